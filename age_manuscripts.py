@@ -0,0 +1,261 @@
+"""
+Command-line batch aging for manuscript images.
+
+Applies the same aging pipeline as the Streamlit app to one or more image
+files and writes the results to an output directory. Optionally prints a
+per-stage performance report, writes a Chrome trace of the run (open it in
+https://ui.perfetto.dev or chrome://tracing) and a cProfile .pstats file.
+
+PNG outputs carry their render plan, so --replay can draw the same marks
+again, on the same page at another resolution or on a different page.
+
+Usage:
+    python age_manuscripts.py page1.png page2.jpg --aging-level heavy --num-marks 20
+    python age_manuscripts.py page.png --seed 7 --trace render.json --profile render.pstats
+    python age_manuscripts.py page_600dpi.png --replay aged_manuscripts/page.png
+    python age_manuscripts.py --calibrate
+    python age_manuscripts.py page.png --budget-ms 300 --report
+    python age_manuscripts.py scans/*.tif --max-seconds 60 --max-memory-mb 2048 --over-limit downscale
+    python age_manuscripts.py scans/*.tif --processes auto
+"""
+
+import argparse
+import os
+import random
+import sys
+from contextlib import ExitStack
+
+import numpy as np
+from PIL import Image
+
+from aging_effects import (CONTRAST_FACTORS, apply_smudges, calibrate_cost_model, estimate_render,
+                           fit_render_size, layer_specs, save_image_with_format)
+from cost_model import COST_MODEL_FILE, check_limits
+from mark_plan import PLAN_METADATA_KEY, dump_plan, load_plan, plan_from_image
+from render_pool import age_images
+from render_stats import collect, format_report, profiled
+
+FORMATS = ['PNG', 'JPEG', 'BMP', 'TIFF']
+
+def process_count(value):
+    """Parse --processes: a number, or 'auto' (None) to fit the machine."""
+    if value == 'auto':
+        return None
+    count = int(value)
+    if count < 1:
+        raise argparse.ArgumentTypeError("must be at least 1, or 'auto'")
+    return count
+
+def build_parser():
+    parser = argparse.ArgumentParser(
+        description="Apply authentic aging effects to manuscript images.")
+    parser.add_argument('inputs', nargs='*', help="Input image files")
+    parser.add_argument('-o', '--output-dir', default='aged_manuscripts',
+                        help="Directory for aged images (default: aged_manuscripts)")
+    parser.add_argument('--aging-level', choices=list(CONTRAST_FACTORS), default=None,
+                        help="light, medium, heavy or extreme (default: medium, or the replayed plan's)")
+    parser.add_argument('--num-marks', type=int, default=15, help="Number of aging marks (1-40)")
+    parser.add_argument('--intensity', type=float, default=None,
+                        help="Mark intensity, 0.2-1.5 (default: 1.0, or the replayed plan's)")
+    parser.add_argument('--format', choices=FORMATS, default='PNG', help="Output format")
+    parser.add_argument('--dpi', type=int, default=300)
+    parser.add_argument('--max-kb', type=int, default=0,
+                        help="Compress each output under this many kB, as the app does (0 = no limit)")
+    parser.add_argument('--seed', type=int, default=None, help="Seed for reproducible marks")
+    parser.add_argument('--replay', metavar='PATH',
+                        help="Render the plan stored in PATH (a plan .json, or a PNG written by "
+                             "this tool) instead of sampling new marks")
+    parser.add_argument('--budget-ms', type=float, default=None,
+                        help="Target render time per image; marks are drawn at lower resolution "
+                             "(or left out) where the cost model says the render would overrun it")
+    parser.add_argument('--calibrate', action='store_true',
+                        help="Time every mark type on this machine and save the cost model used "
+                             "by --budget-ms (cost_model.json)")
+    parser.add_argument('--estimate', action='store_true',
+                        help="Only print each file's estimated render time and peak memory")
+    parser.add_argument('--max-seconds', type=float, default=None,
+                        help="Limit on the estimated render and encode time per image")
+    parser.add_argument('--max-memory-mb', type=float, default=None,
+                        help="Limit on the estimated peak memory per image")
+    parser.add_argument('--over-limit', choices=['refuse', 'downscale'], default='refuse',
+                        help="Skip images whose estimate is over a limit, or render them at the "
+                             "largest size that fits (default: refuse)")
+    parser.add_argument('--report', action='store_true',
+                        help="Print the per-stage timing report for each image")
+    parser.add_argument('--trace', metavar='PATH',
+                        help="Write a Chrome trace of the run (JSON) to PATH")
+    parser.add_argument('--profile', metavar='PATH',
+                        help="Write a cProfile capture of the run (.pstats) to PATH")
+    parser.add_argument('--processes', type=process_count, default=1,
+                        help="Age up to this many images at once in worker processes, passing their "
+                             "pixels through shared memory, as far as memory allows; 'auto' uses "
+                             "one per CPU (default: 1, in this process)")
+    return parser
+
+def read_plan(path):
+    """Read a render plan from a plan JSON file or an image with an embedded plan.
+
+    Returns:
+        Tuple of (list of MarkSpec, settings dict)
+    """
+    if path.lower().endswith('.json'):
+        with open(path) as f:
+            return load_plan(f.read())
+    found = plan_from_image(Image.open(path))
+    if found is None:
+        raise SystemExit(f"error: {path} has no embedded render plan")
+    return found
+
+def preflight(path, args, plan=None):
+    """Estimate one file's job, print the estimate and check it against the limits.
+
+    Returns:
+        Size to render the file at, or None to skip it
+    """
+    size = Image.open(path).size  # Reads the header only
+    estimate = estimate_render(size[0], size[1], args.num_marks, args.aging_level, args.format,
+                               plan=plan)
+    print(f"    estimate: {size[0]}x{size[1]}, {estimate['render_ms'] / 1000:.1f} s render + "
+          f"{estimate['encode_ms'] / 1000:.1f} s {args.format} encode, "
+          f"~{estimate['peak_bytes'] / 2**20:.0f} MB peak")
+    max_peak_bytes = args.max_memory_mb * 2**20 if args.max_memory_mb is not None else None
+    problems = check_limits(estimate, args.max_seconds, max_peak_bytes)
+    if not problems:
+        return size
+    if args.over_limit == 'refuse':
+        print(f"    skipped: {'; '.join(problems)}", file=sys.stderr)
+        return None
+    size = fit_render_size(size[0], size[1], args.num_marks, args.aging_level, args.format,
+                           args.max_seconds, max_peak_bytes, plan=plan)
+    print(f"    downscaled to {size[0]}x{size[1]} to fit the limits")
+    return size
+
+def load_page(path, size=None):
+    """Open an input file, resized to size if given (see preflight)."""
+    image = Image.open(path)
+    if size is not None and size != image.size:
+        image = image.resize(size, Image.LANCZOS)
+    return image
+
+def render_options(args, plan=None):
+    """Return the apply_smudges keyword arguments the command line asks for."""
+    return {
+        'num_smudges': args.num_marks,
+        'intensity': args.intensity,
+        'aging_level': args.aging_level,
+        'plan': plan,
+        'budget_ms': args.budget_ms,
+    }
+
+def write_aged(path, aged, specs, report, args, max_bytes):
+    """Encode an aged page with its plan and write it to the output directory.
+
+    The encode time is added to report. Returns the output path.
+    """
+    metadata = {PLAN_METADATA_KEY: dump_plan(specs, intensity=args.intensity, aging_level=args.aging_level)}
+    with collect() as encode_stats:
+        data, ext = save_image_with_format(aged, args.format, args.dpi, max_bytes=max_bytes,
+                                           metadata=metadata)
+    report['stages']['encode'] = encode_stats.as_dict()['stages']['encode']
+
+    base_name = os.path.splitext(os.path.basename(path))[0]
+    output_path = os.path.join(args.output_dir, f"{base_name}.{ext}")
+    with open(output_path, 'wb') as f:
+        f.write(data)
+    return output_path
+
+def age_file(path, args, max_bytes, plan=None, size=None):
+    """Age one input file and write it to the output directory.
+
+    size, if given, is the size to render at (see preflight).
+
+    Returns:
+        Tuple of (output path, marks used, report dict)
+    """
+    aged, marks_used, report, layers = apply_smudges(load_page(path, size), return_report=True,
+                                                     return_layers=True, **render_options(args, plan))
+    return write_aged(path, aged, layer_specs(layers), report, args, max_bytes), marks_used, report
+
+def print_result(output_path, marks_used, report, args):
+    print(f"    -> {output_path} ({report['total_seconds'] * 1000:.0f} ms)")
+    print(f"    marks: {', '.join(marks_used)}")
+    budget = report['annotations'].get('latency_budget')
+    if budget is not None and budget['degraded'] and not args.report:
+        print(f"    budget {budget['budget_ms']:.0f} ms: {len(budget['degraded'])} marks and effects "
+              f"degraded (--report lists them)")
+    if args.report:
+        print('    ' + format_report(report).replace('\n', '\n    '))
+
+def main(argv=None):
+    parser = build_parser()
+    args = parser.parse_args(argv)
+    if args.calibrate:
+        model = calibrate_cost_model(path=COST_MODEL_FILE)
+        print(f"✓ Cost model for {len(model.mark_costs)} mark types written to {COST_MODEL_FILE}")
+        if not args.inputs:
+            return 0
+    if not args.inputs:
+        parser.error("no input files")
+    if args.processes != 1 and (args.trace or args.profile):
+        parser.error("--trace and --profile record this process only; use them with --processes 1")
+
+    plan = None
+    settings = {}
+    if args.replay:
+        plan, settings = read_plan(args.replay)
+    if args.aging_level is None:
+        args.aging_level = settings.get('aging_level', 'medium')
+    if args.intensity is None:
+        args.intensity = settings.get('intensity', 1.0)
+
+    if args.seed is not None:
+        random.seed(args.seed)
+        np.random.seed(args.seed)
+    if not args.estimate:
+        os.makedirs(args.output_dir, exist_ok=True)
+    max_bytes = args.max_kb * 1024 if args.max_kb > 0 else float('inf')
+
+    with ExitStack() as stack:
+        trace_stats = stack.enter_context(collect(trace=True)) if args.trace else None
+        profile = stack.enter_context(profiled()) if args.profile else None
+
+        skipped = 0
+        jobs = []
+        for index, path in enumerate(args.inputs, 1):
+            print(f"[{index}/{len(args.inputs)}] {path}")
+            size = preflight(path, args, plan)
+            if size is None:
+                skipped += 1
+                continue
+            if args.estimate:
+                continue
+            if args.processes != 1:
+                jobs.append((index, path, size))
+                continue
+            output_path, marks_used, report = age_file(path, args, max_bytes, plan, size)
+            print_result(output_path, marks_used, report, args)
+
+        if jobs:
+            # Pages are loaded as the pool admits them and encoded here as they come back
+            pages = (load_page(path, size) for _, path, size in jobs)
+            results = age_images(pages, args.processes, **render_options(args, plan))
+            for (index, path, _), result in zip(jobs, results):
+                output_path = write_aged(path, result['image'], result['plan'], result['report'],
+                                         args, max_bytes)
+                print(f"[{index}/{len(args.inputs)}] {path}")
+                print_result(output_path, result['marks_used'], result['report'], args)
+
+    if trace_stats is not None:
+        with open(args.trace, 'wb') as f:
+            f.write(trace_stats.chrome_trace_json())
+        print(f"✓ Trace written to {args.trace}")
+    if profile is not None:
+        profile.dump(args.profile)
+        print(f"✓ Profile written to {args.profile}")
+    if skipped:
+        print(f"{skipped} of {len(args.inputs)} images skipped for exceeding the limits", file=sys.stderr)
+        return 1
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
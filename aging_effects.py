@@ -0,0 +1,2896 @@
+"""
+Rendering engine for the Ancient Manuscript Authenticator.
+Mark generators, preference handling, compositing and export helpers live here
+so they can be imported without starting the Streamlit UI.
+"""
+
+import numpy as np
+from PIL import Image, ImageDraw, ImageFilter, ImageEnhance, PngImagePlugin
+import io
+import random
+import math
+import json
+import os
+import time
+import tracemalloc
+import contextvars
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+from cost_model import (COST_MODEL_FILE, DEFAULT_UPSAMPLE_MS_PER_MP, SCALE_STEPS, CostModel,
+                        check_limits, fit_linear, fit_memory, load_cost_model, save_cost_model)
+from mark_plan import MarkSpec
+from noise_bank import fbm_field, noise_field
+from page_geometry import border_boxes, centre_distance, edge_distance, pixel_grid
+from render_stats import span, count, collect, traced, annotate
+from soft_shapes import feather
+from stamp_atlas import ATLAS_VARIANTS, disc, stamp
+
+# Preferences file path
+PREFERENCES_FILE = "user_preferences.json"
+
+def load_preferences():
+    """Load user mark type preferences from file."""
+    default_prefs = {
+        'blob': 1.0,
+        'water_stain': 1.0,
+        'fingerprint': 1.0,
+        'dust': 1.0,
+        'streak': 1.0,
+        'bleeding_ink': 1.0,
+        'faded_ink': 1.0,
+        'smudged_calligraphy': 1.0,
+        'moisture_damage': 1.0,
+        'soot_stain': 1.0,
+        'atmospheric_grime': 1.0,
+        'coffee_mark': 1.0,
+        'muddy_mark': 1.0,
+        'heavy_ink_blotch': 1.0,
+        'age_rings': 1.0,
+        'ink_halo': 1.0,
+        'foxing_spots': 1.0,
+        'uneven_fading': 1.0,
+        'text_area_smudge': 1.0,
+        'rust_stains': 1.0,
+        'dark_damage': 1.0
+    }
+    
+    if os.path.exists(PREFERENCES_FILE):
+        try:
+            with open(PREFERENCES_FILE, 'r') as f:
+                prefs = json.load(f)
+                # Merge with defaults to handle new mark types
+                default_prefs.update(prefs)
+                return default_prefs
+        except:
+            return default_prefs
+    return default_prefs
+
+def save_preferences(preferences):
+    """Save user preferences to file."""
+    with open(PREFERENCES_FILE, 'w') as f:
+        json.dump(preferences, f, indent=2)
+
+def adjust_preferences(mark_types_used, liked):
+    """Adjust mark type weights based on user feedback."""
+    preferences = load_preferences()
+    
+    # Adjust weights for used mark types
+    for mark_type in mark_types_used:
+        if mark_type in preferences:
+            if liked:
+                preferences[mark_type] *= 1.3  # Increase by 30% if liked
+            else:
+                preferences[mark_type] *= 0.7  # Decrease by 30% if disliked
+                preferences[mark_type] = max(0.1, preferences[mark_type])  # Minimum 0.1
+    
+    # Normalize so they average to 1.0
+    avg_pref = sum(preferences.values()) / len(preferences)
+    preferences = {k: v / avg_pref for k, v in preferences.items()}
+    
+    save_preferences(preferences)
+    return preferences
+
+def generate_similar_images(image, liked_marks, num_variations=3, num_smudges=8, intensity=0.7, aging_level='medium'):
+    """
+    Generate multiple variations biased toward the liked mark types.
+    
+    Args:
+        image: Original PIL Image
+        liked_marks: List of mark types the user liked
+        num_variations: How many similar images to generate
+        num_smudges: Number of marks per image
+        intensity: Mark intensity
+        aging_level: Aging level setting
+    
+    Returns:
+        List of (processed_image, marks_used) tuples
+    """
+    from render_pool import age_images  # render_pool imports this module
+
+    # Boost preferences for liked marks; they are passed to each render, the saved ones stay as they are
+    boosted = load_preferences().copy()
+    for mark in liked_marks:
+        if mark in boosted:
+            boosted[mark] *= 3.0  # Triple the weight for liked types
+    
+    # Normalize
+    avg = sum(boosted.values()) / len(boosted)
+    boosted = {k: v / avg for k, v in boosted.items()}
+    
+    # The variations are independent renders, so they run side by side where the machine allows
+    results = age_images([image] * num_variations, num_smudges=num_smudges, intensity=intensity,
+                         aging_level=aging_level, preferences=boosted)
+    return [(result['image'], result['marks_used']) for result in results]
+
+def numpy_rng(rng):
+    """Return the NumPy random source that goes with a generator's rng.
+
+    The default, the random module itself, maps to the global np.random so
+    seeding both still reproduces a render. A random.Random instance yields a
+    RandomState seeded from it, so a seeded mark is fully reproducible.
+    """
+    if rng is random:
+        return np.random
+    return np.random.RandomState(rng.getrandbits(32))
+
+def blur_mask(mask, radius):
+    """Gaussian-blur a mask, timed under the 'blur' stage."""
+    with span('blur'):
+        return mask.filter(ImageFilter.GaussianBlur(radius=radius))
+
+# Heavily blurred marks are drawn on a reduced canvas and upsampled: the blur
+# removes all detail finer than its radius, so the canvas only needs enough
+# pixels for the blur to keep this many pixels of radius
+SYNTHESIS_BLUR_RADIUS = 12.0
+
+# Filled polygons cover the pixels their outline touches, which grows a shape
+# by about this many pixels all round; at reduced scale the points are pulled
+# in by as much so small shapes keep their area
+POLYGON_DILATION = 0.4
+
+# How SoftShapes turns a mark's shapes into its blurred mask (see MarkType.rasterizer)
+RASTERIZERS = ('polygon', 'sdf')
+
+# Polygon points for a turned ellipse
+ELLIPSE_POINTS = 32
+
+# Grid pixels per unit of spread that page-scale stain fields are evaluated on
+SEEP_RESOLUTION = 100
+
+def synthesis_canvas(canvas_size, blur_radius):
+    """Return (drawing size, scale) for a canvas_size mask blurred by blur_radius.
+
+    Draw with coordinates computed at full size and mapped by to_synthesis,
+    blur by blur_radius * scale, then bring the mask back with
+    finish_synthesis before anything that adds sharp detail, such as a
+    rotation.
+    """
+    scale = min(1.0, SYNTHESIS_BLUR_RADIUS / blur_radius) if blur_radius > 0 else 1.0
+    draw_size = max(1, round(canvas_size * scale))
+    return draw_size, draw_size / canvas_size
+
+def to_synthesis(coord, scale):
+    """Map a full-size pixel coordinate onto a canvas drawn at scale.
+
+    Pixel centres line up the way the upsampling in finish_synthesis expects.
+    """
+    return (coord + 0.5) * scale - 0.5
+
+def finish_synthesis(mask, canvas_size):
+    """Upsample a mask drawn by synthesis_canvas back to canvas_size."""
+    if mask.width == canvas_size:
+        return mask
+    return _upsample_mask(mask, (canvas_size, canvas_size))
+
+def page_canvas(width, height, blur_radius):
+    """Return (drawing width, drawing height, scale) for a page mask blurred by blur_radius.
+
+    The full-page counterpart of synthesis_canvas: draw at scale, blur by
+    blur_radius * scale, and upsample to width x height with _upsample_mask.
+    """
+    scale = min(1.0, SYNTHESIS_BLUR_RADIUS / blur_radius) if blur_radius > 0 else 1.0
+    return max(1, round(width * scale)), max(1, round(height * scale)), scale
+
+def finish_page(mask, width, height, blur_radius, scale):
+    """Blur a uint8 array drawn by page_canvas and bring it back to width x height."""
+    mask = blur_mask(Image.fromarray(mask), blur_radius * scale)
+    if mask.size == (width, height):
+        return mask
+    return _upsample_mask(mask, (width, height))
+
+def seep_region(canvas, scale, centre, spread, reach, rng):
+    """Return the noise fields of a stain seeping out from centre on a page canvas.
+
+    Stains are drawn as fields over distance instead of stacks of blobs: the
+    distance to centre is warped by coarse fractal noise, so the stain's outline
+    wanders, and a finer fractal field gives the blotchy pooling inside it. The
+    fields have no detail finer than a fraction of the spread, so they are
+    evaluated on a grid of SEEP_RESOLUTION pixels per spread whatever the page
+    size, and paste_region resizes the result onto the canvas.
+
+    Args:
+        canvas: 2-D uint8 array drawn at scale (see page_canvas)
+        scale: Canvas scale
+        centre: (x, y) the stain spreads from, in full-size pixels
+        spread: Distance, in full-size pixels, that counts as 1
+        reach: Largest distance, in units of spread, the caller draws out to
+        rng: np.random or a RandomState
+
+    Returns:
+        (window, distance, warped, pools), or None if the stain misses the
+        canvas. window is the slice pair of canvas the grid covers; distance
+        and warped are the plain and warped distance of each grid pixel, in
+        units of spread, and pools is fractal noise spread over [0, 1]
+    """
+    height, width = canvas.shape
+    extent = spread * reach
+    x0 = max(0, math.floor((centre[0] - extent) * scale))
+    y0 = max(0, math.floor((centre[1] - extent) * scale))
+    x1 = min(width, math.ceil((centre[0] + extent) * scale))
+    y1 = min(height, math.ceil((centre[1] + extent) * scale))
+    if x0 >= x1 or y0 >= y1:
+        return None
+    # Grid pixel centres in full-size coordinates, as offsets from centre
+    pitch = spread / SEEP_RESOLUTION
+    grid_w = max(2, math.ceil((x1 - x0) / scale / pitch))
+    grid_h = max(2, math.ceil((y1 - y0) / scale / pitch))
+    dx = (x0 + (np.arange(grid_w, dtype=np.float32) + 0.5) * (x1 - x0) / grid_w) / scale - centre[0]
+    dy = (y0 + (np.arange(grid_h, dtype=np.float32) + 0.5) * (y1 - y0) / grid_h) / scale - centre[1]
+    distance = np.sqrt(dx[np.newaxis, :] ** 2 + dy[:, np.newaxis] ** 2) / np.float32(spread)
+    warp = fbm_field(grid_w, grid_h, 0.35 * SEEP_RESOLUTION, gain=0.6, rng=rng) - 0.5
+    pools = fbm_field(grid_w, grid_h, 0.15 * SEEP_RESOLUTION, rng=rng)
+    # fBm clusters around 0.5; stretch it so pools run from dry to saturated
+    pools = np.clip((pools - 0.5) * 3.0 + 0.5, 0.0, 1.0)
+    return np.s_[y0:y1, x0:x1], distance, distance * (1.0 + 1.2 * warp), pools
+
+def paste_region(canvas, window, values):
+    """Resize a field from seep_region onto its canvas window, keeping the maximum."""
+    region = Image.fromarray(np.clip(values, 0, 255).astype(np.uint8))
+    target = canvas[window]
+    region = np.asarray(region.resize((target.shape[1], target.shape[0]), Image.BILINEAR))
+    np.maximum(target, region, out=target)
+
+def draw_border(width, height, boxes, draw, blur=0):
+    """Draw a page effect box by box and return its parts as (uint8 mask, (left, top)).
+
+    draw(left, top, right, bottom) returns the effect's unblurred uint8
+    values over a box. Each box is drawn with enough margin around it that
+    blurring it box by box matches blurring the whole page; the boxes must
+    hold every pixel the blurred effect reaches (see page_geometry.border_boxes).
+    """
+    margin = math.ceil(3 * blur) + 2 if blur else 0
+    parts = []
+    for left, top, right, bottom in boxes:
+        x0, y0 = max(0, left - margin), max(0, top - margin)
+        x1, y1 = min(width, right + margin), min(height, bottom + margin)
+        mask = draw(x0, y0, x1, y1)
+        if blur:
+            mask = np.asarray(blur_mask(Image.fromarray(mask), blur))
+        parts.append((mask[top - y0:bottom - y0, left - x0:right - x0], (left, top)))
+    return parts
+
+def ramp(values, start, stop, blur=0.0):
+    """Return values mapped linearly from 1 at start to 0 at stop, clipped to [0, 1].
+
+    blur widens the ramp about its midpoint about as much as a Gaussian blur
+    of that standard deviation, in the same units, would.
+    """
+    middle = (start + stop) / 2.0
+    width = math.hypot(stop - start, 2.5 * blur)
+    return np.clip((middle - values) / width + 0.5, 0.0, 1.0)
+
+def tide_line(warped, pools, position, width, strength, blur=0.0):
+    """Return a broken tide line along warped distance position; gaps fall where pools is low.
+
+    blur widens the line as a Gaussian blur of that standard deviation would,
+    keeping its mass.
+    """
+    sigma = math.hypot(width / math.sqrt(2.0), blur)
+    band = np.exp(-0.5 * ((warped - position) / sigma) ** 2)
+    return band * np.clip((pools - 0.2) / 0.3, 0.0, 1.0) * (strength * width / math.sqrt(2.0) / sigma)
+
+def irregular_outline(bbox, num_points=None, rng=random):
+    """Sample the outline of an irregular, organic shape for bbox.
+
+    Uses many control points with strong randomised wobble, random aspect
+    ratio skew, and per-point jitter so no two shapes look alike.
+
+    Returns:
+        Tuple (cx, cy, rx, ry, rotation, angles, radii): centre, semi-axes
+        after the aspect skew, rotation, and each control point's angle and
+        radius factor. A bbox too small for wobble gives a plain ellipse
+        (rotation 0, one radius factor of 1) and draws no random numbers.
+    """
+    x0, y0, x1, y1 = bbox
+    cx = (x0 + x1) / 2.0
+    cy = (y0 + y1) / 2.0
+    rx = (x1 - x0) / 2.0
+    ry = (y1 - y0) / 2.0
+    
+    if rx < 3 or ry < 3:
+        return cx, cy, rx, ry, 0.0, (0.0,), (1.0,)
+    
+    # Randomise aspect ratio so shapes are never perfectly round/square
+    aspect_skew = rng.uniform(0.55, 1.45)
+    rx *= aspect_skew
+    ry *= (2.0 - aspect_skew)  # inverse stretch on other axis
+    
+    if num_points is None:
+        num_points = rng.randint(18, 32)  # more points = smoother organic edge
+    
+    # Multiple harmonics for complex wobble
+    num_harmonics = rng.randint(3, 5)
+    freqs = [rng.uniform(1.0, 6.0) for _ in range(num_harmonics)]
+    phases = [rng.uniform(0, 6.28) for _ in range(num_harmonics)]
+    amps = [rng.uniform(0.06, 0.22) for _ in range(num_harmonics)]
+    
+    # Optional rotation of the whole shape
+    rot = rng.uniform(0, 6.28)
+    
+    angles = []
+    radii = []
+    step = 6.2831853 / num_points
+    for i in range(num_points):
+        a = step * i + rng.uniform(-0.25, 0.25)  # stronger angular jitter
+        # Sum multiple harmonics
+        r = 1.0
+        for h in range(num_harmonics):
+            r += amps[h] * math.sin(freqs[h] * a + phases[h])
+        # Per-point random jitter
+        r *= rng.uniform(0.72, 1.22)
+        angles.append(a)
+        radii.append(max(0.3, min(r, 1.5)))
+    return cx, cy, rx, ry, rot, angles, radii
+
+def rotate_outline(outline, angle, pivot):
+    """Turn an irregular_outline by angle degrees about pivot (x, y).
+
+    The turn matches Image.rotate: counter-clockwise on screen, about the
+    canvas centre when pivot is ((size - 1) / 2, (size - 1) / 2).
+    """
+    cx, cy, rx, ry, rot, angles, radii = outline
+    theta = math.radians(angle)
+    cos_t = math.cos(theta)
+    sin_t = math.sin(theta)
+    dx = cx - pivot[0]
+    dy = cy - pivot[1]
+    return (pivot[0] + dx * cos_t + dy * sin_t, pivot[1] - dx * sin_t + dy * cos_t,
+            rx, ry, rot - theta, angles, radii)
+
+def fill_outline(draw, outline, fill, scale=1.0):
+    """Fill an irregular_outline as a polygon, with its coordinates mapped to scale.
+
+    The outline is computed at full size (see synthesis_canvas), so it is the
+    same shape at any drawing scale.
+    """
+    cx, cy, rx, ry, rot, angles, radii = outline
+    if len(angles) == 1:
+        if rot == 0.0 or rx == ry:
+            draw.ellipse([to_synthesis(c, scale) for c in (cx - rx, cy - ry, cx + rx, cy + ry)], fill=fill)
+            return
+        # A turned ellipse has no ImageDraw primitive; fill it as a polygon
+        angles = [6.2831853 * i / ELLIPSE_POINTS for i in range(ELLIPSE_POINTS)]
+        radii = [1.0] * ELLIPSE_POINTS
+    cos_rot = math.cos(rot)
+    sin_rot = math.sin(rot)
+    
+    # Radial pull-in that offsets polygon fill growth on a reduced canvas
+    shrink = POLYGON_DILATION / scale if scale < 1.0 else 0.0
+
+    points = []
+    for a, r in zip(angles, radii):
+        # Local coordinates
+        lx = rx * r * math.cos(a)
+        ly = ry * r * math.sin(a)
+        if shrink:
+            length = math.hypot(lx, ly)
+            pull = max(0.0, length - shrink) / length if length else 0.0
+            lx *= pull
+            ly *= pull
+        # Apply rotation
+        px = cx + lx * cos_rot - ly * sin_rot
+        py = cy + lx * sin_rot + ly * cos_rot
+        points.append((to_synthesis(px, scale), to_synthesis(py, scale)))
+    draw.polygon(points, fill=fill)
+
+def draw_irregular_shape(draw, bbox, fill=None, outline=None, width=1, num_points=None, rng=random,
+                         scale=1.0, angle=0, pivot=None):
+    """Draw an irregular, organic shape instead of a perfect ellipse.
+    Only filled shapes are drawn — outline parameter is accepted but ignored
+    to prevent geometric semi-circle artefacts. The shape is computed for
+    bbox and drawn with its coordinates mapped to scale (see
+    synthesis_canvas), so it is the same shape at any drawing scale. A
+    non-zero angle turns it by that many degrees about pivot (default: its
+    own centre; see rotate_outline).
+    """
+    shape = irregular_outline(bbox, num_points, rng)
+    if angle:
+        shape = rotate_outline(shape, angle, pivot or shape[:2])
+    if fill is not None:
+        fill_outline(draw, shape, fill, scale)
+
+class SoftShapes:
+    """The irregular shapes of one mask, filled in order and softened by a Gaussian blur.
+
+    Generators add shapes as they sample them and call render() once. The
+    'polygon' rasterizer fills each outline and blurs the canvas by each of
+    blur_radii in turn, on the reduced synthesis canvas if synthesis is set;
+    'sdf' computes the blurred result straight from the outlines
+    (soft_shapes.feather), always on the synthesis canvas. Both draw the same
+    random numbers, so a seeded mark keeps its layout under either. The mask
+    comes back at full size. A random turn of the whole mark is applied to
+    the outlines by render(), so no rotated raster (and no clipped corners)
+    is needed.
+    """
+
+    __slots__ = ('canvas_size', 'blur_radii', 'rasterizer', 'synthesis', 'shapes')
+
+    def __init__(self, canvas_size, blur_radii, rasterizer='polygon', synthesis=False):
+        if rasterizer not in RASTERIZERS:
+            raise ValueError(f"unknown rasterizer: {rasterizer!r}")
+        self.canvas_size = canvas_size
+        self.blur_radii = tuple(blur_radii)
+        self.rasterizer = rasterizer
+        self.synthesis = synthesis
+        self.shapes = []
+
+    def add(self, bbox, fill, rng=random):
+        """Add an irregular shape for bbox (see irregular_outline)."""
+        self.shapes.append((irregular_outline(bbox, rng=rng), fill))
+
+    def add_ellipse(self, bbox, fill):
+        """Add a plain ellipse filling bbox."""
+        x0, y0, x1, y1 = bbox
+        self.shapes.append((((x0 + x1) / 2.0, (y0 + y1) / 2.0, (x1 - x0) / 2.0, (y1 - y0) / 2.0,
+                             0.0, (0.0,), (1.0,)), fill))
+
+    def render(self, angle=0):
+        """Return the blurred mask as a canvas_size square 'L' image, turned by angle degrees.
+
+        The turn matches Image.rotate about the canvas centre.
+        """
+        shapes = self.shapes
+        if angle:
+            pivot = ((self.canvas_size - 1) / 2.0, (self.canvas_size - 1) / 2.0)
+            shapes = [(rotate_outline(outline, angle, pivot), fill) for outline, fill in shapes]
+        if self.rasterizer == 'sdf':
+            # Successive blurs add up to one of the root-sum-square radius
+            sigma = math.sqrt(sum(radius * radius for radius in self.blur_radii))
+            draw_size, scale = synthesis_canvas(self.canvas_size, sigma)
+            with span('feather'):
+                mask = feather(shapes, draw_size, sigma, scale)
+            mask = Image.fromarray(np.clip(mask + 0.5, 0, 255).astype(np.uint8))
+        else:
+            if self.synthesis:
+                draw_size, scale = synthesis_canvas(self.canvas_size, self.blur_radii[0])
+            else:
+                draw_size, scale = self.canvas_size, 1.0
+            mask = Image.new('L', (draw_size, draw_size), 0)
+            draw = ImageDraw.Draw(mask)
+            for outline, fill in shapes:
+                fill_outline(draw, outline, fill, scale)
+            for radius in self.blur_radii:
+                mask = blur_mask(mask, radius * scale)
+        return finish_synthesis(mask, self.canvas_size)
+
+def irregular_dot(draw, bbox, fill, rng):
+    """Sprite shape for stamp_atlas.stamp: a small draw_irregular_shape."""
+    draw_irregular_shape(draw, bbox, fill=fill, rng=rng)
+
+@traced
+def create_organic_blob(size, irregularity=0.3, rng=random, rasterizer='polygon'):
+    """Create an organic, irregular blob-shaped smudge with varied aspect ratios."""
+    np_rng = numpy_rng(rng)
+    canvas_size = int(size * 2.5)
+    shapes = SoftShapes(canvas_size, (size * 0.20, size * 0.12), rasterizer)
+    
+    center = canvas_size // 2
+    num_circles = rng.randint(10, 20)
+    
+    for _ in range(num_circles):
+        offset_x = rng.randint(-int(size * irregularity * 1.3), int(size * irregularity * 1.3))
+        offset_y = rng.randint(-int(size * irregularity * 1.3), int(size * irregularity * 1.3))
+        # Randomise width and height independently for non-circular sub-shapes
+        radius_x = rng.randint(int(size * 0.2), int(size * 0.8))
+        radius_y = rng.randint(int(size * 0.15), int(size * 0.7))
+        
+        x0 = center + offset_x - radius_x
+        y0 = center + offset_y - radius_y
+        x1 = center + offset_x + radius_x
+        y1 = center + offset_y + radius_y
+        
+        opacity = rng.randint(60, 160)
+        shapes.add([x0, y0, x1, y1], opacity, rng)
+    
+    # Random rotation so blob is never axis-aligned
+    angle = rng.randint(0, 360)
+    smudge = shapes.render(angle)
+    
+    smudge_array = np.array(smudge)
+    noise = noise_field(smudge_array.shape[1], smudge_array.shape[0], -25, 25, rng=np_rng)
+    smudge_array = np.clip(smudge_array.astype(int) + noise, 0, 255).astype(np.uint8)
+    return Image.fromarray(smudge_array)
+
+@traced
+def create_water_stain(size, rng=random, rasterizer='polygon'):
+    """Create a water stain with wick/tide-line effect — darker concentrated
+    borders where liquid evaporated, semi-transparent interior, and variable
+    opacity zones (dense opaque areas + ghost regions)."""
+    canvas_size = int(size * 3.0)
+    shapes = SoftShapes(canvas_size, (size * 0.22,), rasterizer)
+    
+    center = canvas_size // 2
+    
+    # --- 1. Build interior fill: variable transparency pools ---
+    num_pools = rng.randint(6, 14)
+    for i in range(num_pools):
+        pool_rx = rng.randint(int(size * 0.20), int(size * 0.85))
+        pool_ry = rng.randint(int(size * 0.15), int(size * 0.80))
+        
+        for _ in range(rng.randint(3, 6)):
+            offset_x = rng.randint(-int(size * 0.55), int(size * 0.55))
+            offset_y = rng.randint(-int(size * 0.55), int(size * 0.55))
+            
+            # Variable transparency: some pools are dense/opaque, others are ghost-faint
+            if rng.random() < 0.3:
+                # Dense opaque region — obscures text
+                opacity = rng.randint(120, 200)
+            elif rng.random() < 0.5:
+                # Medium — text partially visible
+                opacity = rng.randint(55, 119)
+            else:
+                # Ghost stain — text remains visible
+                opacity = rng.randint(18, 54)
+            
+            x0 = center + offset_x - pool_rx
+            y0 = center + offset_y - pool_ry
+            x1 = center + offset_x + pool_rx
+            y1 = center + offset_y + pool_ry
+            
+            shapes.add([x0, y0, x1, y1], opacity, rng)
+    
+    # --- 2. Wick / tide-line effect: scattered filled blobs along the perimeter ---
+    # (Using filled blobs instead of outline rings to avoid geometric semi-circle appearance)
+    num_tide_blobs = rng.randint(30, 70)
+    for _ in range(num_tide_blobs):
+        # Place blobs in a band around the stain perimeter
+        tide_angle = rng.uniform(0, 6.28)
+        tide_rx = rng.randint(int(size * 0.55), int(size * 1.1))
+        tide_ry = rng.randint(int(size * 0.45), int(size * 1.0))
+        # Scatter along the perimeter with some variance
+        tide_dist_x = tide_rx * (1.0 + rng.gauss(0, 0.12))
+        tide_dist_y = tide_ry * (1.0 + rng.gauss(0, 0.12))
+        tx = int(center + tide_dist_x * math.cos(tide_angle))
+        ty = int(center + tide_dist_y * math.sin(tide_angle))
+        # Small filled blobs for the tide line
+        tr_x = rng.randint(max(2, int(size * 0.02)), max(4, int(size * 0.08)))
+        tr_y = rng.randint(max(2, int(size * 0.02)), max(4, int(size * 0.07)))
+        tide_opacity = rng.randint(100, 200)
+        if 0 < tx < canvas_size and 0 < ty < canvas_size:
+            shapes.add([tx - tr_x, ty - tr_y, tx + tr_x, ty + tr_y], tide_opacity, rng)
+    
+    # --- 3. Spatter dots around the stain edges ---
+    num_droplets = rng.randint(8, 25)
+    for _ in range(num_droplets):
+        angle = rng.uniform(0, 6.28)
+        dist = rng.gauss(size * 0.8, size * 0.3)
+        dx = int(center + dist * math.cos(angle))
+        dy = int(center + dist * math.sin(angle))
+        dot_r = rng.randint(1, max(2, int(size * 0.04)))
+        dot_opacity = rng.randint(80, 190)
+        if 0 < dx < canvas_size and 0 < dy < canvas_size:
+            shapes.add([dx - dot_r, dy - dot_r, dx + dot_r, dy + dot_r], dot_opacity, rng)
+    
+    # Random rotation for unique orientation
+    angle = rng.randint(0, 360)
+    stain = shapes.render(angle)
+    return stain
+
+@traced
+def create_bleeding_ink(size, rng=random, rasterizer='polygon'):
+    """Create a soft, feathered ink bleed."""
+    canvas_size = int(size * 2.2)
+    shapes = SoftShapes(canvas_size, (size * 0.30, size * 0.15), rasterizer, synthesis=True)
+
+    center = canvas_size // 2
+    num_blobs = rng.randint(8, 16)
+
+    for _ in range(num_blobs):
+        offset_x = rng.randint(-int(size * 0.6), int(size * 0.6))
+        offset_y = rng.randint(-int(size * 0.6), int(size * 0.6))
+        radius_x = rng.randint(int(size * 0.2), int(size * 0.85))
+        radius_y = rng.randint(int(size * 0.15), int(size * 0.75))
+
+        x0 = center + offset_x - radius_x
+        y0 = center + offset_y - radius_y
+        x1 = center + offset_x + radius_x
+        y1 = center + offset_y + radius_y
+
+        opacity = rng.randint(50, 130)
+        shapes.add([x0, y0, x1, y1], opacity, rng)
+
+    angle = rng.randint(0, 360)
+    bleed = shapes.render(angle)
+    return bleed
+
+@traced
+def create_coffee_ring(size, rng=random, rasterizer='polygon'):
+    """Create a coffee ring stain with a darker edge."""
+    canvas_size = int(size * 2.6)
+    shapes = SoftShapes(canvas_size, (size * 0.25,), rasterizer)
+
+    center = canvas_size // 2
+    outer_x = int(size * rng.uniform(0.9, 1.3))
+    outer_y = int(size * rng.uniform(0.7, 1.2))
+    inner_x = int(outer_x * rng.uniform(0.5, 0.75))
+    inner_y = int(outer_y * rng.uniform(0.5, 0.75))
+
+    for _ in range(rng.randint(6, 12)):
+        jitter_x = rng.randint(-size // 3, size // 3)
+        jitter_y = rng.randint(-size // 3, size // 3)
+
+        shapes.add([center + jitter_x - outer_x, center + jitter_y - outer_y,
+                    center + jitter_x + outer_x, center + jitter_y + outer_y],
+                   rng.randint(50, 120), rng)
+        shapes.add([center + jitter_x - inner_x, center + jitter_y - inner_y,
+                    center + jitter_x + inner_x, center + jitter_y + inner_y],
+                   rng.randint(10, 45), rng)
+
+    angle = rng.randint(0, 360)
+    ring = shapes.render(angle)
+    return ring
+
+@traced
+def create_soot_stain(size, rng=random, rasterizer='polygon'):
+    """Create a smoky soot stain."""
+    canvas_size = int(size * 2.4)
+    shapes = SoftShapes(canvas_size, (size * 0.40,), rasterizer, synthesis=True)
+
+    center = canvas_size // 2
+    num_clouds = rng.randint(12, 24)
+
+    for _ in range(num_clouds):
+        offset_x = rng.randint(-int(size * 0.8), int(size * 0.8))
+        offset_y = rng.randint(-int(size * 0.8), int(size * 0.8))
+        radius_x = rng.randint(int(size * 0.15), int(size * 0.6))
+        radius_y = rng.randint(int(size * 0.1), int(size * 0.55))
+        opacity = rng.randint(35, 90)
+
+        x0 = center + offset_x - radius_x
+        y0 = center + offset_y - radius_y
+        x1 = center + offset_x + radius_x
+        y1 = center + offset_y + radius_y
+
+        shapes.add([x0, y0, x1, y1], opacity, rng)
+
+    angle = rng.randint(0, 360)
+    soot = shapes.render(angle)
+    return soot
+
+@traced
+def create_heavy_ink_blotch(size, rng=random, rasterizer='polygon'):
+    """Create a large, irregular ink blotch with variable transparency,
+    darker wick borders, and splatter droplets around the edges."""
+    canvas_size = int(size * 2.8)
+    shapes = SoftShapes(canvas_size, (size * 0.22,), rasterizer)
+
+    center = canvas_size // 2
+    base_radius = max(1, int(size * 0.9))
+
+    # Core blob with variable transparency
+    for _ in range(rng.randint(12, 22)):
+        offset_x = rng.randint(-int(size * 0.6), int(size * 0.6))
+        offset_y = rng.randint(-int(size * 0.6), int(size * 0.6))
+        radius_x = rng.randint(int(base_radius * 0.3), int(base_radius * 0.95))
+        radius_y = rng.randint(int(base_radius * 0.25), int(base_radius * 0.9))
+        # Variable transparency — safe with multiply blend
+        if rng.random() < 0.35:
+            opacity = rng.randint(170, 245)  # dense core
+        elif rng.random() < 0.5:
+            opacity = rng.randint(90, 169)   # semi-transparent
+        else:
+            opacity = rng.randint(30, 89)    # ghost stain
+
+        shapes.add([center + offset_x - radius_x, center + offset_y - radius_y,
+                    center + offset_x + radius_x, center + offset_y + radius_y],
+                   opacity, rng)
+
+    # Wick effect: scattered filled blobs along the border (not outline rings)
+    num_wick_blobs = rng.randint(25, 55)
+    for _ in range(num_wick_blobs):
+        wick_angle = rng.uniform(0, 6.28)
+        wick_rx = base_radius * rng.uniform(0.75, 1.3)
+        wick_ry = base_radius * rng.uniform(0.65, 1.2)
+        wx = int(center + wick_rx * math.cos(wick_angle) * (1.0 + rng.gauss(0, 0.1)))
+        wy = int(center + wick_ry * math.sin(wick_angle) * (1.0 + rng.gauss(0, 0.1)))
+        wr_x = rng.randint(max(2, int(size * 0.02)), max(4, int(size * 0.07)))
+        wr_y = rng.randint(max(2, int(size * 0.015)), max(4, int(size * 0.06)))
+        wick_opacity = rng.randint(120, 220)
+        if 0 < wx < canvas_size and 0 < wy < canvas_size:
+            shapes.add([wx - wr_x, wy - wr_y, wx + wr_x, wy + wr_y], wick_opacity, rng)
+
+    # Splatter droplets — small dots scattered around the stain edges
+    for _ in range(rng.randint(15, 35)):
+        angle = rng.uniform(0, 6.28)
+        dist = rng.gauss(base_radius * 1.1, base_radius * 0.3)
+        dot_x = int(center + dist * math.cos(angle))
+        dot_y = int(center + dist * math.sin(angle))
+        dot_size = rng.randint(1, max(2, int(size * 0.04)))
+        opacity = rng.randint(80, 200)
+        if 0 < dot_x < canvas_size and 0 < dot_y < canvas_size:
+            shapes.add([dot_x - dot_size, dot_y - dot_size, dot_x + dot_size, dot_y + dot_size], opacity, rng)
+
+    angle = rng.randint(0, 360)
+    blot = shapes.render(angle)
+    return blot
+
+@traced
+def create_atmospheric_grime(size, rng=random, rasterizer='polygon'):
+    """Create a diffuse grime patch with soft texture."""
+    canvas_size = int(size * 2.4)
+    shapes = SoftShapes(canvas_size, (size * 0.35,), rasterizer)
+
+    center = canvas_size // 2
+    num_spots = rng.randint(15, 28)
+
+    for _ in range(num_spots):
+        offset_x = rng.randint(-int(size * 0.9), int(size * 0.9))
+        offset_y = rng.randint(-int(size * 0.9), int(size * 0.9))
+        radius_x = rng.randint(int(size * 0.12), int(size * 0.55))
+        radius_y = rng.randint(int(size * 0.10), int(size * 0.50))
+        opacity = rng.randint(25, 80)
+
+        x0 = center + offset_x - radius_x
+        y0 = center + offset_y - radius_y
+        x1 = center + offset_x + radius_x
+        y1 = center + offset_y + radius_y
+
+        shapes.add([x0, y0, x1, y1], opacity, rng)
+
+    angle = rng.randint(0, 360)
+    grime = shapes.render(angle)
+    return grime
+
+@traced
+def create_torn_paper_edge(width, height, rng=random):
+    """Create torn/ragged paper edges along document borders. Fast numpy version.
+    Only the border band is drawn: returns the parts (see draw_border) of a
+    mask that is dark where the paper is torn away."""
+    np_rng = numpy_rng(rng)
+    max_tear = 25
+    blur = 1.5
+
+    # Random tear depth and darkness per column (top, bottom) and per row (left, right)
+    top_offsets = np_rng.randint(0, max_tear + 1, size=width)
+    top_intensities = np_rng.randint(80, 201, size=width).astype(np.float32)
+    bottom_offsets = np_rng.randint(0, max_tear + 1, size=width)
+    bottom_intensities = np_rng.randint(80, 201, size=width).astype(np.float32)
+    left_offsets = np_rng.randint(0, max_tear + 1, size=height)
+    left_intensities = np_rng.randint(80, 201, size=height).astype(np.float32)
+    right_offsets = np_rng.randint(0, max_tear + 1, size=height)
+    right_intensities = np_rng.randint(80, 201, size=height).astype(np.float32)
+    ys, xs = pixel_grid(width, height)
+
+    def draw(left, top, right, bottom):
+        rows, cols = ys[top:bottom], xs[:, left:right]  # (h, 1), (1, w)
+        paper = np.full((bottom - top, right - left), 255, dtype=np.float32)
+        # Later edges overwrite earlier ones where tears meet in a corner
+        for torn, intensities in (
+                (rows < top_offsets[left:right], top_intensities[left:right]),
+                (rows > (height - 1 - bottom_offsets[left:right]), bottom_intensities[left:right]),
+                (cols < left_offsets[top:bottom].reshape(-1, 1), left_intensities[top:bottom].reshape(-1, 1)),
+                (cols > (width - 1 - right_offsets[top:bottom]).reshape(-1, 1),
+                 right_intensities[top:bottom].reshape(-1, 1))):
+            paper = np.where(torn, intensities, paper)
+        # Irregular jagged noise on the torn paper
+        edge_noise = noise_field(right - left, bottom - top, -30, 30, rng=np_rng)
+        paper = np.where(paper < 255, np.clip(paper + edge_noise * 0.3, 0, 255), paper)
+        return (255 - paper).astype(np.uint8)
+
+    return draw_border(width, height, border_boxes(width, height, max_tear + 1 + math.ceil(3 * blur)),
+                       draw, blur)
+
+@traced
+def create_age_rings(size, rng=random, rasterizer='polygon'):
+    """Create irregular age staining — overlapping organic blobs with variable
+    opacity that mimic the mottled discolouration seen on old manuscripts.
+    No concentric circles or sinusoidal rings — purely organic shapes."""
+    canvas_size = int(size * 2.2)
+    center = canvas_size // 2
+    base_radius = max(1, int(size * 0.7))  # Divides the fades below, so never 0
+    
+    shapes = SoftShapes(canvas_size, (size * 0.15,), rasterizer)
+    
+    # Layer 1: large soft blotches for overall staining
+    num_large = rng.randint(6, 14)
+    for _ in range(num_large):
+        angle = rng.uniform(0, 6.28)
+        dist = abs(rng.gauss(0, base_radius * 0.5))
+        bx = int(center + dist * math.cos(angle))
+        by = int(center + dist * math.sin(angle))
+        br = rng.randint(int(base_radius * 0.15), int(base_radius * 0.45))
+        fade = max(0.2, 1.0 - dist / base_radius)
+        opacity = int(rng.randint(30, 75) * fade)
+        x0, y0 = bx - br, by - br
+        x1, y1 = bx + br, by + br
+        shapes.add([x0, y0, x1, y1], opacity, rng)
+    
+    # Layer 2: medium patches for variation
+    num_med = rng.randint(10, 25)
+    for _ in range(num_med):
+        angle = rng.uniform(0, 6.28)
+        dist = abs(rng.gauss(0, base_radius * 0.6))
+        bx = int(center + dist * math.cos(angle))
+        by = int(center + dist * math.sin(angle))
+        br = rng.randint(int(base_radius * 0.06), int(base_radius * 0.22))
+        fade = max(0.15, 1.0 - dist / base_radius)
+        opacity = int(rng.randint(20, 55) * fade)
+        x0, y0 = bx - br, by - br
+        x1, y1 = bx + br, by + br
+        shapes.add([x0, y0, x1, y1], opacity, rng)
+    
+    # Layer 3: tiny speckles for texture
+    num_tiny = rng.randint(20, 50)
+    for _ in range(num_tiny):
+        tx = rng.randint(center - base_radius, center + base_radius)
+        ty = rng.randint(center - base_radius, center + base_radius)
+        tr = rng.randint(1, max(3, int(base_radius * 0.05)))
+        dist_from_ctr = math.sqrt((tx - center)**2 + (ty - center)**2)
+        if dist_from_ctr < base_radius:
+            fade = max(0.1, 1.0 - dist_from_ctr / base_radius)
+            opacity = int(rng.randint(15, 45) * fade)
+            shapes.add_ellipse([tx - tr, ty - tr, tx + tr, ty + tr], opacity)
+    
+    # Random rotation for variety
+    age = shapes.render(rng.randint(0, 360))
+    return age
+
+@traced
+def create_ink_halo(size, rng=random):
+    """Create a soft ink seepage halo around text. Fast numpy version."""
+    np_rng = numpy_rng(rng)
+    canvas_size = int(size * 2.4)
+    draw_size, scale = synthesis_canvas(canvas_size, size * 0.35)
+    center = canvas_size // 2
+    base_radius = max(1, int(size * 0.8))
+    
+    # Build radial gradient with numpy, in full-size units
+    y_idx, x_idx = np.ogrid[:draw_size, :draw_size]
+    offset = to_synthesis(center, scale)
+    dist = (np.sqrt((x_idx - offset)**2 + (y_idx - offset)**2) / scale).astype(np.float32)
+    
+    # Soft halo: opacity falls off from centre
+    halo_array = np.zeros((draw_size, draw_size), dtype=np.float32)
+    within = dist < base_radius
+    halo_array[within] = 80 * (1.0 - dist[within] / base_radius) ** 0.8
+    
+    # Add noise
+    noise = noise_field(halo_array.shape[1], halo_array.shape[0], -8, 8, rng=np_rng)
+    halo_array = np.clip(halo_array + noise, 0, 255).astype(np.uint8)
+    
+    halo = Image.fromarray(halo_array)
+    halo = blur_mask(halo, size * 0.35 * scale)
+    return finish_synthesis(halo, canvas_size)
+
+@traced
+def create_foxing_spots(size, rng=random, rasterizer='polygon'):
+    """Create foxing - brown aging spots common in old manuscripts."""
+    canvas_size = int(size * 2)
+    shapes = SoftShapes(canvas_size, (size * 0.20,), rasterizer)
+    
+    center = canvas_size // 2
+    num_spots = rng.randint(4, 10)
+    
+    for _ in range(num_spots):
+        offset_x = rng.randint(-int(size * 0.5), int(size * 0.5))
+        offset_y = rng.randint(-int(size * 0.5), int(size * 0.5))
+        spot_rx = rng.randint(int(size * 0.10), int(size * 0.45))
+        spot_ry = rng.randint(int(size * 0.08), int(size * 0.40))
+        opacity = rng.randint(70, 130)
+        
+        x0 = center + offset_x - spot_rx
+        y0 = center + offset_y - spot_ry
+        x1 = center + offset_x + spot_rx
+        y1 = center + offset_y + spot_ry
+        
+        shapes.add([x0, y0, x1, y1], opacity, rng)
+    
+    foxing = shapes.render()
+    return foxing
+
+@traced
+def create_moisture_tide_mark(width, height, rng=random):
+    """Create horizontal tide marks from water damage."""
+    tide = Image.new('L', (width, height), 0)
+    draw = ImageDraw.Draw(tide)
+    
+    # Create 1-3 horizontal bands
+    num_bands = rng.randint(1, 3)
+    for _ in range(num_bands):
+        y_pos = rng.randint(int(height * 0.2), int(height * 0.8))
+        band_height = rng.randint(15, 40)
+        opacity_start = rng.randint(60, 120)
+        
+        # Gradient from top to bottom of band
+        for offset in range(band_height):
+            opacity = int(opacity_start * (1 - offset / band_height) ** 1.5)
+            if opacity > 10:
+                draw.line(
+                    [(0, y_pos + offset), (width, y_pos + offset)],
+                    fill=opacity,
+                    width=1
+                )
+    
+    tide = blur_mask(tide, 2)
+    return tide
+
+@traced
+def create_uneven_fading(size, rng=random, rasterizer='polygon'):
+    """Create patches of uneven fading - lighter/darker areas."""
+    canvas_size = int(size * 2.6)
+    shapes = SoftShapes(canvas_size, (size * 0.40,), rasterizer, synthesis=True)
+    
+    center = canvas_size // 2
+    num_patches = rng.randint(5, 12)
+    
+    for _ in range(num_patches):
+        offset_x = rng.randint(-int(size * 0.8), int(size * 0.8))
+        offset_y = rng.randint(-int(size * 0.8), int(size * 0.8))
+        patch_rx = rng.randint(int(size * 0.2), int(size * 0.75))
+        patch_ry = rng.randint(int(size * 0.15), int(size * 0.7))
+        opacity = rng.randint(30, 85)
+        
+        x0 = center + offset_x - patch_rx
+        y0 = center + offset_y - patch_ry
+        x1 = center + offset_x + patch_rx
+        y1 = center + offset_y + patch_ry
+        
+        shapes.add([x0, y0, x1, y1], opacity, rng)
+    
+    angle = rng.randint(0, 360)
+    fade = shapes.render(angle)
+    return fade
+
+@traced
+def create_rust_stains(width, height, rng=random):
+    """Create rust/oxidation stains on margins and edges."""
+    rust = Image.new('L', (width, height), 0)
+    draw = ImageDraw.Draw(rust)
+    
+    # Rust stains primarily on left/right edges and corners
+    for _ in range(rng.randint(3, 7)):
+        edge_choice = rng.choice(['left', 'right', 'corner'])
+        
+        if edge_choice == 'left':
+            x_start = rng.randint(0, int(width * 0.15))
+            y_start = rng.randint(0, height)
+        elif edge_choice == 'right':
+            x_start = rng.randint(int(width * 0.85), width)
+            y_start = rng.randint(0, height)
+        else:  # corner
+            corner = rng.choice(['top-left', 'top-right', 'bottom-left', 'bottom-right'])
+            if corner == 'top-left':
+                x_start = rng.randint(0, int(width * 0.2))
+                y_start = rng.randint(0, int(height * 0.2))
+            elif corner == 'top-right':
+                x_start = rng.randint(int(width * 0.8), width)
+                y_start = rng.randint(0, int(height * 0.2))
+            elif corner == 'bottom-left':
+                x_start = rng.randint(0, int(width * 0.2))
+                y_start = rng.randint(int(height * 0.8), height)
+            else:
+                x_start = rng.randint(int(width * 0.8), width)
+                y_start = rng.randint(int(height * 0.8), height)
+        
+        # Create stain spread
+        stain_width = rng.randint(20, 80)
+        stain_height = rng.randint(30, 150)
+        
+        for _ in range(rng.randint(5, 12)):
+            offset_x = rng.randint(-stain_width, stain_width)
+            offset_y = rng.randint(-stain_height, stain_height)
+            spot_radius = rng.randint(5, 20)
+            opacity = rng.randint(60, 140)
+            
+            cx = x_start + offset_x
+            cy = y_start + offset_y
+            
+            if 0 <= cx < width and 0 <= cy < height:
+                draw_irregular_shape(draw, [cx - spot_radius, cy - spot_radius, cx + spot_radius, cy + spot_radius], fill=int(opacity * 0.5), rng=rng)
+    
+    rust = blur_mask(rust, 5)
+    return rust
+
+@traced
+def create_text_area_smudge(size, rng=random, rasterizer='polygon'):
+    """Create smudges and halos around text areas."""
+    canvas_size = int(size * 2.5)
+    shapes = SoftShapes(canvas_size, (size * 0.35,), rasterizer, synthesis=True)
+    
+    center = canvas_size // 2
+    
+    # Create irregular text-like smudge pattern
+    num_marks = rng.randint(5, 12)
+    for _ in range(num_marks):
+        mark_x = rng.randint(int(center * 0.3), int(center * 1.7))
+        mark_y = rng.randint(int(center * 0.1), int(center * 1.9))
+        mark_width = rng.randint(int(size * 0.2), int(size * 0.9))
+        mark_height = rng.randint(int(size * 0.1), int(size * 0.6))
+        opacity = rng.randint(30, 90)
+        
+        shapes.add([mark_x - mark_width, mark_y - mark_height, mark_x + mark_width, mark_y + mark_height], opacity, rng)
+    
+    angle = rng.randint(0, 360)
+    smudge = shapes.render(angle)
+    return smudge
+
+@traced
+def create_edge_darkening(width, height, rng=random):
+    """Create dramatic organic edge darkening simulating oxidation and handling.
+    Produces wide, irregular gradients shifting from cream to near-black at the
+    very edges, with heavy corner blotches — matching authentic aged manuscripts.
+    Only the border band and corner patches are drawn: returns the parts
+    (see draw_border) of the mask."""
+    np_rng = numpy_rng(rng)
+    min_dim = min(width, height)
+    # At least a pixel: the gradient below divides by it
+    edge_width = max(1, rng.randint(int(min_dim * 0.06), int(min_dim * 0.20)))
+    blur = max(3, edge_width // 4)
+    
+    # Organic wobble via coarse noise, upsampled over each box as needed
+    noise_h = max(4, height // 28)
+    noise_w = max(4, width // 28)
+    coarse_noise = np_rng.uniform(-0.5, 0.5, (noise_h, noise_w)).astype(np.float32)
+    noise_img = Image.fromarray(((coarse_noise + 0.5) * 255).astype(np.uint8), mode='L')
+    wobble_amplitude = edge_width * 0.6
+    
+    # Heavy corner blotches — much larger with higher opacity
+    corner_radius = int(min_dim * rng.uniform(0.08, 0.22))
+    blotches = []
+    corner_patches = []
+    for (cx, cy) in [(0, 0), (width, 0), (0, height), (width, height)]:
+        patch_w = patch_h = 0
+        num_blobs = rng.randint(8, 18)
+        for _ in range(num_blobs):
+            bx = cx + rng.randint(-corner_radius, corner_radius)
+            by = cy + rng.randint(-corner_radius, corner_radius)
+            br = rng.randint(corner_radius // 3, corner_radius)
+            bop = rng.randint(120, 240)
+            x0 = max(0, bx - br)
+            y0 = max(0, by - br)
+            x1 = min(width, bx + br)
+            y1 = min(height, by + br)
+            if x1 > x0 + 2 and y1 > y0 + 2:
+                outline = irregular_outline([x0, y0, x1, y1], rng=rng)
+                ox, oy, rx, ry, rot, _, radii = outline
+                # Half extents of the turned outline
+                reach_x = max(radii) * math.hypot(rx * math.cos(rot), ry * math.sin(rot))
+                reach_y = max(radii) * math.hypot(rx * math.sin(rot), ry * math.cos(rot))
+                blotches.append((outline, bop, (ox - reach_x, oy - reach_y, ox + reach_x, oy + reach_y)))
+                patch_w = max(patch_w, abs(ox - cx) + reach_x)
+                patch_h = max(patch_h, abs(oy - cy) + reach_y)
+        corner_patches.append((patch_w + 1 + 3 * blur, patch_h + 1 + 3 * blur))
+    
+    def draw(left, top, right, bottom):
+        # Distance from the edge, warped by the wobble noise
+        wobble = noise_img.resize((right - left, bottom - top), Image.BILINEAR,
+                                  box=(left * noise_w / width, top * noise_h / height,
+                                       right * noise_w / width, bottom * noise_h / height))
+        noise_full = (np.asarray(wobble).astype(np.float32) / 255.0 - 0.5) * 2.0
+        warped_dist = edge_distance(width, height, (left, top, right, bottom)) + noise_full * wobble_amplitude
+        
+        # Convert to opacity: fade from 230 at edge → 0 at interior
+        edge_mask = np.clip(1.0 - warped_dist / edge_width, 0, 1)
+        edge_arr = (edge_mask ** 1.3) * 230
+        
+        # Fine noise for organic grain
+        fine_noise = noise_field(right - left, bottom - top, -15, 16, rng=np_rng).astype(np.float32)
+        edge_arr = np.clip(edge_arr + fine_noise * edge_mask, 0, 255)
+        
+        edges = Image.fromarray(edge_arr.astype(np.uint8), mode='L')
+        box_draw = ImageDraw.Draw(edges)
+        for (ox, oy, rx, ry, rot, angles, radii), bop, (bx0, by0, bx1, by1) in blotches:
+            if bx1 >= left and bx0 < right and by1 >= top and by0 < bottom:
+                fill_outline(box_draw, (ox - left, oy - top, rx, ry, rot, angles, radii), bop)
+        return np.asarray(edges)
+    
+    # The gradient ends where the widest wobble pushes it, 1.6 edge widths in
+    band = 1.6 * edge_width + 1 + 3 * blur
+    return draw_border(width, height, border_boxes(width, height, band, corner_patches), draw, blur)
+
+@traced
+def create_fingerprint_mark(size, rng=random, rasterizer='polygon'):
+    """Create a fingerprint/touch mark - smeared, elongated."""
+    canvas_size = int(size * 2)
+    shapes = SoftShapes(canvas_size, (size * 0.15,), rasterizer)
+    
+    center = canvas_size // 2
+    # Create fingerprint-like ridges
+    num_ridges = rng.randint(4, 7)
+    
+    for i in range(num_ridges):
+        offset = rng.randint(-size // 4, size // 4)
+        width = rng.randint(int(size * 0.1), int(size * 0.2))
+        length = int(size * rng.uniform(0.6, 1.2))
+        
+        x0 = center - length // 2
+        y0 = center + offset - width // 2
+        x1 = center + length // 2
+        y1 = center + offset + width // 2
+        
+        opacity = rng.randint(35, 80)
+        shapes.add([x0, y0, x1, y1], opacity, rng)
+    
+    # Random rotation
+    angle = rng.randint(0, 360)
+    mark = shapes.render(angle)
+    
+    return mark
+
+@traced
+def create_dust_speckles(size, rng=random):
+    """Create tiny dust spots or foxing marks."""
+    np_rng = numpy_rng(rng)
+    canvas_size = int(size * 2)
+    speckles = np.zeros((canvas_size, canvas_size), dtype=np.uint8)
+    
+    # Random tiny spots, stamped from the sprite atlas with the blur built in
+    num_spots = rng.randint(10, 25)
+    stamp(speckles,
+          np_rng.randint(0, canvas_size + 1, num_spots), np_rng.randint(0, canvas_size + 1, num_spots),
+          np_rng.randint(1, 5, num_spots), np_rng.randint(40, 91, num_spots),
+          shape=irregular_dot, variants=ATLAS_VARIANTS, blur=2, rng=np_rng)
+    return Image.fromarray(speckles)
+
+@traced
+def create_streak_mark(size, rng=random):
+    """Create a streak or smear mark."""
+    canvas_size = int(size * 2)
+    streak = Image.new('L', (canvas_size, canvas_size), 0)
+    draw = ImageDraw.Draw(streak)
+    
+    center = canvas_size // 2
+    # Create streaky pattern
+    num_streaks = rng.randint(3, 8)
+    
+    for _ in range(num_streaks):
+        start_x = rng.randint(center - size // 2, center + size // 2)
+        start_y = rng.randint(center - size // 2, center + size // 2)
+        
+        length = rng.randint(int(size * 0.3), int(size * 0.8))
+        angle = rng.uniform(0, 360)
+        
+        end_x = start_x + int(length * np.cos(np.radians(angle)))
+        end_y = start_y + int(length * np.sin(np.radians(angle)))
+        
+        width = rng.randint(2, 6)
+        opacity = rng.randint(70, 140)
+        
+        draw.line([start_x, start_y, end_x, end_y], fill=opacity, width=width)
+    
+    streak = blur_mask(streak, size * 0.12)
+    return streak
+
+@traced
+def create_corner_aging(width, height, corner_position, rng=random):
+    """Create corner darkening/aging effect. Only the corner patch is drawn:
+    returns its part (see draw_border)."""
+    corner_size = rng.randint(min(width, height) // 6, min(width, height) // 4)
+    if corner_size == 0:
+        return []  # A page under 6 pixels across has no room for a corner
+    blur = corner_size * 0.2
+    
+    # The gradient was a stack of nested squares from the corner, smallest
+    # (and faintest) last; each pixel takes the last square covering it, the
+    # one whose inner edge it sits on, unless that square was too faint to draw
+    last_step = max(i for i in range(corner_size) if int(100 * (1 - i / corner_size) ** 2) > 5)
+    left_side = 'left' in corner_position
+    top_side = 'top' in corner_position
+    ys, xs = pixel_grid(width, height)
+    
+    def draw(left, top, right, bottom):
+        cols = xs[:, left:right].astype(np.int64)
+        rows = ys[top:bottom].astype(np.int64)
+        # How many steps in from the outside of the corner square each pixel sits
+        across = corner_size - cols if left_side else cols - (width - corner_size)
+        down = corner_size - rows if top_side else rows - (height - corner_size)
+        step = np.minimum(np.minimum(across, down), last_step)
+        aging = (100 * (1 - step / corner_size) ** 2).astype(np.uint8)
+        aging[step < 0] = 0
+        return aging
+    
+    extent = min(corner_size + 1 + math.ceil(3 * blur), width, height)
+    box = (0 if left_side else width - extent, 0 if top_side else height - extent,
+           extent if left_side else width, extent if top_side else height)
+    return draw_border(width, height, [box], draw, blur)
+
+@traced
+def create_paper_grain(width, height, intensity=0.5):
+    """Create paper texture/grain effect."""
+    return _paper_grain(width, height, intensity)
+
+def _paper_grain(width, height, intensity):
+    grain = noise_field(width, height, -30, 30)
+    grain = (grain * np.float32(intensity)).astype(np.int16)
+    return grain
+
+def apply_grain_to_overlay(overlay, intensity=0.4):
+    """Apply grain to mark colors while preserving transparency."""
+    with span('grain'):
+        return _apply_grain_to_overlay(overlay, intensity)
+
+def _apply_grain_to_overlay(overlay, intensity):
+    overlay_rgba = overlay.convert('RGBA')
+    rgb = overlay_rgba.convert('RGB')
+
+    img_array = np.array(rgb).astype(np.int16)
+    grain = create_paper_grain(rgb.width, rgb.height, intensity=intensity)
+    img_array[:, :, 0] = np.clip(img_array[:, :, 0] + grain, 0, 255)
+    img_array[:, :, 1] = np.clip(img_array[:, :, 1] + grain, 0, 255)
+    img_array[:, :, 2] = np.clip(img_array[:, :, 2] + grain, 0, 255)
+
+    rgb_grain = Image.fromarray(img_array.astype(np.uint8))
+    r, g, b = rgb_grain.split()
+    _, _, _, a = overlay_rgba.split()
+    return Image.merge('RGBA', (r, g, b, a))
+
+@traced
+def create_vignette(width, height, strength=0.5):
+    """Create vignette/edge darkening effect. Fast numpy version."""
+    center_x, center_y = width / 2.0, height / 2.0
+    max_dist = math.sqrt(center_x**2 + center_y**2)
+    
+    dist = centre_distance(width, height)
+    vignette_array = np.clip((dist / max_dist) * 180 * strength, 0, 200).astype(np.uint8)
+    
+    vignette = Image.fromarray(vignette_array)
+    vignette = blur_mask(vignette, max(width, height) * 0.1)
+    return vignette
+
+@traced
+def create_fold_line(width, height, vertical=True, rng=random):
+    """Create a fold/crease line."""
+    fold = Image.new('L', (width, height), 0)
+    draw = ImageDraw.Draw(fold)
+    
+    if vertical:
+        # Vertical fold
+        center = rng.randint(int(width * 0.3), int(width * 0.7))
+        for y in range(height):
+            offset = rng.randint(-3, 3)
+            x = center + offset
+            thickness = rng.randint(2, 5)
+            opacity = rng.randint(60, 120)
+            draw.line([(x - thickness, y), (x + thickness, y)], fill=opacity, width=thickness)
+    else:
+        # Horizontal fold
+        center = rng.randint(int(height * 0.3), int(height * 0.7))
+        for x in range(width):
+            offset = rng.randint(-3, 3)
+            y = center + offset
+            thickness = rng.randint(2, 5)
+            opacity = rng.randint(60, 120)
+            draw.line([(x, y - thickness), (x, y + thickness)], fill=opacity, width=thickness)
+    
+    fold = blur_mask(fold, 2)
+    return fold
+
+@traced
+def create_crack_pattern(width, height, rng=random):
+    """Create small cracks or tears in the paper."""
+    crack = Image.new('L', (width, height), 0)
+    draw = ImageDraw.Draw(crack)
+    
+    # Random starting point
+    x = rng.randint(int(width * 0.2), int(width * 0.8))
+    y = rng.randint(int(height * 0.2), int(height * 0.8))
+    
+    # Create branching crack
+    length = rng.randint(30, 100)
+    angle = rng.uniform(0, 360)
+    
+    for i in range(length):
+        angle += rng.uniform(-15, 15)
+        step_x = int(np.cos(np.radians(angle)) * 2)
+        step_y = int(np.sin(np.radians(angle)) * 2)
+        
+        x += step_x
+        y += step_y
+        
+        if 0 <= x < width and 0 <= y < height:
+            thickness = rng.randint(1, 3)
+            opacity = rng.randint(80, 150)
+            draw.ellipse([x - thickness, y - thickness, x + thickness, y + thickness], fill=opacity)
+            
+            # Random branching
+            if rng.random() < 0.1:
+                branch_length = rng.randint(10, 30)
+                branch_angle = angle + rng.uniform(-60, 60)
+                bx, by = x, y
+                for j in range(branch_length):
+                    bx += int(np.cos(np.radians(branch_angle)) * 2)
+                    by += int(np.sin(np.radians(branch_angle)) * 2)
+                    if 0 <= bx < width and 0 <= by < height:
+                        draw.point((bx, by), fill=opacity // 2)
+    
+    crack = blur_mask(crack, 0.5)
+    return crack
+
+@traced
+def create_algae_growth(width, height, rng=random):
+    """Create algae/mold growth patches — greenish-brown organic spread
+    common on ancient manuscripts stored in humid environments. Colonies are
+    thresholded fractal noise that thins out with distance from their seed,
+    veined with ridged noise."""
+    np_rng = numpy_rng(rng)
+    blur = max(4, min(width, height) * 0.02)
+    draw_w, draw_h, scale = page_canvas(width, height, blur)
+    algae = np.zeros((draw_h, draw_w), dtype=np.uint8)
+
+    # 1-4 algae colonies, each spreading organically from a seed point
+    num_colonies = rng.randint(1, 4)
+    for _ in range(num_colonies):
+        # Seed near edges/corners (algae grows from where moisture enters)
+        edge = rng.choice(['top', 'bottom', 'left', 'right', 'corner'])
+        if edge == 'top':
+            cx = rng.randint(int(width * 0.1), int(width * 0.9))
+            cy = rng.randint(0, int(height * 0.2))
+        elif edge == 'bottom':
+            cx = rng.randint(int(width * 0.1), int(width * 0.9))
+            cy = rng.randint(int(height * 0.8), height)
+        elif edge == 'left':
+            cx = rng.randint(0, int(width * 0.2))
+            cy = rng.randint(int(height * 0.1), int(height * 0.9))
+        elif edge == 'right':
+            cx = rng.randint(int(width * 0.8), width)
+            cy = rng.randint(int(height * 0.1), int(height * 0.9))
+        else:
+            corner = rng.choice([(0.1, 0.1), (0.9, 0.1), (0.1, 0.9), (0.9, 0.9)])
+            cx = int(width * corner[0]) + rng.randint(-30, 30)
+            cy = int(height * corner[1]) + rng.randint(-30, 30)
+
+        # Colony size based on image dimensions
+        colony_radius = rng.randint(min(width, height) // 8, min(width, height) // 3)
+
+        region = seep_region(algae, scale, (cx, cy), colony_radius, 1.3, np_rng)
+        if region is None:
+            continue
+        window, distance, warped, pools = region
+        height_w, width_w = distance.shape
+
+        # Patchy growth: the noise has to clear a threshold that rises outward
+        growth = fbm_field(width_w, height_w, 0.3 * SEEP_RESOLUTION, rng=np_rng)
+        colony = np.clip((growth - 0.3 - 0.3 * warped) / 0.08, 0.0, 1.0) * (25 + 65 * pools)
+
+        # Fine veins radiating through the colony: ridged noise peaks along
+        # the midlines of the field's level sets
+        veins = fbm_field(width_w, height_w, 0.25 * SEEP_RESOLUTION, octaves=3, rng=np_rng)
+        veins = (1.0 - np.abs(2.0 * veins - 1.0)) ** 8 * 30 * ramp(warped, 0.6, 1.2)
+        paste_region(algae, window, np.maximum(colony, veins))
+
+    return finish_page(algae, width, height, blur, scale)
+
+@traced
+def create_dark_damage_patch(width, height, rng=random):
+    """Create large, very dark irregular damage patches concentrated at edges/corners.
+    Simulates severe water, smoke, or age damage where the parchment has turned
+    very dark brown to near-black — matching authentic ancient manuscripts.
+    Each patch is a noise-warped distance field: a dense core, a ghost fringe
+    and a sharp tide line at its border. The patch has no other detail, so
+    its softening blur is built into the field's edges instead of run over
+    the page."""
+    np_rng = numpy_rng(rng)
+    min_dim = min(width, height)
+    blur = max(3, min_dim * 0.012)
+    patch = np.zeros((height, width), dtype=np.uint8)
+
+    # Choose 1-3 regions for damage (biased to corners/edges)
+    num_patches = rng.randint(1, 3)
+    for _ in range(num_patches):
+        corner = rng.choice([
+            (0, 0), (width, 0), (0, height), (width, height),
+            (width // 2, 0), (width // 2, height),
+            (0, height // 2), (width, height // 2)
+        ])
+
+        # Large spread — covers significant portion of the page
+        spread = rng.randint(int(min_dim * 0.25), int(min_dim * 0.65))
+        tide_at = rng.uniform(0.45, 0.75)
+        tide_opacity = rng.randint(160, 245)
+
+        region = seep_region(patch, 1.0, corner, spread, 1.7, np_rng)
+        if region is None:
+            continue
+        window, distance, warped, pools = region
+        softness = blur / spread
+
+        # Dense core, darkest near the seed
+        fade = np.maximum(0.3, 1.0 - np.minimum(distance, 1.0) ** 0.6)
+        damage = ramp(warped, 0.7, 0.9, softness) * fade * (140 + 100 * pools)
+        # Ghost outer fringe
+        fringe = np.maximum(0.05, 1.0 - np.minimum(distance / 1.2, 1.0) ** 0.5)
+        np.maximum(damage, ramp(warped, 0.9, 1.3, softness) * fringe * (20 + 40 * pools), out=damage)
+        # Sharp tide line at the damage border
+        np.maximum(damage, tide_line(warped, pools, tide_at, 0.08, tide_opacity, softness), out=damage)
+        paste_region(patch, window, damage)
+
+    return Image.fromarray(patch)
+
+@traced
+def create_ink_splatter(width, height, rng=random):
+    """Create scattered ink splatter dots across the page — many tiny 1-2px
+    dots plus occasional dense clusters and larger blots. Every group of
+    dots is sampled as arrays and stamped from the sprite atlas in one go,
+    with the slight softening blur built into the sprites."""
+    np_rng = numpy_rng(rng)
+    splatter = np.zeros((height, width), dtype=np.uint8)
+
+    def scatter(count, radius_range, opacity_range, shape):
+        stamp(splatter, np_rng.randint(0, width, count), np_rng.randint(0, height, count),
+              np_rng.randint(radius_range[0], radius_range[1] + 1, count),
+              np_rng.randint(opacity_range[0], opacity_range[1] + 1, count),
+              shape=shape, variants=1 if shape is disc else ATLAS_VARIANTS, blur=0.5, rng=np_rng)
+
+    # --- Tiny scattered dots (1-2px) — the majority of spatter ---
+    scatter(rng.randint(150, 500), (1, 2), (100, 230), disc)
+
+    # --- Medium scattered dots (3-8px) ---
+    scatter(rng.randint(30, 100), (3, 8), (130, 245), irregular_dot)
+
+    # --- Occasional large blots (10-25px) ---
+    scatter(rng.randint(3, 15), (10, 25), (160, 250), irregular_dot)
+
+    # --- Dense clusters (ink drips / bottle spills) ---
+    num_clusters = rng.randint(1, 3)
+    for _ in range(num_clusters):
+        cluster_x = rng.randint(int(width * 0.05), int(width * 0.95))
+        cluster_y = rng.randint(int(height * 0.05), int(height * 0.95))
+        cluster_spread = rng.uniform(15, 50)
+        cluster_dots = rng.randint(30, 80)
+        xs = (cluster_x + np_rng.normal(0, cluster_spread, cluster_dots)).astype(int)
+        ys = (cluster_y + np_rng.normal(0, cluster_spread, cluster_dots)).astype(int)
+        tiny = np_rng.random_sample(cluster_dots) < 0.65
+        medium = np_rng.random_sample(cluster_dots) < 0.6
+        radii = np.where(tiny, np_rng.randint(1, 4, cluster_dots),   # mostly tiny
+                         np.where(medium, np_rng.randint(3, 9, cluster_dots),
+                                  np_rng.randint(8, 19, cluster_dots)))  # concentrated blot
+        on_page = (xs >= 0) & (xs < width) & (ys >= 0) & (ys < height)
+        dots = on_page & (radii <= 2)
+        stamp(splatter, xs[dots], ys[dots], radii[dots], np_rng.randint(140, 251, dots.sum()), blur=0.5)
+        blots = on_page & (radii > 2)
+        stamp(splatter, xs[blots], ys[blots], radii[blots], np_rng.randint(160, 251, blots.sum()),
+              shape=irregular_dot, variants=ATLAS_VARIANTS, blur=0.5, rng=np_rng)
+    return Image.fromarray(splatter)
+
+@traced
+def create_edge_water_stain(width, height, rng=random):
+    """Create large organic water/moisture stain spreading inward from
+    one or more edges — like real manuscripts with water damage from the sides.
+    Produces soft, feathered, irregularly-shaped brownish patches, each a
+    noise-warped distance field with a tide line and a scatter of droplets."""
+    np_rng = numpy_rng(rng)
+    blur = max(5, min(width, height) * 0.025)
+    draw_w, draw_h, scale = page_canvas(width, height, blur)
+    stain = np.zeros((draw_h, draw_w), dtype=np.uint8)
+
+    # Choose 1-3 edges to spawn stains from
+    num_stains = rng.randint(1, 3)
+    for _ in range(num_stains):
+        edge = rng.choice(['top', 'bottom', 'left', 'right',
+                               'top-right', 'top-left', 'bottom-right', 'bottom-left'])
+
+        # Determine seed region along chosen edge
+        if edge == 'top':
+            seed_x = rng.randint(int(width * 0.1), int(width * 0.9))
+            seed_y = 0
+        elif edge == 'bottom':
+            seed_x = rng.randint(int(width * 0.1), int(width * 0.9))
+            seed_y = height
+        elif edge == 'left':
+            seed_x = 0
+            seed_y = rng.randint(int(height * 0.1), int(height * 0.9))
+        elif edge == 'right':
+            seed_x = width
+            seed_y = rng.randint(int(height * 0.1), int(height * 0.9))
+        elif edge == 'top-right':
+            seed_x = width
+            seed_y = 0
+        elif edge == 'top-left':
+            seed_x = 0
+            seed_y = 0
+        elif edge == 'bottom-right':
+            seed_x = width
+            seed_y = height
+        else:
+            seed_x = 0
+            seed_y = height
+
+        # Spread distance — how far the stain seeps inward
+        spread = rng.randint(min(width, height) // 3, int(min(width, height) * 0.75))
+        tide_at = rng.uniform(0.5, 0.85)
+        tide_opacity = rng.randint(100, 200)
+
+        region = seep_region(stain, scale, (seed_x, seed_y), spread, 1.8, np_rng)
+        if region is not None:
+            window, distance, warped, pools = region
+            # Body, fading with distance from the edge
+            fade = np.maximum(0.2, 1.0 - np.minimum(distance, 1.0) ** 0.7)
+            water = ramp(warped, 0.7, 0.9) * fade * (50 + 90 * pools)
+            # Softer secondary spread for feathered edges (ghost regions)
+            fringe = np.maximum(0.05, 1.0 - np.minimum(distance / 1.3, 1.0) ** 0.6)
+            np.maximum(water, ramp(warped, 0.95, 1.4) * fringe * (12 + 33 * pools), out=water)
+            # Wick / tide-line effect: darker concentrated border at stain perimeter
+            np.maximum(water, tide_line(warped, pools, tide_at, 0.1, tide_opacity), out=water)
+            paste_region(stain, window, water)
+
+        # --- Ink spatter droplets around stain edges ---
+        num_droplets = rng.randint(10, 30)
+        angles = np_rng.uniform(0, 2 * math.pi, num_droplets)
+        reach = spread * np_rng.uniform(0.6, 1.3, num_droplets)
+        xs = to_synthesis(seed_x + reach * np.cos(angles), scale)
+        ys = to_synthesis(seed_y + reach * np.sin(angles), scale)
+        radii = np.maximum(1, np.round(np_rng.randint(1, max(2, spread // 25) + 1, num_droplets) * scale))
+        stamp(stain, np.round(xs), np.round(ys), radii, np_rng.randint(80, 181, num_droplets),
+              shape=irregular_dot, variants=ATLAS_VARIANTS, rng=np_rng)
+
+    return finish_page(stain, width, height, blur, scale)
+
+def apply_paper_yellowing(image, intensity=0.3):
+    """Apply overall yellowing/sepia tint to simulate aging paper."""
+    img_array = np.array(image).astype(np.float32)
+    
+    # Create sepia/yellow tint
+    sepia_r = 1.0 + (0.3 * intensity)
+    sepia_g = 1.0 + (0.15 * intensity)
+    sepia_b = 1.0 - (0.2 * intensity)
+    
+    img_array[:, :, 0] = np.clip(img_array[:, :, 0] * sepia_r, 0, 255)
+    img_array[:, :, 1] = np.clip(img_array[:, :, 1] * sepia_g, 0, 255)
+    img_array[:, :, 2] = np.clip(img_array[:, :, 2] * sepia_b, 0, 255)
+    
+    return Image.fromarray(img_array.astype(np.uint8))
+
+# Finishing-stage settings per aging level
+CONTRAST_FACTORS = {
+    'light': 0.95,
+    'medium': 0.92,
+    'heavy': 0.88,
+    'extreme': 0.85
+}
+
+GRAIN_INTENSITIES = {
+    'light': 0.2,
+    'medium': 0.3,
+    'heavy': 0.4,
+    'extreme': 0.5
+}
+
+# Rows per block in the finishing pass and the integer multiply blend; keeps
+# the temporaries to around a hundred kilobytes on typical page widths
+FINISH_BLOCK_ROWS = 16
+
+def available_cpus():
+    """Return the number of CPUs this process may run on."""
+    if hasattr(os, 'sched_getaffinity'):
+        return len(os.sched_getaffinity(0))
+    return os.cpu_count() or 1
+
+# Threads working on one render: drawing its masks, and finishing it in
+# bands of rows. Both are mostly Pillow drawing and blurs and NumPy passes,
+# which release the GIL.
+RENDER_THREADS = available_cpus()
+
+def run_threaded(func, items, threads):
+    """Call func on every item on up to threads threads and return the results in order.
+
+    items is consumed lazily in the calling thread, at most two per thread
+    ahead of the results, so a generator can prepare the items in order and
+    only a few are held at once. Each call runs in a copy of the caller's
+    context, so its spans and counters reach the active collector. With
+    threads below 2 everything runs in the calling thread.
+    """
+    if threads < 2:
+        return [func(item) for item in items]
+    results = []
+    pending = deque()
+    with ThreadPoolExecutor(max_workers=threads) as pool:
+        for item in items:
+            if len(pending) >= 2 * threads:
+                results.append(pending.popleft().result())
+            pending.append(pool.submit(contextvars.copy_context().run, func, item))
+        results.extend(future.result() for future in pending)
+    return results
+
+# Edge length of the dirty-tile grid. The finishing stages only touch tiles
+# that some layer has drawn into; everywhere else the overlay alpha is zero
+# and the page is left exactly as it was.
+TILE_SIZE = 128
+
+# Pixels per block when a layer is merged into the overlay; the uint32
+# temporaries stay within a few hundred kilobytes
+COMPOSITE_BLOCK_PIXELS = 2**16
+
+def new_tile_map(width, height):
+    """Return an all-clean boolean tile grid covering a width x height page."""
+    return np.zeros((-(-height // TILE_SIZE), -(-width // TILE_SIZE)), dtype=bool)
+
+def clip_to_page(alpha, position, width, height):
+    """Clip alpha placed at position to a width x height page, the way paste() does.
+
+    Returns the clipped alpha and its (left, top, right, bottom) box on the
+    page, or None when nothing of it falls on the page.
+    """
+    left, top = position
+    x0, y0 = max(left, 0), max(top, 0)
+    x1 = min(left + alpha.shape[1], width)
+    y1 = min(top + alpha.shape[0], height)
+    if x0 >= x1 or y0 >= y1:
+        return None
+    return alpha[y0 - top:y1 - top, x0 - left:x1 - left], (x0, y0, x1, y1)
+
+def mark_dirty_tiles(tiles, alpha, position=(0, 0)):
+    """Flag every tile under a nonzero pixel of alpha placed at position."""
+    clipped = clip_to_page(alpha, position, tiles.shape[1] * TILE_SIZE, tiles.shape[0] * TILE_SIZE)
+    if clipped is None:
+        return
+    alpha, (x0, y0, x1, y1) = clipped
+
+    # Max over each tile-aligned run of rows, then of columns
+    row_starts = np.arange(y0 - y0 % TILE_SIZE, y1, TILE_SIZE)
+    col_starts = np.arange(x0 - x0 % TILE_SIZE, x1, TILE_SIZE)
+    row_cuts = np.maximum(row_starts - y0, 0)
+    col_cuts = np.maximum(col_starts - x0, 0)
+    occupied = np.maximum.reduceat(np.maximum.reduceat(alpha, row_cuts, axis=0), col_cuts, axis=1)
+    tiles[row_starts[0] // TILE_SIZE:row_starts[-1] // TILE_SIZE + 1,
+          col_starts[0] // TILE_SIZE:col_starts[-1] // TILE_SIZE + 1] |= occupied > 0
+
+def dirty_boxes(tiles, size):
+    """Turn a tile grid into (left, top, right, bottom) boxes clipped to size.
+
+    Adjacent dirty tiles in a tile row are merged into one box.
+    """
+    width, height = size
+    boxes = []
+    for tile_row, row in enumerate(tiles):
+        top = tile_row * TILE_SIZE
+        bottom = min(top + TILE_SIZE, height)
+        flags = np.concatenate(([False], row, [False]))
+        edges = np.flatnonzero(flags[1:] != flags[:-1])
+        for start, stop in zip(edges[::2], edges[1::2]):
+            boxes.append((int(start) * TILE_SIZE, top, min(int(stop) * TILE_SIZE, width), bottom))
+    return boxes
+
+def make_layer(kind, mask, color, intensity_mod, alpha_cap=255, position=None, spec=None, op=None):
+    """Return a layer record for a raw uint8 mask, cropped to its nonzero pixels.
+
+    position is the page coordinate of the mask's top-left corner for local
+    marks, which are pasted; None marks a full-page layer, which is
+    alpha-composited. op overrides that choice, as for the parts of a border
+    effect, which are alpha-composited at their position. The layer's alpha
+    at render time is mask * intensity * intensity_mod, capped at alpha_cap.
+    spec is the MarkSpec the layer was drawn from, if any.
+    """
+    left, top = position or (0, 0)
+    rows = np.flatnonzero(mask.any(axis=1))
+    cols = np.flatnonzero(mask.any(axis=0))
+    if rows.size:
+        mask = mask[rows[0]:rows[-1] + 1, cols[0]:cols[-1] + 1].copy()
+        left, top = left + int(cols[0]), top + int(rows[0])
+    else:
+        mask = np.zeros((0, 0), dtype=np.uint8)
+    return {
+        'kind': kind,
+        'mask': mask,
+        'color': color,
+        'position': (left, top),
+        'intensity_mod': intensity_mod,
+        'alpha_cap': alpha_cap,
+        'op': op or ('composite' if position is None else 'paste'),
+        'spec': spec,
+    }
+
+def alpha_lut(intensity_mod, alpha_cap, intensity):
+    """Return the uint8 table mapping mask values to alpha at the given global intensity.
+
+    Each entry is mask * intensity * intensity_mod in float32, clipped to
+    alpha_cap and truncated.
+    """
+    alpha = np.arange(256, dtype=np.float32)
+    alpha *= np.float32(intensity * intensity_mod)
+    np.clip(alpha, 0, alpha_cap, out=alpha)
+    return alpha.astype(np.uint8)
+
+def layer_alpha(layer, intensity):
+    """Scale a layer's mask to uint8 alpha for the given global intensity.
+
+    The table is applied with Image.point, which is several times faster
+    than indexing it with the mask in NumPy. The result is read-only.
+    """
+    lut = alpha_lut(layer['intensity_mod'], layer['alpha_cap'], intensity)
+    return np.asarray(Image.fromarray(layer['mask']).point(lut.tolist()))
+
+def composite_layer(overlay, color, alpha, position=(0, 0), op='composite', tiles=None):
+    """Merge a solid colour through a uint8 alpha array into an RGBA overlay array.
+
+    op 'composite' alpha-composites the layer at position (full-page
+    effects); 'paste' pastes it using its own alpha as the mask (local
+    marks). Both work in place on the layer's box in the overlay, in blocks
+    of rows, with Pillow's integer arithmetic, so the result is the same as
+    Image.alpha_composite and Image.paste on an RGBA layer. The tiles the
+    layer touches are flagged in tiles, if given. Returns the overlay.
+    """
+    with span('composite'):
+        if tiles is not None:
+            mark_dirty_tiles(tiles, alpha, position)
+        clipped = clip_to_page(alpha, position, overlay.shape[1], overlay.shape[0])
+        if clipped is None:
+            return overlay
+        alpha, (left, top, right, bottom) = clipped
+        if op == 'composite':
+            count('full_page_layers')
+            merge, fills = _composite_block, _composite_fills(color)
+        else:
+            count('local_layers')
+            merge, fills = _paste_block, _paste_fills(color)
+        block_rows = max(1, COMPOSITE_BLOCK_PIXELS // (right - left))
+        for block_top in range(top, bottom, block_rows):
+            block_bottom = min(block_top + block_rows, bottom)
+            block = alpha[block_top - top:block_bottom - top]
+            # Zero alpha leaves the overlay as it is; skip the empty columns
+            cols = np.flatnonzero(block.any(axis=0))
+            if not cols.size:
+                continue
+            region = overlay[block_top:block_bottom, left + cols[0]:left + cols[-1] + 1]
+            block = block[:, cols[0]:cols[-1] + 1]
+            if region.any():
+                merge(region, color, block)
+            else:
+                # Over untouched overlay each pixel only depends on its alpha
+                region.view(np.uint32)[:, :, 0] = fills.take(block)
+        return overlay
+
+def _pixel_table(channels):
+    # Pack four 256-entry channel tables into a table of whole uint32
+    # pixels, in the overlay's byte order
+    return np.stack(channels, axis=1).astype(np.uint8).view(np.uint32)[:, 0]
+
+def _paste_fills(color):
+    alpha = np.arange(256, dtype=np.uint16)
+    channels = [alpha * np.uint16(source) for source in color] + [alpha * alpha]
+    for channel in channels:
+        _div255(channel)
+    return _pixel_table(channels)
+
+def _paste_block(region, color, alpha):
+    # Pillow's paste with the layer's own alpha as mask: every channel,
+    # alpha included, becomes (dst * (255 - a) + src * a) / 255, rounded
+    # by DIV255. All terms fit in uint16; one channel at a time is fastest.
+    alpha = alpha.astype(np.uint16)
+    keep = 255 - alpha
+    for channel, source in enumerate(color + (None,)):
+        blended = region[:, :, channel] * keep
+        blended += alpha * (alpha if source is None else np.uint16(source))
+        _div255(blended)
+        region[:, :, channel] = blended
+
+def _composite_tables():
+    # Pillow's alpha_composite in fixed point (PRECISION_BITS = 7), indexed
+    # by (source alpha << 8) | destination alpha: the source colour's weight
+    # out of 255 << 7, and the resulting alpha.
+    source = np.arange(256, dtype=np.uint32)[:, None]
+    dest = np.arange(256, dtype=np.uint32)[None, :]
+    out_alpha = dest * (255 - source) + source * 255
+    weight = source * (255 * 255 << 7) // np.maximum(out_alpha, 1)
+    out_alpha += 0x80
+    return weight.ravel(), ((out_alpha + (out_alpha >> 8)) >> 8).astype(np.uint8).ravel()
+
+COMPOSITE_WEIGHTS, COMPOSITE_ALPHAS = _composite_tables()
+
+def _composite_fills(color):
+    # Over nothing the colour is copied as is wherever alpha is nonzero
+    alpha = np.arange(256)
+    return _pixel_table([np.where(alpha > 0, source, 0) for source in color] + [alpha])
+
+def _composite_block(region, color, alpha):
+    index = alpha.astype(np.uint16) << 8
+    index |= region[:, :, 3]
+    weight = COMPOSITE_WEIGHTS[index]
+    keep = (255 << 7) - weight
+    for channel, source in enumerate(color):
+        mixed = region[:, :, channel] * keep
+        mixed += weight * source
+        mixed += 0x80 << 7
+        mixed += mixed >> 8
+        mixed >>= 15
+        region[:, :, channel] = mixed
+    region[:, :, 3] = COMPOSITE_ALPHAS[index]
+
+def adjust_overlay_contrast(overlay, contrast_factor):
+    """Lower the contrast of the overlay colours, leaving its alpha untouched."""
+    with span('contrast'):
+        return _adjust_overlay_contrast(overlay, contrast_factor)
+
+def _adjust_overlay_contrast(overlay, contrast_factor):
+    overlay_rgb = overlay.convert('RGB')
+    overlay_rgb = ImageEnhance.Contrast(overlay_rgb).enhance(contrast_factor)
+    return Image.merge('RGBA', (*overlay_rgb.split(), overlay.split()[3]))
+
+def contrast_lut(mean, contrast_factor):
+    """Return the uint8 table ImageEnhance.Contrast applies for a given luma mean.
+
+    Pillow blends towards the mean in float32 and truncates, so the table is
+    built the same way and matches it exactly.
+    """
+    values = np.arange(256, dtype=np.float32)
+    mean = np.float32(mean)
+    return (mean + np.float32(contrast_factor) * (values - mean)).astype(np.uint8)
+
+def multiply_blend(result, overlay):
+    """Multiply-blend the RGBA overlay onto the RGBA page.
+
+    Multiply blend darkens paper while preserving text contrast:
+    result = original * (overlay_color / 255)
+    Text (dark) stays dark; paper (light) picks up stain color.
+    This keeps text readable even at maximum intensity.
+    """
+    with span('blend'):
+        result_arr = np.array(result)
+        overlay_arr = np.asarray(overlay)
+        height = result_arr.shape[0]
+        for top in range(0, height, FINISH_BLOCK_ROWS):
+            rows = slice(top, min(top + FINISH_BLOCK_ROWS, height))
+            _blend_block(result_arr[rows], 255 - overlay_arr[rows, :, :3], overlay_arr[rows, :, 3:4])
+        return Image.fromarray(result_arr)
+
+def _blend_block(page, absorbed, alpha):
+    """Multiply-blend onto the RGB channels of an RGBA page block in place.
+
+    absorbed is 255 minus the overlay colour. With everything scaled to 0..1
+    the blend is original * (1 - alpha * absorbed), evaluated in uint16:
+      keep = 255 - alpha * absorbed / 255
+      final = original * keep / 255
+    Both divisions round via (t + 128 + ((t + 128) >> 8)) >> 8, which is exact
+    for t <= 255 * 255, and the result stays within 1 of the float blend.
+    """
+    keep = alpha.astype(np.uint16) * absorbed
+    _div255(keep)
+    np.subtract(255, keep, out=keep)
+    keep *= page[:, :, :3]
+    _div255(keep)
+    page[:, :, :3] = keep
+
+def _div255(values):
+    """Divide a uint16 array of products of two bytes by 255 in place, rounding."""
+    values += 128
+    values += values >> 8
+    values >>= 8
+
+def finish_overlay(result, overlay, contrast_factor, grain_intensity, boxes=None, threads=None):
+    """Lower contrast, add grain and multiply-blend the overlay onto the page.
+
+    Does the work of adjust_overlay_contrast, apply_grain_to_overlay and
+    multiply_blend in one pass over blocks of rows, without intermediate
+    images. With boxes, only those regions are processed; pixels outside
+    them must be untouched (0, 0, 0, 0) in the overlay, and the page there
+    is copied unchanged. Without, the page is split into bands of TILE_SIZE
+    rows. The boxes are finished on up to threads threads (default
+    RENDER_THREADS), each in blocks of FINISH_BLOCK_ROWS rows that stay in
+    cache; the result is the same for any number of threads.
+    Returns the finished page.
+    """
+    with span('finish'):
+        result_arr = np.array(result)
+        overlay_arr = np.asarray(overlay)
+        height, width = overlay_arr.shape[:2]
+        if boxes is None:
+            boxes = [(0, top, width, min(top + TILE_SIZE, height)) for top in range(0, height, TILE_SIZE)]
+        threads = min(RENDER_THREADS if threads is None else threads, len(boxes))
+
+        # Contrast pulls colours towards the overlay's mean luma, taken over
+        # the whole frame like ImageEnhance.Contrast; untouched pixels are
+        # black, so summing over the boxes alone gives the same mean.
+        def box_luma(box):
+            left, top, right, bottom = box
+            total = 0
+            for block_top in range(top, bottom, FINISH_BLOCK_ROWS):
+                block = overlay_arr[block_top:min(block_top + FINISH_BLOCK_ROWS, bottom), left:right]
+                luma = block[:, :, 0] * np.uint32(19595)
+                luma += block[:, :, 1] * np.uint32(38470)
+                luma += block[:, :, 2] * np.uint32(7471)
+                luma += 0x8000
+                luma >>= 16
+                total += int(luma.sum())
+            return total
+
+        luma_total = sum(run_threaded(box_luma, boxes, threads))
+        lut = contrast_lut(int(luma_total / (width * height) + 0.5), contrast_factor)
+        absorbed_lut = (255 - lut).astype(np.int16)
+
+        def finish_box(item):
+            (left, top, right, bottom), noise = item
+            grain = (noise * np.float32(grain_intensity)).astype(np.int16)
+            for block_top in range(top, bottom, FINISH_BLOCK_ROWS):
+                rows = slice(block_top, min(block_top + FINISH_BLOCK_ROWS, bottom))
+                block = overlay_arr[rows, left:right]
+                # 255 - clip(contrast(colour) + grain), straight from the table
+                absorbed = absorbed_lut[block[:, :, :3]]
+                absorbed -= grain[rows.start - top:rows.stop - top, :, None]
+                np.clip(absorbed, 0, 255, out=absorbed)
+                _blend_block(result_arr[rows, left:right], absorbed.view(np.uint16), block[:, :, 3:4])
+
+        # The grain's placement comes from the global NumPy random state, so
+        # each box's noise is drawn here, in box order, as the box is handed out
+        run_threaded(finish_box, ((box, noise_field(box[2] - box[0], box[3] - box[1], -30, 30))
+                                  for box in boxes), threads)
+
+        return Image.fromarray(result_arr)
+
+# Extended color palette for natural aging — manuscript-accurate tones
+AGING_COLORS = [
+    # Amber / Ochre / Light Tan (water stain tea-staining)
+    (195, 155, 80), (185, 145, 75), (175, 140, 70), (200, 160, 90),
+    (190, 150, 85), (180, 142, 78), (170, 135, 68),
+    # Brown/Sepia tones (ink stains)
+    (101, 67, 33), (92, 64, 51), (80, 60, 40), (70, 50, 30),
+    # Grayish tones (mold, dirt, dust)
+    (120, 115, 100), (100, 95, 85), (90, 85, 75),
+    # Burnt Sienna / Rust (oxidation weathering)
+    (160, 82, 45), (145, 75, 40), (170, 90, 50), (155, 80, 42),
+    (130, 80, 50), (110, 70, 40), (140, 90, 60),
+    # Greenish gray (moisture, mildew)
+    (100, 110, 90), (85, 95, 80),
+    # Dark grays (soot, dirt)
+    (60, 55, 50), (75, 70, 65),
+    # Paper-matching dark tan/brown (large water damage look)
+    (140, 115, 75), (130, 105, 65), (120, 95, 60),
+    (110, 90, 55), (150, 120, 80), (105, 85, 55),
+    (95, 75, 50), (85, 70, 45)
+]
+
+# Water stain colors — Amber / Ochre / Tan + darker damage browns
+WATER_STAIN_COLORS = [
+    (195, 155, 80), (185, 145, 75), (200, 160, 90),
+    (175, 140, 70), (190, 150, 85), (180, 142, 78),
+    (170, 135, 68), (165, 130, 65), (160, 125, 60),
+    (155, 120, 58), (150, 118, 55), (145, 112, 52),
+    # Darker damage browns (for severe water staining)
+    (120, 90, 48), (105, 75, 40), (90, 65, 35),
+    (80, 58, 30), (110, 82, 42), (95, 68, 36)
+]
+
+# Very dark damage colors — near-black browns for severe patches
+DARK_DAMAGE_COLORS = [
+    (55, 40, 28), (45, 35, 25), (65, 48, 32),
+    (40, 30, 20), (50, 38, 25), (60, 42, 28),
+    (70, 50, 30), (35, 28, 18), (75, 55, 35)
+]
+
+# Ink smudge colors — Deep Charcoal, Sepia, Black (carbon-based ink)
+INK_COLORS = [
+    (25, 22, 20), (35, 30, 28), (45, 40, 38), (55, 48, 42),
+    (30, 28, 25), (40, 35, 30), (20, 18, 15), (50, 45, 40),
+    (65, 55, 45), (75, 65, 50)  # sepia tones
+]
+
+# Darker ink tones only, for splatter
+DARK_INK_COLORS = INK_COLORS[:6]
+
+# Deep black / charcoal — concentrated carbon ink
+BLOTCH_INK_COLORS = [(15, 12, 10), (20, 18, 15), (25, 22, 20), (30, 28, 25), (10, 8, 6)]
+
+# Faded sepia/charcoal
+FADED_INK_COLORS = [(65, 55, 45), (75, 65, 50), (85, 75, 60), (95, 85, 70)]
+
+# Weathering/oxidation colors — Burnt Sienna, Rust
+WEATHERING_COLORS = [
+    (160, 82, 45), (145, 75, 40), (170, 90, 50), (155, 80, 42),
+    (180, 95, 55), (150, 78, 38), (140, 72, 35), (165, 85, 48),
+    (135, 68, 32), (175, 88, 52)
+]
+
+COFFEE_COLORS = [
+    (120, 80, 50), (110, 70, 40), (130, 85, 55), (145, 95, 60),
+    (135, 82, 48), (125, 78, 45)
+]
+
+GRIME_COLORS = [
+    (90, 85, 75), (85, 80, 70), (100, 95, 85), (75, 70, 65),
+    (95, 88, 78), (80, 75, 65)
+]
+
+ALGAE_COLORS = [
+    # Dark olive / mold greens
+    (75, 85, 50), (65, 80, 45), (80, 90, 55), (55, 70, 40),
+    # Brownish-green (dried algae)
+    (90, 85, 55), (80, 75, 50), (100, 90, 60),
+    # Very dark green-grey (heavy mold)
+    (50, 60, 40), (60, 65, 45)
+]
+
+FINGERPRINT_COLORS = [(80, 60, 40), (70, 50, 30), (90, 70, 50)]
+STREAK_COLORS = [(92, 64, 51), (80, 60, 40), (100, 95, 85), (110, 70, 40)]
+SOOT_COLORS = [(40, 40, 40), (55, 50, 50), (60, 60, 60)]
+MUD_COLORS = [(90, 70, 50), (100, 80, 55), (80, 60, 40), (120, 95, 60)]
+AGE_RING_COLORS = [(150, 130, 100), (140, 120, 85), (160, 140, 110), (145, 125, 95)]
+HALO_COLORS = [(80, 70, 55), (70, 60, 45), (90, 80, 65)]
+FADING_COLORS = [(110, 105, 95), (120, 115, 105), (100, 95, 85)]
+TEXT_SMUDGE_COLORS = [(70, 65, 55), (85, 80, 70), (65, 60, 50)]
+
+# Page effect colors
+CORNER_COLORS = [(80, 70, 55), (90, 80, 65), (70, 60, 50), (60, 50, 40)]
+CRACK_COLORS = [(60, 50, 40), (70, 60, 50), (50, 40, 30)]
+TIDE_COLORS = [(120, 110, 90), (115, 105, 85), (130, 120, 100)]
+TORN_EDGE_COLORS = [(70, 60, 50), (80, 65, 50), (60, 50, 40)]
+EDGE_DARKENING_COLORS = [
+    (55, 40, 28), (45, 35, 25), (65, 48, 32),   # very dark brown
+    (75, 55, 35), (50, 38, 25), (60, 45, 30),   # dark umber
+    (40, 30, 20), (70, 50, 30), (80, 58, 38),   # near-black brown
+]
+
+class MarkType:
+    """Registry entry describing how one mark type is sampled and drawn.
+
+    Local marks call generator(size, rng) with a size drawn from size_range
+    (fractions of the page's shorter side) and are placed on the page; their
+    mask is a square canvas of size * canvas_scale. Full-frame marks call
+    generator(width, height, rng) and cover the page. cost is a rough class
+    ('low', 'medium' or 'high') of the time one mark takes on an A4 page at
+    150 dpi; weight is the base probability of picking the type. min_scale
+    is the lowest mask resolution the type can be drawn at and upsampled
+    without visibly changing; types with thin, sharp features keep 1.0.
+    Generators built from SoftShapes take a rasterizer argument, and
+    rasterizer picks it ('polygon' or 'sdf'); it is None for the others.
+    """
+
+    __slots__ = ('name', 'generator', 'palette', 'scope', 'size_range', 'canvas_scale',
+                 'cost', 'weight', 'intensity_range', 'stain', 'alpha_cap', 'min_scale', 'rasterizer')
+
+    def __init__(self, name, generator, palette, weight, intensity_range, cost,
+                 size_range=None, canvas_scale=None, stain=False, alpha_cap=245, min_scale=0.25,
+                 rasterizer=None):
+        self.name = name
+        self.generator = generator
+        self.palette = palette
+        self.scope = 'full' if size_range is None else 'local'
+        self.size_range = size_range
+        self.canvas_scale = canvas_scale
+        self.cost = cost
+        self.weight = weight
+        self.intensity_range = intensity_range
+        self.stain = stain
+        self.alpha_cap = alpha_cap
+        self.min_scale = min_scale
+        self.rasterizer = rasterizer
+
+    def __repr__(self):
+        return f"MarkType({self.name!r}, scope={self.scope!r}, cost={self.cost!r})"
+
+# Every mark type apply_smudges can pick. Stains are placed near edges and
+# corners more often than other marks.
+MARK_TYPES = {mark.name: mark for mark in [
+    MarkType('blob', lambda size, rng, rasterizer: create_organic_blob(size, rng.uniform(0.3, 0.6), rng, rasterizer),
+             AGING_COLORS, 0.06, (1.1, 1.6), 'high', (0.15, 0.45), 2.5, rasterizer='polygon'),
+    # Amber / Ochre / Light Tan — tea-staining from aged moisture
+    MarkType('water_stain', create_water_stain, WATER_STAIN_COLORS, 0.14, (1.0, 1.6), 'high',
+             (0.30, 0.70), 3.0, stain=True, rasterizer='polygon'),
+    MarkType('fingerprint', create_fingerprint_mark, FINGERPRINT_COLORS, 0.04, (0.8, 1.3), 'low',
+             (0.08, 0.20), 2.0, min_scale=0.5, rasterizer='sdf'),
+    MarkType('dust', create_dust_speckles, AGING_COLORS, 0.05, (0.9, 1.3), 'low',
+             (0.12, 0.30), 2.0, min_scale=1.0),
+    MarkType('streak', create_streak_mark, STREAK_COLORS, 0.04, (0.8, 1.3), 'low',
+             (0.12, 0.35), 2.0, min_scale=1.0),
+    # Deep Charcoal / Sepia / Black — carbon-based ink
+    MarkType('bleeding_ink', create_bleeding_ink, INK_COLORS, 0.04, (0.8, 1.3), 'low',
+             (0.08, 0.22), 2.2, rasterizer='polygon'),
+    MarkType('faded_ink', lambda size, rng, rasterizer: create_organic_blob(size, rng.uniform(0.2, 0.5), rng, rasterizer),
+             FADED_INK_COLORS, 0.03, (0.8, 1.3), 'medium', (0.10, 0.28), 2.5, rasterizer='polygon'),
+    # Deep Charcoal / Sepia — carbon ink smudge
+    MarkType('smudged_calligraphy', create_streak_mark, INK_COLORS, 0.03, (0.9, 1.4), 'low',
+             (0.10, 0.28), 2.0, min_scale=1.0),
+    MarkType('moisture_damage', create_water_stain, WATER_STAIN_COLORS, 0.08, (1.0, 1.5), 'high',
+             (0.30, 0.65), 3.0, stain=True, rasterizer='polygon'),
+    MarkType('soot_stain', create_soot_stain, SOOT_COLORS, 0.03, (0.8, 1.3), 'medium',
+             (0.15, 0.35), 2.4, rasterizer='polygon'),
+    MarkType('atmospheric_grime', create_atmospheric_grime, GRIME_COLORS, 0.07, (0.8, 1.3), 'medium',
+             (0.18, 0.45), 2.4, stain=True, rasterizer='sdf'),
+    MarkType('coffee_mark', create_coffee_ring, COFFEE_COLORS, 0.06, (0.9, 1.4), 'medium',
+             (0.18, 0.45), 2.6, stain=True, rasterizer='polygon'),
+    MarkType('muddy_mark', lambda size, rng, rasterizer: create_organic_blob(size, rng.uniform(0.4, 0.7), rng, rasterizer),
+             MUD_COLORS, 0.03, (0.9, 1.5), 'medium', (0.15, 0.40), 2.5, rasterizer='polygon'),
+    MarkType('heavy_ink_blotch', create_heavy_ink_blotch, BLOTCH_INK_COLORS, 0.08, (1.1, 1.6), 'medium',
+             (0.22, 0.55), 2.8, rasterizer='polygon'),
+    MarkType('age_rings', create_age_rings, AGE_RING_COLORS, 0.05, (0.9, 1.4), 'medium',
+             (0.20, 0.45), 2.2, stain=True, rasterizer='sdf'),
+    MarkType('ink_halo', create_ink_halo, HALO_COLORS, 0.04, (0.8, 1.2), 'medium',
+             (0.12, 0.30), 2.4),
+    # Burnt Sienna / Rust — oxidation spots
+    MarkType('foxing_spots', create_foxing_spots, WEATHERING_COLORS, 0.08, (0.9, 1.4), 'low',
+             (0.18, 0.40), 2.0, stain=True, rasterizer='sdf'),
+    MarkType('uneven_fading', create_uneven_fading, FADING_COLORS, 0.05, (0.8, 1.2), 'medium',
+             (0.18, 0.45), 2.6, rasterizer='polygon'),
+    MarkType('text_area_smudge', create_text_area_smudge, TEXT_SMUDGE_COLORS, 0.07, (0.8, 1.3), 'medium',
+             (0.15, 0.35), 2.5, stain=True, rasterizer='polygon'),
+    # Full-frame marks: rust oxidation, algae/mold, scattered ink dots,
+    # edge-spreading water stains and severe dark damage at the edges
+    MarkType('rust_stains', create_rust_stains, WEATHERING_COLORS, 0.03, (0.6, 1.1), 'medium',
+             alpha_cap=255, min_scale=1.0),
+    MarkType('algae_growth', create_algae_growth, ALGAE_COLORS, 0.10, (0.7, 1.2), 'high',
+             stain=True, alpha_cap=240, min_scale=0.5),
+    MarkType('ink_splatter', create_ink_splatter, DARK_INK_COLORS, 0.10, (0.7, 1.2), 'low', min_scale=1.0),
+    MarkType('edge_water_stain', create_edge_water_stain, WATER_STAIN_COLORS, 0.12, (1.0, 1.6), 'high',
+             stain=True, min_scale=0.5),
+    MarkType('dark_damage', create_dark_damage_patch, DARK_DAMAGE_COLORS, 0.10, (0.9, 1.4), 'high',
+             stain=True, min_scale=0.5),
+]}
+
+# Mark types and their base probabilities
+MARK_WEIGHTS = {name: mark.weight for name, mark in MARK_TYPES.items()}
+
+STAIN_TYPES = {name for name, mark in MARK_TYPES.items() if mark.stain}
+
+# Corner aging positions, as the (x, y) a MarkSpec stores for them
+CORNERS = {
+    'top-left': (0, 0),
+    'top-right': (1, 0),
+    'bottom-left': (0, 1),
+    'bottom-right': (1, 1)
+}
+
+def _corner_aging_mask(spec, width, height, rng):
+    corner = next(name for name, xy in CORNERS.items() if xy == (spec.x, spec.y))
+    return create_corner_aging(width, height, corner, rng=rng)
+
+def _torn_edge_mask(spec, width, height, rng):
+    return create_torn_paper_edge(width, height, rng=rng)
+
+# Lowest mask resolution for each page effect (see MarkType.min_scale)
+PAGE_EFFECT_MIN_SCALES = {
+    'corner_aging': 0.25,
+    'crack': 1.0,
+    'moisture_tide': 1.0,
+    'torn_edge': 1.0,
+    'edge_darkening': 0.25,
+}
+
+# Page effects sampled by plan_effects: generator(spec, width, height, rng)
+PAGE_EFFECTS = {
+    'corner_aging': _corner_aging_mask,
+    'crack': lambda spec, width, height, rng: create_crack_pattern(width, height, rng=rng),
+    'moisture_tide': lambda spec, width, height, rng: create_moisture_tide_mark(width, height, rng=rng),
+    'torn_edge': _torn_edge_mask,
+    'edge_darkening': lambda spec, width, height, rng: create_edge_darkening(width, height, rng=rng),
+}
+
+def plan_mark(mark_type, width, height, rng=random):
+    """Sample one mark of mark_type for a width x height page.
+
+    Picks the mark's sub-seed, size, colour, intensity modifier and placement
+    and returns them as a MarkSpec; nothing is drawn until render_mark().
+    """
+    mark = MARK_TYPES.get(mark_type)
+    if mark is None:
+        raise ValueError(f"unknown mark type: {mark_type!r}")
+    seed = rng.getrandbits(32)
+
+    if mark.scope == 'full':
+        # Full-frame marks span the whole image - no size or position
+        color = rng.choice(mark.palette)
+        intensity_mod = rng.uniform(*mark.intensity_range)
+        return MarkSpec(mark_type, seed, color, intensity_mod, mark.alpha_cap)
+
+    # Variable size for each mark
+    base_size = min(width, height)
+    smudge_size = rng.randint(int(base_size * mark.size_range[0]), int(base_size * mark.size_range[1]))
+    color = rng.choice(mark.palette)
+    intensity_mod = rng.uniform(*mark.intensity_range)
+
+    # Calculate maximum valid positions for the generator's square canvas
+    canvas_size = int(smudge_size * mark.canvas_scale)
+    max_x = max(0, width - canvas_size)
+    max_y = max(0, height - canvas_size)
+
+    # Calculate margin with safety checks
+    edge_bias = rng.uniform(0.7, 1.8) if mark.stain else rng.uniform(0.4, 1.2)
+    margin = int(smudge_size * edge_bias)
+    margin = max(0, min(margin, min(width, height) // 4))
+
+    # Sometimes place marks near edges or corners for natural look
+    edge_prob = 0.6 if mark.stain else 0.25
+    if rng.random() < edge_prob and max_x > 0 and max_y > 0:  # bias stains to edges/corners
+        if rng.random() < 0.5:
+            # Place on left or right edge
+            if rng.random() < 0.5 and margin > 0:
+                # Left edge
+                pos_x = rng.randint(0, min(margin, max_x))
+            else:
+                # Right edge
+                left_edge = max(0, width - margin - canvas_size)
+                if left_edge <= max_x:
+                    pos_x = rng.randint(left_edge, max_x)
+                else:
+                    pos_x = rng.randint(0, max_x)
+            pos_y = rng.randint(0, max_y)
+        else:
+            # Place on top or bottom edge
+            pos_x = rng.randint(0, max_x)
+            if rng.random() < 0.5 and margin > 0:
+                # Top edge
+                pos_y = rng.randint(0, min(margin, max_y))
+            else:
+                # Bottom edge
+                top_edge = max(0, height - margin - canvas_size)
+                if top_edge <= max_y:
+                    pos_y = rng.randint(top_edge, max_y)
+                else:
+                    pos_y = rng.randint(0, max_y)
+    else:
+        # Normal placement - avoid edges if possible
+        min_x = min(margin, max_x)
+        min_y = min(margin, max_y)
+
+        # Calculate safe range
+        safe_max_x = max(min_x, max_x - margin)
+        safe_max_y = max(min_y, max_y - margin)
+
+        # Ensure valid range
+        if min_x <= safe_max_x:
+            pos_x = rng.randint(min_x, safe_max_x)
+        else:
+            pos_x = rng.randint(0, max_x) if max_x > 0 else 0
+
+        if min_y <= safe_max_y:
+            pos_y = rng.randint(min_y, safe_max_y)
+        else:
+            pos_y = rng.randint(0, max_y) if max_y > 0 else 0
+
+    return MarkSpec(mark_type, seed, color, intensity_mod, mark.alpha_cap,
+                    size=smudge_size / base_size,
+                    x=(pos_x + canvas_size / 2) / width,
+                    y=(pos_y + canvas_size / 2) / height)
+
+def plan_effects(width, height, aging_level='medium', rng=random):
+    """Sample the page-wide effects for an aging level as a list of MarkSpecs."""
+    plan = []
+
+    # Aging level-based effects
+    # Light: basic smudges only
+    # Medium: add corners, grain, slight yellowing
+    # Heavy: add all effects including folds, cracks, vignette, strong yellowing
+    # Extreme: maximum intensity of all effects
+
+    # Randomly add corner aging (probability based on aging level)
+    corner_prob = {
+        'light': 0.2,
+        'medium': 0.4,
+        'heavy': 0.6,
+        'extreme': 0.9
+    }.get(aging_level, 0.4)
+
+    for corner, (corner_x, corner_y) in CORNERS.items():
+        if rng.random() < corner_prob:
+            corner_color = rng.choice(CORNER_COLORS)
+            corner_intensity_mult = 0.6 if aging_level != 'extreme' else 0.9
+            plan.append(MarkSpec('corner_aging', rng.getrandbits(32), corner_color,
+                                 corner_intensity_mult, x=corner_x, y=corner_y))
+
+    # Note: vignette removed to preserve original page color
+
+    # Add cracks (heavy and extreme)
+    if aging_level in ['heavy', 'extreme']:
+        num_cracks = rng.randint(0, 2) if aging_level == 'heavy' else rng.randint(2, 4)
+        for _ in range(num_cracks):
+            crack_color = rng.choice(CRACK_COLORS)
+            crack_intensity_mult = 0.8 if aging_level == 'heavy' else 1.1
+            plan.append(MarkSpec('crack', rng.getrandbits(32), crack_color, crack_intensity_mult))
+
+    # Add moisture tide marks (heavy and extreme)
+    if aging_level in ['heavy', 'extreme']:
+        if rng.random() < (0.4 if aging_level == 'heavy' else 0.7):
+            tide_color = rng.choice(TIDE_COLORS)
+            tide_intensity_mult = 0.5 if aging_level == 'heavy' else 0.7
+            plan.append(MarkSpec('moisture_tide', rng.getrandbits(32), tide_color, tide_intensity_mult))
+
+    # Add torn edge effect to result (on corners/edges)
+    if aging_level in ['heavy', 'extreme']:
+        if rng.random() < (0.5 if aging_level == 'heavy' else 0.8):
+            torn_color = rng.choice(TORN_EDGE_COLORS)
+            torn_intensity_mult = 0.6 if aging_level == 'heavy' else 0.9
+            plan.append(MarkSpec('torn_edge', rng.getrandbits(32), torn_color, torn_intensity_mult / 255))
+
+    # Add edge darkening with very dark brown / burnt sienna oxidation
+    if rng.random() < (0.5 if aging_level == 'light' else 0.7 if aging_level == 'medium' else 0.90):
+        edge_color = rng.choice(EDGE_DARKENING_COLORS)
+        edge_intensity_mult = 0.4 if aging_level == 'light' else 0.6 if aging_level == 'medium' else 0.8 if aging_level == 'heavy' else 1.0
+        plan.append(MarkSpec('edge_darkening', rng.getrandbits(32), edge_color, edge_intensity_mult, 245))
+
+    return plan
+
+def plan_render(width, height, num_smudges=3, aging_level='medium', preferences=None, rng=random):
+    """Sample a full render for a width x height page: marks first, then page effects.
+
+    preferences multiplies the base MARK_WEIGHTS per type (see load_preferences).
+    """
+    preferences = preferences or {}
+    kinds = list(MARK_WEIGHTS)
+    weights = [weight * preferences.get(kind, 1.0) for kind, weight in MARK_WEIGHTS.items()]
+    plan = []
+    for _ in range(num_smudges):
+        # Choose random mark type based on weights
+        mark_type = rng.choices(kinds, weights=weights)[0]
+        plan.append(plan_mark(mark_type, width, height, rng))
+    plan.extend(plan_effects(width, height, aging_level, rng))
+    return plan
+
+def render_mark(spec, width, height, scale=1.0):
+    """Draw one MarkSpec for a width x height page and return its layer records.
+
+    A mark or full-page effect makes one layer; a border effect makes one
+    per part (see draw_border), so the page interior is never touched.
+    With scale below 1 the mask is drawn at that fraction of its resolution
+    and upsampled, which costs roughly scale squared of the full render but
+    loses fine detail (used by latency budgets).
+    """
+    rng = random.Random(spec.seed)
+    kind = spec.kind
+
+    effect = PAGE_EFFECTS.get(kind)
+    mark = MARK_TYPES.get(kind)
+    if effect is None and mark is None:
+        raise ValueError(f"unknown mark type: {kind!r}")
+
+    if effect is not None or mark.scope == 'full':
+        draw_width = max(1, round(width * scale))
+        draw_height = max(1, round(height * scale))
+        if effect is not None:
+            mask = effect(spec, draw_width, draw_height, rng)
+        else:
+            mask = mark.generator(draw_width, draw_height, rng=rng)
+            count('mask_pixels:' + kind, draw_width * draw_height)
+        if isinstance(mask, list):
+            return [make_layer(kind, part, spec.color, spec.intensity_mod, spec.alpha_cap,
+                               position=position, spec=spec, op='composite')
+                    for part, position in _upsample_parts(mask, (draw_width, draw_height), (width, height))]
+        if scale < 1.0:
+            mask = _upsample_mask(mask, (width, height))
+        return [make_layer(kind, np.asarray(mask, dtype=np.uint8), spec.color, spec.intensity_mod,
+                           spec.alpha_cap, spec=spec)]
+
+    smudge_size = max(1, round(spec.size * min(width, height)))
+    if mark.rasterizer is None:
+        mask = mark.generator(max(1, round(smudge_size * scale)), rng=rng)
+    else:
+        mask = mark.generator(max(1, round(smudge_size * scale)), rng=rng, rasterizer=mark.rasterizer)
+    count('mask_pixels:' + kind, mask.width * mask.height)
+    if scale < 1.0:
+        canvas_size = max(1, int(smudge_size * mark.canvas_scale))
+        mask = _upsample_mask(mask, (canvas_size, canvas_size))
+
+    # Centre the mask on the planned point, kept on the page like the planner did
+    pos_x = min(max(0, round(spec.x * width - mask.width / 2)), max(0, width - mask.width))
+    pos_y = min(max(0, round(spec.y * height - mask.height / 2)), max(0, height - mask.height))
+    # A mask larger than the page only keeps the part that lands on it
+    mask = np.array(mask)[:height - pos_y, :width - pos_x]
+    return [make_layer(kind, mask, spec.color, spec.intensity_mod, spec.alpha_cap,
+                       position=(pos_x, pos_y), spec=spec)]
+
+def _upsample_mask(mask, size):
+    """Resize a reduced-resolution mask (PIL image or uint8 array) up to size."""
+    if not isinstance(mask, Image.Image):
+        mask = Image.fromarray(np.asarray(mask, dtype=np.uint8))
+    with span('upsample'):
+        return mask.resize(size, Image.BILINEAR)
+
+def _upsample_parts(parts, draw_size, size):
+    """Map the parts of a border effect drawn at draw_size onto a page of size.
+
+    Part edges are mapped through the same rounding, so parts that tiled the
+    reduced page tile the full one.
+    """
+    if draw_size == size:
+        return parts
+    def across(x):
+        return round(x * size[0] / draw_size[0])
+    def down(y):
+        return round(y * size[1] / draw_size[1])
+    upsampled = []
+    for part, (left, top) in parts:
+        box = (across(left), down(top), across(left + part.shape[1]), down(top + part.shape[0]))
+        if box[2] > box[0] and box[3] > box[1]:
+            upsampled.append((np.asarray(_upsample_mask(part, (box[2] - box[0], box[3] - box[1]))),
+                              box[:2]))
+    return upsampled
+
+def render_plan(plan, width, height, scales=None, threads=None):
+    """Draw every MarkSpec of a plan for a width x height page, in plan order.
+
+    The plan may come from a page of another size; sizes and positions are
+    stored relative to the page and scale with it. scales optionally gives
+    each spec's mask resolution (see render_mark and budget_scales); specs
+    with scale 0 are left out. Each layer records the scale it was drawn at
+    (see layer_scales).
+
+    The masks are drawn on up to threads threads (default RENDER_THREADS).
+    Every spec draws from its own seed, so the layers, returned in plan
+    order, are the same however many threads draw them.
+    """
+    jobs = [(spec, scales[index] if scales is not None else 1.0) for index, spec in enumerate(plan)]
+    jobs = [(spec, scale) for spec, scale in jobs if scale > 0]
+
+    def draw(job):
+        spec, scale = job
+        if spec.kind in MARK_WEIGHTS:
+            with span('mark:' + spec.kind):
+                layers = render_mark(spec, width, height, scale)
+        else:
+            layers = render_mark(spec, width, height, scale)
+        for layer in layers:
+            layer['scale'] = scale
+        return layers
+
+    threads = min(RENDER_THREADS if threads is None else threads, len(jobs))
+    if threads > 1:
+        count('render_threads', threads)
+    return [layer for mark_layers in run_threaded(draw, jobs, threads) for layer in mark_layers]
+
+def layer_specs(layers):
+    """Return the MarkSpecs a layer stack was drawn from, once each, in order.
+
+    The parts of a border effect are consecutive layers sharing one spec.
+    """
+    specs = []
+    for layer in layers:
+        if not specs or layer['spec'] is not specs[-1]:
+            specs.append(layer['spec'])
+    return specs
+
+def layer_scales(layers):
+    """Return the mask scale each MarkSpec of a layer stack was drawn at, in layer_specs order.
+
+    Passed to render_plan with layer_specs(layers), it redraws the stack as
+    it was, marks degraded by a latency budget included. Layers not drawn
+    by render_plan count as full scale.
+    """
+    specs, scales = [], []
+    for layer in layers:
+        if not specs or layer['spec'] is not specs[-1]:
+            specs.append(layer['spec'])
+            scales.append(layer.get('scale', 1.0))
+    return scales
+
+def spec_megapixels(spec, width, height):
+    """Return the size in megapixels of the full-resolution mask a spec draws."""
+    mark = MARK_TYPES.get(spec.kind)
+    if mark is None or mark.scope == 'full':
+        return width * height / 1e6
+    canvas_size = int(max(1, round(spec.size * min(width, height))) * mark.canvas_scale)
+    return canvas_size * canvas_size / 1e6
+
+def budget_scales(plan, width, height, budget_ms, model=None):
+    """Choose per-spec mask scales so the estimated render fits in budget_ms.
+
+    Starting from full resolution, the mark whose next step down in
+    SCALE_STEPS saves the most estimated time is degraded first, so large
+    full-frame effects lose resolution before small local marks do; no mark
+    goes below its type's min_scale. If the render still overruns with every
+    mask at its smallest step, the most expensive marks are left out (scale
+    0), as long as that can bring it within budget. Finishing is counted but
+    never degraded.
+
+    Returns:
+        Tuple of (list of scales, report dict with the budget, the estimated
+        time at full and chosen quality, whether it fits, and one entry per
+        degraded or dropped spec)
+    """
+    model = model or load_cost_model()
+    megapixels = [spec_megapixels(spec, width, height) for spec in plan]
+    min_scales = [MARK_TYPES[spec.kind].min_scale if spec.kind in MARK_TYPES
+                  else PAGE_EFFECT_MIN_SCALES.get(spec.kind, 1.0) for spec in plan]
+    steps = [0] * len(plan)
+    costs = [model.mark_ms(spec.kind, mp) + model.composite_ms(mp) for spec, mp in zip(plan, megapixels)]
+    full_ms = model.finish_ms(width * height / 1e6) + sum(costs)
+    total_ms = full_ms
+
+    while total_ms > budget_ms:
+        best, best_saving = None, 0.0
+        for index, spec in enumerate(plan):
+            if steps[index] + 1 < len(SCALE_STEPS) and SCALE_STEPS[steps[index] + 1] >= min_scales[index]:
+                cheaper = (model.mark_ms(spec.kind, megapixels[index], SCALE_STEPS[steps[index] + 1])
+                           + model.composite_ms(megapixels[index]))
+                if costs[index] - cheaper > best_saving:
+                    best, best_saving = index, costs[index] - cheaper
+        if best is None:
+            break
+        steps[best] += 1
+        costs[best] -= best_saving
+        total_ms -= best_saving
+
+    scales = [SCALE_STEPS[step] for step in steps]
+    if total_ms - sum(costs) <= budget_ms:
+        for index in sorted(range(len(plan)), key=lambda i: costs[i], reverse=True):
+            if total_ms <= budget_ms:
+                break
+            scales[index] = 0.0
+            total_ms -= costs[index]
+
+    return scales, {
+        'budget_ms': budget_ms,
+        'estimated_full_ms': round(full_ms, 1),
+        'estimated_ms': round(total_ms, 1),
+        'fits': total_ms <= budget_ms,
+        'model': model.source,
+        'degraded': [
+            {'index': index, 'kind': spec.kind, 'scale': scale}
+            for index, (spec, scale) in enumerate(zip(plan, scales)) if scale < 1.0
+        ],
+    }
+
+def estimate_render(width, height, num_smudges=3, aging_level='medium', format_choice=None,
+                    model=None, plan=None, samples=4):
+    """Predict the time and peak memory of apply_smudges on a width x height page.
+
+    Nothing is drawn: a few plans are sampled with a fixed seed, so the same
+    job always gets the same estimate, and priced with the cost model (a
+    given plan is priced as it is). format_choice adds the time to encode
+    the result for download.
+
+    Returns:
+        Dict with render_ms, encode_ms, total_ms, peak_bytes and megapixels
+    """
+    model = model or load_cost_model()
+    rng = random.Random(0)
+    plans = [plan] if plan is not None else [
+        plan_render(width, height, num_smudges, aging_level, rng=rng) for _ in range(samples)
+    ]
+    marks_ms = mask_megapixels = 0.0
+    for sampled_plan in plans:
+        for spec in sampled_plan:
+            megapixels = spec_megapixels(spec, width, height)
+            marks_ms += model.mark_ms(spec.kind, megapixels) + model.composite_ms(megapixels)
+            mask_megapixels += megapixels
+    page_megapixels = width * height / 1e6
+    render_ms = marks_ms / len(plans) + model.finish_ms(page_megapixels)
+    encode_ms = model.encode_ms(format_choice, page_megapixels) if format_choice else 0.0
+    return {
+        'render_ms': round(render_ms, 1),
+        'encode_ms': round(encode_ms, 1),
+        'total_ms': round(render_ms + encode_ms, 1),
+        'peak_bytes': int(model.peak_bytes(width * height, mask_megapixels / len(plans) * 1e6)),
+        'megapixels': round(page_megapixels, 2),
+    }
+
+def fit_render_size(width, height, num_smudges=3, aging_level='medium', format_choice=None,
+                    max_seconds=None, max_peak_bytes=None, model=None, plan=None):
+    """Return the largest page size, at the aspect ratio of width x height, within the limits.
+
+    The size is returned unchanged if its estimate (see estimate_render)
+    already fits; otherwise it shrinks until it does, down to a 64 pixel
+    shorter side.
+    """
+    scale = 1.0
+    while True:
+        size = (max(1, round(width * scale)), max(1, round(height * scale)))
+        estimate = estimate_render(size[0], size[1], num_smudges, aging_level, format_choice, model, plan)
+        if not check_limits(estimate, max_seconds, max_peak_bytes) or min(size) <= 64:
+            return size
+        ratio = 1.0
+        if max_seconds is not None:
+            ratio = min(ratio, max_seconds * 1000 / estimate['total_ms'])
+        if max_peak_bytes is not None:
+            ratio = min(ratio, max_peak_bytes / estimate['peak_bytes'])
+        # Costs grow with pixel count, so shrink both sides by the square root
+        scale *= min(0.95, math.sqrt(ratio))
+
+def calibrate_cost_model(width=1240, height=1754, repeats=3, path=COST_MODEL_FILE):
+    """Time every mark type and effect on this machine and save the fitted model.
+
+    Each type is drawn at full, half and quarter resolution for a width x
+    height page (repeats times, keeping the fastest) and fitted with
+    cost_model.fit_linear; compositing and finishing are timed the same way.
+    Peak memory is traced over whole renders of half and quarter size pages
+    with few and many marks, and encoding is timed on those renders.
+
+    Returns:
+        The calibrated CostModel
+    """
+    rng = random.Random(0)
+    mark_costs = {}
+    for kind in list(MARK_TYPES) + list(PAGE_EFFECTS):
+        if kind in MARK_TYPES:
+            spec = plan_mark(kind, width, height, rng)
+        else:
+            spec = MarkSpec(kind, rng.getrandbits(32), (0, 0, 0), 1.0, x=0, y=0)
+        megapixels = spec_megapixels(spec, width, height)
+        samples = []
+        for scale in (1.0, 0.5, 0.25):
+            best = min(_time_ms(render_mark, spec, width, height, scale) for _ in range(repeats))
+            upsample_ms = DEFAULT_UPSAMPLE_MS_PER_MP * megapixels if scale < 1.0 else 0.0
+            samples.append((megapixels * scale * scale, max(0.0, best - upsample_ms)))
+        mark_costs[kind] = fit_linear(samples)
+
+    page = Image.new('RGBA', (width, height), (232, 220, 190, 255))
+    finish_samples = []
+    for page_scale in (1.0, 0.5):
+        size = (max(1, round(width * page_scale)), max(1, round(height * page_scale)))
+        scaled_page = page.resize(size)
+        layers = [make_layer('calibration', np.full((size[1], size[0]), 128, dtype=np.uint8),
+                             (100, 80, 60), 1.0)]
+        best = min(_time_ms(recomposite, scaled_page, layers, 1.0, 'extreme') for _ in range(repeats))
+        finish_samples.append((size[0] * size[1] / 1e6, best))
+
+    def composite_one(layer):
+        # Half the overlay already holds marks, which is slower to blend onto
+        overlay = np.zeros((height, width, 4), dtype=np.uint8)
+        overlay[:height // 2] = 90
+        composite_layer(overlay, layer['color'], layer_alpha(layer, 1.0), layer['position'],
+                        layer['op'], tiles=new_tile_map(width, height))
+
+    composite_samples = []
+    for mask_scale in (1.0, 0.25):
+        size = (max(1, round(width * mask_scale)), max(1, round(height * mask_scale)))
+        layer = make_layer('calibration', np.full((size[1], size[0]), 128, dtype=np.uint8),
+                           (100, 80, 60), 1.0)
+        best = min(_time_ms(composite_one, layer) for _ in range(repeats))
+        composite_samples.append((size[0] * size[1] / 1e6, best))
+
+    memory_samples = []
+    encode_samples = {format_choice: [] for format_choice in ('PNG', 'JPEG', 'BMP', 'TIFF')}
+    for page_scale in (0.5, 0.25):
+        size = (max(1, round(width * page_scale)), max(1, round(height * page_scale)))
+        text_page = Image.new('RGB', size, (232, 220, 190))
+        draw = ImageDraw.Draw(text_page)
+        for y in range(20, size[1] - 20, 18):
+            draw.rectangle([20, y, size[0] - 20, y + 7], fill=(30, 25, 20))
+        for num_smudges in (5, 30):
+            plan = plan_render(size[0], size[1], num_smudges, 'extreme', rng=rng)
+            mask_pixels = sum(spec_megapixels(spec, *size) for spec in plan) * 1e6
+            tracemalloc.start()
+            try:
+                aged, _ = apply_smudges(text_page, plan=plan, aging_level='extreme')
+                peak = tracemalloc.get_traced_memory()[1]
+            finally:
+                tracemalloc.stop()
+            memory_samples.append((size[0] * size[1], mask_pixels, peak))
+        for format_choice, samples in encode_samples.items():
+            best = min(_time_ms(save_image_with_format, aged, format_choice, 300) for _ in range(repeats))
+            samples.append((size[0] * size[1] / 1e6, best))
+
+    model = CostModel(mark_costs, fit_linear(finish_samples), fit_linear(composite_samples),
+                      memory_cost=fit_memory(memory_samples),
+                      encode_costs={name: fit_linear(samples) for name, samples in encode_samples.items()},
+                      source=path)
+    save_cost_model(model, path)
+    return model
+
+def _time_ms(fn, *args):
+    start = time.perf_counter()
+    fn(*args)
+    return (time.perf_counter() - start) * 1000
+
+def plan_marks_used(plan):
+    """Return the distinct mark types of a plan in order of first use."""
+    marks_used = []
+    for spec in plan:
+        if spec.kind in MARK_WEIGHTS and spec.kind not in marks_used:
+            marks_used.append(spec.kind)
+    return marks_used
+
+def reroll_mark(layers, index, size):
+    """Return a copy of layers with one mark regenerated as a new mark of the same type.
+
+    index is the mark's first layer; every layer drawn from its spec is
+    replaced. Only mark layers (kinds in MARK_WEIGHTS) can be re-rolled;
+    page effects such as edge darkening come back with a full render.
+    """
+    kind = layers[index]['kind']
+    if kind not in MARK_WEIGHTS:
+        raise ValueError(f"'{kind}' is a page effect, not a mark, and cannot be re-rolled")
+    end = index + 1
+    while end < len(layers) and layers[end]['spec'] is layers[index]['spec']:
+        end += 1
+    layers = list(layers)
+    with span('mark:' + kind):
+        layers[index:end] = render_mark(plan_mark(kind, size[0], size[1]), size[0], size[1])
+    return layers
+
+@traced
+def apply_smudges(image, num_smudges=3, intensity=0.5, aging_level='medium', return_report=False,
+                  return_layers=False, plan=None, budget_ms=None, threads=None, preferences=None):
+    """
+    Apply varied organic aging effects to the image with multiple types and colors.
+    
+    Args:
+        image: PIL Image to process
+        num_smudges: Number of effects to apply
+        intensity: Overall opacity of effects (0-1)
+        aging_level: 'light', 'medium', 'heavy' or 'extreme'
+        return_report: Also return a performance report for this render
+        return_layers: Also return the layer stack, for recomposite()
+        plan: Render this list of MarkSpecs (see plan_render) instead of
+            sampling new marks; num_smudges is then ignored
+        budget_ms: Target render time. Masks are drawn at reduced resolution
+            where the cost model predicts the render would overrun it; the
+            report's annotations list what was degraded (see budget_scales)
+        threads: Threads drawing the masks and finishing the page (default
+            RENDER_THREADS); the result is the same for any number
+        preferences: Mark type weights to sample with (default: the saved
+            preferences, see load_preferences)
+    
+    Returns:
+        Tuple of (PIL Image with aging effects applied, list of mark types used).
+        With return_report=True a dict is added with total time, per-stage
+        times (marks, blur, feather, upsample, composite, finish), per-mark-type time and
+        mask size, and counters. With return_layers=True the list of layer
+        records (see make_layer) is added last; each carries its MarkSpec.
+    """
+    if return_report:
+        with collect() as stats:
+            outputs = apply_smudges(image, num_smudges, intensity, aging_level,
+                                    return_layers=return_layers, plan=plan, budget_ms=budget_ms,
+                                    threads=threads, preferences=preferences)
+        return outputs[:2] + (stats.as_dict(),) + outputs[2:]
+
+    # Convert to RGBA if not already
+    if image.mode != 'RGBA':
+        image = image.convert('RGBA')
+    
+    width, height = image.size
+    
+    # Sample every mark and effect first, weighted by the user's preferences
+    if plan is None:
+        with span('plan'):
+            if preferences is None:
+                preferences = load_preferences()
+            plan = plan_render(width, height, num_smudges, aging_level, preferences)
+    
+    # Then draw them; every mark and effect becomes a layer composited at the end
+    scales = None
+    if budget_ms is not None:
+        scales, budget = budget_scales(plan, width, height, budget_ms)
+        annotate('latency_budget', budget)
+        count('degraded_marks', len(budget['degraded']))
+    layers = render_plan(plan, width, height, scales, threads)
+    marks_used = plan_marks_used(plan)
+    
+    result = recomposite(image, layers, intensity, aging_level, threads)
+    if return_layers:
+        return result, marks_used, layers
+    return result, marks_used
+
+@traced
+def recomposite(image, layers, intensity=0.5, aging_level='medium', threads=None):
+    """Composite a layer stack from apply_smudges onto image and finish it.
+
+    This is the last step of apply_smudges. Calling it again with another
+    intensity or aging level re-renders the same marks without regenerating
+    any mask; here the aging level only sets the contrast and grain strength.
+    threads is passed on to finish_overlay.
+    """
+    if image.mode != 'RGBA':
+        image = image.convert('RGBA')
+    width, height = image.size
+    count('page_pixels', width * height)
+
+    # Overlay of all marks, and the grid of tiles they have drawn into
+    overlay = np.zeros((height, width, 4), dtype=np.uint8)
+    tiles = new_tile_map(width, height)
+    for layer in layers:
+        if layer['mask'].size:
+            composite_layer(overlay, layer['color'], layer_alpha(layer, intensity),
+                            layer['position'], layer['op'], tiles=tiles)
+
+    # Apply low contrast and grain to marks only so base paper color stays intact.
+    # Tiles no layer has drawn into have zero alpha and are skipped.
+    boxes = dirty_boxes(tiles, (width, height))
+    count('tiles', tiles.size)
+    count('dirty_tiles', int(tiles.sum()))
+    return finish_overlay(
+        image, overlay,
+        CONTRAST_FACTORS.get(aging_level, 0.92),
+        GRAIN_INTENSITIES.get(aging_level, 0.3),
+        boxes=boxes,
+        threads=threads
+    )
+
+def save_image_with_format(image, format_choice, dpi_value, max_bytes=1_000_000, metadata=None):
+    """Save image in specified format with DPI settings under a size limit.
+
+    metadata is a dict of text entries, such as an embedded render plan; it is
+    written to PNG text chunks and ignored by the other formats.
+    """
+    with span('encode'):
+        return _save_image_with_format(image, format_choice, dpi_value, max_bytes, metadata)
+
+def _save_image_with_format(image, format_choice, dpi_value, max_bytes, metadata=None):
+    # Convert DPI setting to inches for quality
+    pil_dpi = (dpi_value, dpi_value)
+    pnginfo = None
+    if metadata:
+        pnginfo = PngImagePlugin.PngInfo()
+        for key, value in metadata.items():
+            pnginfo.add_text(key, value, zip=True)
+
+    def encode_png(img, compress_level=9, use_quantize=False):
+        buf = io.BytesIO()
+        if use_quantize:
+            if img.mode in ['RGBA', 'LA']:
+                base = Image.new('RGBA', img.size, (255, 255, 255, 0))
+                base.paste(img)
+                img = base
+            img = img.convert('P', palette=Image.ADAPTIVE, colors=256)
+        img.save(buf, format='PNG', dpi=pil_dpi, optimize=True, compress_level=compress_level,
+                 pnginfo=pnginfo)
+        return buf.getvalue()
+
+    def encode_jpeg(img, quality=95):
+        buf = io.BytesIO()
+        if img.mode == 'RGBA':
+            rgb_image = Image.new('RGB', img.size, (255, 255, 255))
+            rgb_image.paste(img, mask=img.split()[3])
+            img = rgb_image
+        img.save(buf, format='JPEG', quality=quality, dpi=pil_dpi, optimize=True)
+        return buf.getvalue()
+
+    def encode_bmp(img):
+        buf = io.BytesIO()
+        if img.mode == 'RGBA':
+            rgb_image = Image.new('RGB', img.size, (255, 255, 255))
+            rgb_image.paste(img, mask=img.split()[3])
+            img = rgb_image
+        img.save(buf, format='BMP', dpi=pil_dpi)
+        return buf.getvalue()
+
+    def encode_tiff(img, compression='tiff_deflate'):
+        buf = io.BytesIO()
+        img.save(buf, format='TIFF', dpi=pil_dpi, compression=compression)
+        return buf.getvalue()
+
+    def resize_down(img, scale):
+        new_w = max(1, int(img.width * scale))
+        new_h = max(1, int(img.height * scale))
+        return img.resize((new_w, new_h), Image.LANCZOS)
+
+    working = image.copy()
+    extension = {'PNG': 'png', 'JPEG': 'jpg', 'BMP': 'bmp', 'TIFF': 'tif'}.get(format_choice, 'png')
+
+    if format_choice == 'PNG':
+        data = encode_png(working, compress_level=9, use_quantize=False)
+        if len(data) > max_bytes:
+            data = encode_png(working, compress_level=9, use_quantize=True)
+        scale = 0.9
+        while len(data) > max_bytes and min(working.size) > 400:
+            working = resize_down(working, scale)
+            data = encode_png(working, compress_level=9, use_quantize=True)
+
+    elif format_choice == 'JPEG':
+        quality = 95
+        data = encode_jpeg(working, quality=quality)
+        while len(data) > max_bytes and quality >= 50:
+            quality -= 5
+            data = encode_jpeg(working, quality=quality)
+        scale = 0.9
+        while len(data) > max_bytes and min(working.size) > 400:
+            working = resize_down(working, scale)
+            data = encode_jpeg(working, quality=max(50, quality))
+
+    elif format_choice == 'BMP':
+        data = encode_bmp(working)
+        scale = 0.9
+        while len(data) > max_bytes and min(working.size) > 400:
+            working = resize_down(working, scale)
+            data = encode_bmp(working)
+
+    elif format_choice == 'TIFF':
+        data = encode_tiff(working, compression='tiff_deflate')
+        if len(data) > max_bytes:
+            data = encode_tiff(working, compression='tiff_lzw')
+        scale = 0.9
+        while len(data) > max_bytes and min(working.size) > 400:
+            working = resize_down(working, scale)
+            data = encode_tiff(working, compression='tiff_deflate')
+
+    else:
+        data = encode_png(working, compress_level=9, use_quantize=False)
+        extension = 'png'
+
+    return data, extension
@@ -0,0 +1,210 @@
+"""
+Render cost model.
+
+Predicts how long each mark type and the finishing pass take from the number
+of mask pixels they draw. Every mark type is modelled as a fixed cost plus a
+cost per megapixel of its mask canvas; the finishing pass as a cost per page
+megapixel. Peak memory is modelled per page pixel plus per mask pixel, and
+encoding per page megapixel for each output format. The built-in coefficients
+come from calibrate_cost_model on a development machine; a per-machine
+calibration saved to COST_MODEL_FILE (see aging_effects.calibrate_cost_model)
+replaces them.
+"""
+
+import json
+import os
+
+import numpy as np
+
+COST_MODEL_FILE = "cost_model.json"
+COST_MODEL_VERSION = 1
+
+# kind -> (fixed ms, ms per mask megapixel)
+DEFAULT_MARK_COSTS = {
+    'blob': (0.0, 46.2),
+    'water_stain': (2.2, 24.9),
+    'fingerprint': (0.7, 29.8),
+    'dust': (0.0, 2.7),
+    'streak': (0.0, 19.8),
+    'bleeding_ink': (2.9, 6.2),
+    'faded_ink': (0.5, 40.5),
+    'smudged_calligraphy': (0.1, 22.8),
+    'moisture_damage': (8.5, 30.9),
+    'soot_stain': (0.3, 7.6),
+    'atmospheric_grime': (3.7, 3.0),
+    'coffee_mark': (1.9, 25.5),
+    'muddy_mark': (0.0, 46.4),
+    'heavy_ink_blotch': (2.2, 22.9),
+    'age_rings': (7.3, 8.8),
+    'ink_halo': (0.8, 6.5),
+    'foxing_spots': (1.0, 7.7),
+    'uneven_fading': (0.0, 6.8),
+    'text_area_smudge': (0.0, 4.8),
+    'rust_stains': (0.0, 20.2),
+    'algae_growth': (20.4, 11.3),
+    'ink_splatter': (1.6, 1.4),
+    'edge_water_stain': (16.5, 9.8),
+    'dark_damage': (8.7, 9.4),
+    'corner_aging': (0.0, 4.2),
+    'crack': (0.0, 17.4),
+    'moisture_tide': (0.0, 17.1),
+    'torn_edge': (0.0, 8.0),
+    'edge_darkening': (26.4, 52.1),
+}
+
+# Finishing per page megapixel, compositing one layer per mask megapixel,
+# and upsampling a reduced mask per megapixel of the full-size mask
+DEFAULT_FINISH_COST = (1.0, 76.6)
+DEFAULT_COMPOSITE_COST = (1.2, 7.2)
+DEFAULT_UPSAMPLE_MS_PER_MP = 7.0
+
+# Peak traced memory of apply_smudges: bytes per page pixel, bytes per mask pixel
+DEFAULT_MEMORY_COST = (22.0, 0.97)
+
+# save_image_with_format at its default 1 MB limit: format -> (fixed ms, ms per page megapixel)
+DEFAULT_ENCODE_COSTS = {
+    'PNG': (0.0, 4034.8),
+    'JPEG': (0.7, 26.2),
+    'BMP': (0.0, 211.8),
+    'TIFF': (2.7, 231.9),
+}
+
+# Mask resolutions a latency budget can step a mark down through; once every
+# mark is at the last step, marks are left out (scale 0) as a last resort
+SCALE_STEPS = (1.0, 0.5, 0.25)
+
+class CostModel:
+    """Per-mark-type time estimates in milliseconds."""
+
+    def __init__(self, mark_costs=None, finish_cost=DEFAULT_FINISH_COST,
+                 composite_cost=DEFAULT_COMPOSITE_COST,
+                 upsample_ms_per_mp=DEFAULT_UPSAMPLE_MS_PER_MP, memory_cost=DEFAULT_MEMORY_COST,
+                 encode_costs=None, source='built-in'):
+        self.mark_costs = dict(DEFAULT_MARK_COSTS)
+        self.mark_costs.update(mark_costs or {})
+        self.finish_cost = tuple(finish_cost)
+        self.composite_cost = tuple(composite_cost)
+        self.upsample_ms_per_mp = upsample_ms_per_mp
+        self.memory_cost = tuple(memory_cost)
+        self.encode_costs = dict(DEFAULT_ENCODE_COSTS)
+        self.encode_costs.update(encode_costs or {})
+        self.source = source
+
+    def mark_ms(self, kind, megapixels, scale=1.0):
+        """Estimate drawing one mark whose full-size mask covers megapixels, at scale."""
+        fixed, per_mp = self.mark_costs.get(kind, (2.0, 30.0))
+        estimate = fixed + per_mp * megapixels * scale * scale
+        if scale < 1.0:
+            estimate += self.upsample_ms_per_mp * megapixels
+        return estimate
+
+    def composite_ms(self, megapixels):
+        """Estimate compositing one layer of megapixels onto the overlay."""
+        fixed, per_mp = self.composite_cost
+        return fixed + per_mp * megapixels
+
+    def finish_ms(self, megapixels):
+        """Estimate compositing and finishing for a page of megapixels."""
+        fixed, per_mp = self.finish_cost
+        return fixed + per_mp * megapixels
+
+    def encode_ms(self, format_choice, megapixels):
+        """Estimate save_image_with_format for a page of megapixels."""
+        fixed, per_mp = self.encode_costs.get(format_choice, self.encode_costs['PNG'])
+        return fixed + per_mp * megapixels
+
+    def peak_bytes(self, page_pixels, mask_pixels):
+        """Estimate the peak memory of rendering a page with masks of mask_pixels in total."""
+        per_page_pixel, per_mask_pixel = self.memory_cost
+        return per_page_pixel * page_pixels + per_mask_pixel * mask_pixels
+
+    def as_dict(self):
+        return {
+            'version': COST_MODEL_VERSION,
+            'marks': {kind: list(cost) for kind, cost in self.mark_costs.items()},
+            'finish': list(self.finish_cost),
+            'composite': list(self.composite_cost),
+            'upsample_ms_per_mp': self.upsample_ms_per_mp,
+            'memory': list(self.memory_cost),
+            'encode': {name: list(cost) for name, cost in self.encode_costs.items()},
+        }
+
+def fit_linear(samples):
+    """Least-squares fit of ms = fixed + per_mp * megapixels.
+
+    Args:
+        samples: List of (megapixels, milliseconds)
+
+    Returns:
+        Tuple of (fixed ms, ms per megapixel), both clamped at zero
+    """
+    n = len(samples)
+    mean_x = sum(x for x, _ in samples) / n
+    mean_y = sum(y for _, y in samples) / n
+    var_x = sum((x - mean_x) ** 2 for x, _ in samples)
+    if var_x == 0:
+        return 0.0, max(0.0, mean_y / mean_x) if mean_x else 0.0
+    per_mp = sum((x - mean_x) * (y - mean_y) for x, y in samples) / var_x
+    per_mp = max(0.0, per_mp)
+    fixed = max(0.0, mean_y - per_mp * mean_x)
+    return round(fixed, 3), round(per_mp, 3)
+
+def fit_memory(samples):
+    """Least-squares fit of peak bytes = a * page pixels + b * mask pixels.
+
+    Args:
+        samples: List of (page pixels, mask pixels, peak bytes)
+
+    Returns:
+        Tuple of (bytes per page pixel, bytes per mask pixel), both clamped at zero
+    """
+    pixels = np.array([(page, mask) for page, mask, _ in samples], dtype=np.float64)
+    peaks = np.array([peak for _, _, peak in samples], dtype=np.float64)
+    (per_page_pixel, per_mask_pixel), *_ = np.linalg.lstsq(pixels, peaks, rcond=None)
+    return round(max(0.0, float(per_page_pixel)), 3), round(max(0.0, float(per_mask_pixel)), 3)
+
+def check_limits(estimate, max_seconds=None, max_peak_bytes=None):
+    """Return the reasons an estimate (see aging_effects.estimate_render) breaks the limits.
+
+    An empty list means the job fits; None disables a limit.
+    """
+    problems = []
+    if max_seconds is not None and estimate['total_ms'] > max_seconds * 1000:
+        problems.append(f"about {estimate['total_ms'] / 1000:.1f} s, over the {max_seconds:g} s limit")
+    if max_peak_bytes is not None and estimate['peak_bytes'] > max_peak_bytes:
+        problems.append(f"about {estimate['peak_bytes'] / 2**20:.0f} MB peak memory, over the "
+                        f"{max_peak_bytes / 2**20:.0f} MB limit")
+    return problems
+
+_model = None
+
+def load_cost_model(path=COST_MODEL_FILE):
+    """Return the calibrated model from path, or the built-in one if there is none."""
+    global _model
+    if _model is not None and _model.source == path:
+        return _model
+    if os.path.exists(path):
+        try:
+            with open(path, 'r') as f:
+                data = json.load(f)
+            if data.get('version') == COST_MODEL_VERSION:
+                _model = CostModel(
+                    {kind: tuple(cost) for kind, cost in data.get('marks', {}).items()},
+                    data.get('finish', DEFAULT_FINISH_COST),
+                    data.get('composite', DEFAULT_COMPOSITE_COST),
+                    data.get('upsample_ms_per_mp', DEFAULT_UPSAMPLE_MS_PER_MP),
+                    data.get('memory', DEFAULT_MEMORY_COST),
+                    {name: tuple(cost) for name, cost in data.get('encode', {}).items()},
+                    source=path
+                )
+                return _model
+        except (OSError, ValueError):
+            pass
+    return CostModel()
+
+def save_cost_model(model, path=COST_MODEL_FILE):
+    """Write a calibrated model so later renders on this machine use it."""
+    global _model
+    with open(path, 'w') as f:
+        json.dump(model.as_dict(), f, indent=2)
+    _model = None
@@ -0,0 +1,78 @@
+"""
+Render plans: what a render will draw, kept apart from drawing it.
+
+apply_smudges first samples every mark and page effect into a MarkSpec (type,
+colour, strength, normalised size and position, and a sub-seed for the
+generator's own randomness) and only then rasterises the list. A plan is a few
+hundred bytes of JSON, so it can be cached, compared, embedded in an output
+file and rendered again later at the same or another resolution.
+"""
+
+import json
+
+PLAN_VERSION = 1
+PLAN_METADATA_KEY = 'aging_plan'  # PNG text chunk holding the plan of a saved image
+
+class MarkSpec:
+    """One planned mark or page effect.
+
+    size is the mark size as a fraction of the page's shorter side, and x, y
+    the centre of its mask as fractions of the page width and height. Both are
+    None for marks that cover the whole page; corner aging uses x, y of 0 or 1
+    to name its corner. seed drives the generator, so the same spec always
+    draws the same shape.
+    """
+
+    __slots__ = ('kind', 'seed', 'color', 'intensity_mod', 'alpha_cap', 'size', 'x', 'y')
+
+    def __init__(self, kind, seed, color, intensity_mod, alpha_cap=255, size=None, x=None, y=None):
+        self.kind = kind
+        self.seed = seed
+        self.color = tuple(color)
+        self.intensity_mod = intensity_mod
+        self.alpha_cap = alpha_cap
+        self.size = size
+        self.x = x
+        self.y = y
+
+    def as_dict(self):
+        return {name: getattr(self, name) for name in self.__slots__}
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(**{name: data[name] for name in cls.__slots__ if name in data})
+
+    def __eq__(self, other):
+        if not isinstance(other, MarkSpec):
+            return NotImplemented
+        return all(getattr(self, name) == getattr(other, name) for name in self.__slots__)
+
+    def __repr__(self):
+        fields = ', '.join(f"{name}={getattr(self, name)!r}" for name in self.__slots__)
+        return f"MarkSpec({fields})"
+
+def dump_plan(plan, **settings):
+    """Encode a plan as JSON, with render settings such as intensity and aging_level."""
+    return json.dumps({
+        'version': PLAN_VERSION,
+        'settings': settings,
+        'marks': [spec.as_dict() for spec in plan],
+    }, separators=(',', ':'))
+
+def load_plan(text):
+    """Decode dump_plan() output.
+
+    Returns:
+        Tuple of (list of MarkSpec, settings dict)
+    """
+    data = json.loads(text)
+    if data.get('version') != PLAN_VERSION:
+        raise ValueError(f"unsupported render plan version: {data.get('version')!r}")
+    return [MarkSpec.from_dict(mark) for mark in data['marks']], data.get('settings', {})
+
+def plan_from_image(image):
+    """Return the (plan, settings) embedded in a saved PIL image, or None."""
+    text = image.info.get(PLAN_METADATA_KEY)
+    if text is None:
+        return None
+    return load_plan(text)
@@ -0,0 +1,337 @@
+"""
+Memory regression suite for the aging pipeline.
+
+Renders synthetic pages at several sizes and aging levels, measures the peak
+traced (tracemalloc) and resident (RSS) memory of every pipeline stage, and
+fails when a stage exceeds its budget. Budgets are expressed as a multiple of
+the page's RGBA byte size so an accidental full-frame copy shows up no matter
+which image size triggered it.
+
+Usage:
+    python memory_regression.py
+    python memory_regression.py --sizes 800x600 2480x3508 --levels light extreme
+
+Before measuring, a few tiny and extreme-aspect pages are rendered at every
+level with several seeds, and any that fails to render fails the run.
+"""
+
+import argparse
+import ctypes
+import functools
+import gc
+import random
+import sys
+import tracemalloc
+import warnings
+
+import numpy as np
+from PIL import Image, ImageDraw
+
+import aging_effects as ae
+from page_geometry import clear_geometry_cache
+
+# Allowed peak allocation per stage, as a multiple of the page's RGBA bytes
+# (width * height * 4). Mark generators that allocate a canvas sized from
+# min(width, height) are budgeted against the same page bytes.
+STAGE_BUDGETS = {
+    'mark:blob': 8.5,
+    'mark:water_stain': 3.5,
+    'mark:fingerprint': 0.5,
+    'mark:dust': 0.5,
+    'mark:streak': 0.75,
+    'mark:bleeding_ink': 0.5,
+    'mark:soot_stain': 0.75,
+    'mark:atmospheric_grime': 1.0,
+    'mark:coffee_mark': 1.0,
+    'mark:heavy_ink_blotch': 2.0,
+    'mark:age_rings': 1.0,
+    'mark:ink_halo': 2.5,
+    'mark:foxing_spots': 0.75,
+    'mark:uneven_fading': 1.0,
+    'mark:text_area_smudge': 0.75,
+    'mark:rust_stains': 1.0,
+    'mark:algae_growth': 1.0,
+    'mark:ink_splatter': 1.0,
+    'mark:edge_water_stain': 1.0,
+    'mark:dark_damage': 1.0,
+    'effect:corner_aging': 1.0,
+    'effect:crack': 1.0,
+    'effect:moisture_tide': 1.0,
+    'effect:torn_edge': 8.5,
+    'effect:edge_darkening': 11.0,
+    'finish:contrast': 5.0,
+    'finish:grain': 10.0,
+    'finish:blend': 3.5,
+    'finish:fused': 3.5,
+    'encode:png': 1.5,
+    'apply_smudges': 20.0,
+}
+
+# Fixed allowance for allocator and interpreter noise, so tiny pages do not
+# fail on a few hundred kilobytes of bookkeeping.
+SLACK_BYTES = 4 * 1024 * 1024
+
+# Local mark generators with the largest size fraction apply_smudges can pick
+LOCAL_MARKS = [
+    ('blob', lambda s, **kwargs: ae.create_organic_blob(s, irregularity=0.6, **kwargs), 0.45),
+    ('water_stain', ae.create_water_stain, 0.70),
+    ('fingerprint', ae.create_fingerprint_mark, 0.20),
+    ('dust', ae.create_dust_speckles, 0.30),
+    ('streak', ae.create_streak_mark, 0.35),
+    ('bleeding_ink', ae.create_bleeding_ink, 0.22),
+    ('soot_stain', ae.create_soot_stain, 0.35),
+    ('atmospheric_grime', ae.create_atmospheric_grime, 0.45),
+    ('coffee_mark', ae.create_coffee_ring, 0.45),
+    ('heavy_ink_blotch', ae.create_heavy_ink_blotch, 0.55),
+    ('age_rings', ae.create_age_rings, 0.45),
+    ('ink_halo', ae.create_ink_halo, 0.30),
+    ('foxing_spots', ae.create_foxing_spots, 0.40),
+    ('uneven_fading', ae.create_uneven_fading, 0.45),
+    ('text_area_smudge', ae.create_text_area_smudge, 0.35),
+]
+
+# Full-page mark generators and effects, called with (width, height)
+FULL_PAGE_STAGES = [
+    ('mark:rust_stains', ae.create_rust_stains),
+    ('mark:algae_growth', ae.create_algae_growth),
+    ('mark:ink_splatter', ae.create_ink_splatter),
+    ('mark:edge_water_stain', ae.create_edge_water_stain),
+    ('mark:dark_damage', ae.create_dark_damage_patch),
+    ('effect:corner_aging', lambda w, h: ae.create_corner_aging(w, h, 'top-left')),
+    ('effect:crack', ae.create_crack_pattern),
+    ('effect:moisture_tide', ae.create_moisture_tide_mark),
+    ('effect:torn_edge', ae.create_torn_paper_edge),
+    ('effect:edge_darkening', ae.create_edge_darkening),
+]
+
+# Pages rendered, not measured, to catch marks that break at degenerate sizes
+SMALL_PAGE_SIZES = [(100, 100), (10, 10), (2, 2), (1, 1), (50, 3000)]
+
+def parse_size(text):
+    """Parse a WIDTHxHEIGHT string."""
+    width, height = text.lower().split('x')
+    return int(width), int(height)
+
+def check_small_pages(levels, num_smudges=15, seeds=range(5)):
+    """Render every SMALL_PAGE_SIZES page at each level and seed.
+
+    Marks are sized from the page, so tiny pages drive them to degenerate
+    sizes. Warnings are raised as errors, so a division by zero that would
+    only turn into NaN pixels fails too. Returns a list of (size, level,
+    seed, error) for the renders that raised.
+    """
+    failures = []
+    for width, height in SMALL_PAGE_SIZES:
+        page = make_test_page(width, height)
+        for level in levels:
+            for seed in seeds:
+                random.seed(seed)
+                np.random.seed(seed)
+                try:
+                    with warnings.catch_warnings():
+                        warnings.simplefilter('error')
+                        ae.apply_smudges(page, num_smudges=num_smudges, aging_level=level)
+                except Exception as error:
+                    failures.append(((width, height), level, seed, f"{type(error).__name__}: {error}"))
+    return failures
+
+def make_test_page(width, height):
+    """Build a plain parchment page with dark text-like strokes."""
+    page = Image.new('RGB', (width, height), (232, 220, 190))
+    draw = ImageDraw.Draw(page)
+    for y in range(40, height - 40, 36):
+        x = 40
+        while x < width - 80:
+            length = random.randint(20, 70)
+            draw.rectangle([x, y, x + length, y + 14], fill=(30, 25, 20))
+            x += length + 15
+    return page
+
+def make_test_overlay(width, height):
+    """Build an RGBA overlay with a few opaque marks on a transparent page."""
+    overlay = Image.new('RGBA', (width, height), (0, 0, 0, 0))
+    draw = ImageDraw.Draw(overlay)
+    for _ in range(6):
+        x = random.randint(0, width - 1)
+        y = random.randint(0, height - 1)
+        r = random.randint(10, max(11, min(width, height) // 5))
+        draw.ellipse([x - r, y - r, x + r, y + r], fill=(120, 90, 60, 160))
+    return overlay
+
+try:
+    _malloc_trim = ctypes.CDLL('libc.so.6').malloc_trim
+except (OSError, AttributeError):
+    _malloc_trim = None
+
+def _read_status_kb(key):
+    """Read a kB value such as VmRSS or VmHWM from /proc/self/status."""
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith(key + ':'):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return None
+
+def _reset_peak_rss():
+    """Reset the kernel's RSS high-water mark. Returns False where unsupported."""
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+        return _read_status_kb('VmHWM') is not None
+    except OSError:
+        return False
+
+def _measure_once(fn, args, kwargs):
+    """Run fn once and return (traced_peak_bytes, rss_peak_bytes or None)."""
+    # Measure cold: geometry cached by an earlier run would hide its own allocation
+    clear_geometry_cache()
+    gc.collect()
+    if _malloc_trim is not None:
+        # Hand freed pages back to the OS so reused heap memory shows up in RSS
+        _malloc_trim(0)
+    rss_before = _read_status_kb('VmRSS')
+    rss_supported = _reset_peak_rss()
+    tracemalloc.reset_peak()
+    traced_before = tracemalloc.get_traced_memory()[0]
+
+    result = fn(*args, **kwargs)
+
+    traced_peak = tracemalloc.get_traced_memory()[1] - traced_before
+    rss_peak = None
+    if rss_supported and rss_before is not None:
+        rss_peak = max(0, _read_status_kb('VmHWM') - rss_before) * 1024
+    del result
+    return max(0, traced_peak), rss_peak
+
+def measure_stage(fn, *args, repeat=2, **kwargs):
+    """Return the lowest (traced_peak_bytes, rss_peak_bytes) over repeat runs.
+
+    tracemalloc sees NumPy buffers but not Pillow's image memory, so the RSS
+    high-water mark is sampled alongside it where the platform allows. RSS is
+    noisy, so the minimum over a few runs is reported.
+    """
+    samples = [_measure_once(fn, args, kwargs) for _ in range(repeat)]
+    traced = min(sample[0] for sample in samples)
+    rss_values = [sample[1] for sample in samples if sample[1] is not None]
+    return traced, (min(rss_values) if rss_values else None)
+
+def run_suite(sizes, levels, num_smudges=15, intensity=1.0, seed=0):
+    """Measure every stage for each size and aging level.
+
+    Returns:
+        List of dicts with size, level, stage, traced, rss, budget and ok
+    """
+    rows = []
+
+    def record(size, level, stage, traced, rss):
+        page_bytes = size[0] * size[1] * 4
+        budget = STAGE_BUDGETS[stage] * page_bytes + SLACK_BYTES
+        peak = max(traced, rss or 0)
+        rows.append({
+            'size': size, 'level': level, 'stage': stage,
+            'traced': traced, 'rss': rss, 'budget': budget,
+            'ratio': peak / page_bytes, 'ok': peak <= budget,
+        })
+
+    tracemalloc.start()
+    try:
+        for size in sizes:
+            width, height = size
+            base_size = min(width, height)
+            random.seed(seed)
+            np.random.seed(seed)
+
+            for name, generator, fraction in LOCAL_MARKS:
+                # Draw with the rasterizer the registry picks for the type
+                rasterizer = ae.MARK_TYPES[name].rasterizer
+                if rasterizer is not None:
+                    generator = functools.partial(generator, rasterizer=rasterizer)
+                traced, rss = measure_stage(generator, max(4, int(base_size * fraction)))
+                record(size, '-', 'mark:' + name, traced, rss)
+
+            for stage, generator in FULL_PAGE_STAGES:
+                traced, rss = measure_stage(generator, width, height)
+                record(size, '-', stage, traced, rss)
+
+            page = make_test_page(width, height).convert('RGBA')
+            overlay = make_test_overlay(width, height)
+
+            traced, rss = measure_stage(ae.save_image_with_format, page, 'PNG', 300)
+            record(size, '-', 'encode:png', traced, rss)
+
+            for level in levels:
+                traced, rss = measure_stage(
+                    ae.adjust_overlay_contrast, overlay, ae.CONTRAST_FACTORS[level])
+                record(size, level, 'finish:contrast', traced, rss)
+
+                traced, rss = measure_stage(
+                    ae.apply_grain_to_overlay, overlay, ae.GRAIN_INTENSITIES[level])
+                record(size, level, 'finish:grain', traced, rss)
+
+                traced, rss = measure_stage(ae.multiply_blend, page, overlay)
+                record(size, level, 'finish:blend', traced, rss)
+
+                traced, rss = measure_stage(
+                    ae.finish_overlay, page, overlay,
+                    ae.CONTRAST_FACTORS[level], ae.GRAIN_INTENSITIES[level])
+                record(size, level, 'finish:fused', traced, rss)
+
+                def render():
+                    # Reseed so every repeat renders the same marks
+                    random.seed(seed)
+                    np.random.seed(seed)
+                    return ae.apply_smudges(page, num_smudges=num_smudges,
+                                            intensity=intensity, aging_level=level)
+
+                traced, rss = measure_stage(render)
+                record(size, level, 'apply_smudges', traced, rss)
+    finally:
+        tracemalloc.stop()
+    return rows
+
+def print_report(rows):
+    """Print one line per measurement, flagging budget overruns."""
+    mib = 1024 * 1024
+    print(f"{'size':>11} {'level':>8} {'stage':<24} {'traced MiB':>10} "
+          f"{'rss MiB':>8} {'x page':>7} {'budget MiB':>10}")
+    for row in rows:
+        size = f"{row['size'][0]}x{row['size'][1]}"
+        rss = f"{row['rss'] / mib:8.1f}" if row['rss'] is not None else f"{'n/a':>8}"
+        flag = '' if row['ok'] else '  << OVER BUDGET'
+        print(f"{size:>11} {row['level']:>8} {row['stage']:<24} "
+              f"{row['traced'] / mib:10.1f} {rss} {row['ratio']:7.2f} "
+              f"{row['budget'] / mib:10.1f}{flag}")
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().split('\n')[0])
+    parser.add_argument('--sizes', nargs='+', type=parse_size,
+                        default=[(800, 600), (1240, 1754)],
+                        help="Page sizes as WIDTHxHEIGHT")
+    parser.add_argument('--levels', nargs='+', choices=list(ae.CONTRAST_FACTORS),
+                        default=list(ae.CONTRAST_FACTORS), help="Aging levels to render")
+    parser.add_argument('--num-smudges', type=int, default=15)
+    parser.add_argument('--intensity', type=float, default=1.0)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args(argv)
+
+    crashes = check_small_pages(args.levels, num_smudges=args.num_smudges)
+    for (width, height), level, seed, error in crashes:
+        print(f"✗ {width}x{height} {level} seed {seed}: {error}")
+    if crashes:
+        return 1
+
+    rows = run_suite(args.sizes, args.levels, num_smudges=args.num_smudges,
+                     intensity=args.intensity, seed=args.seed)
+    print_report(rows)
+
+    failures = [row for row in rows if not row['ok']]
+    if failures:
+        print(f"\n✗ {len(failures)} stage(s) over budget")
+        return 1
+    print(f"\n✓ All {len(rows)} measurements within budget")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
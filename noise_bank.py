@@ -0,0 +1,112 @@
+"""
+Precomputed noise for paper grain and mask texture, and fractal noise for stains.
+
+Generating a page-sized field with np.random on every render is one of the
+larger costs of a big page. Instead, a small bank of uniform noise tiles is
+built once per value range, and page-sized fields are assembled from it: the
+cell grid gets a random offset, and every cell is a random window of a random
+bank tile in one of its eight rotations and flips. White noise has no
+structure across a cell border, so the result shows no seams or repeats.
+
+Page-scale stains need smooth, blotchy noise instead: fbm_field sums a few
+octaves of value noise, each a small grid of random values bilinearly
+upsampled to the field, so its cost is a few passes over the field whatever
+the feature size.
+"""
+
+import numpy as np
+
+NOISE_TILE = 512      # Edge length of each bank tile
+NOISE_CELL = 256      # Edge length of the cells a field is assembled from
+NOISE_VARIANTS = 4    # Tiles per bank
+NOISE_SEED = 1409     # Fixed, so every process builds the same banks
+
+# (low, high) -> int8 array of shape (NOISE_VARIANTS, NOISE_TILE, NOISE_TILE). Render threads
+# may both build a missing bank; they build the same one, so either result is kept.
+_banks = {}
+
+def noise_bank(low, high):
+    """Return the bank of values uniform over [low, high), building it on first use."""
+    bank = _banks.get((low, high))
+    if bank is None:
+        if not -128 <= low < high <= 128:
+            raise ValueError("noise banks hold int8 values; use a range within [-128, 128)")
+        rng = np.random.default_rng([NOISE_SEED, low + 128, high + 128])
+        bank = rng.integers(low, high, (NOISE_VARIANTS, NOISE_TILE, NOISE_TILE), dtype=np.int8)
+        _banks[(low, high)] = bank
+    return bank
+
+def noise_field(width, height, low, high, rng=np.random):
+    """Return a height x width int16 field uniform over [low, high).
+
+    Stands in for np.random.randint(low, high, (height, width)). Placement is
+    drawn from rng (np.random or a RandomState), so seeding it reproduces the
+    field.
+    """
+    bank = noise_bank(low, high)
+    field = np.empty((height, width), dtype=np.int16)
+    offset_y, offset_x = rng.randint(NOISE_CELL, size=2)
+    tops = range(-offset_y, height, NOISE_CELL)
+    lefts = range(-offset_x, width, NOISE_CELL)
+    cells = len(tops) * len(lefts)
+    variants = rng.randint(NOISE_VARIANTS, size=cells)
+    orientations = rng.randint(8, size=cells)
+    windows = rng.randint(NOISE_TILE - NOISE_CELL + 1, size=(cells, 2))
+
+    cell = 0
+    for top in tops:
+        for left in lefts:
+            tile = np.rot90(bank[variants[cell]], orientations[cell] % 4)
+            if orientations[cell] >= 4:
+                tile = tile[:, ::-1]
+            window_y, window_x = windows[cell]
+            y0, x0 = max(top, 0), max(left, 0)
+            y1, x1 = min(top + NOISE_CELL, height), min(left + NOISE_CELL, width)
+            field[y0:y1, x0:x1] = tile[window_y + y0 - top:window_y + y1 - top,
+                                       window_x + x0 - left:window_x + x1 - left]
+            cell += 1
+    return field
+
+def _bilinear(size, source_size, step, phase=0.0):
+    """Return the size x source_size matrix that bilinearly resamples a line of source_size values.
+
+    Output pixel i takes the source at phase + (i + 0.5) / step - 0.5,
+    clamped to the ends, so step is output pixels per source pixel.
+    """
+    position = np.clip(phase + (np.arange(size) + 0.5) / step - 0.5, 0, source_size - 1)
+    left = np.minimum(position.astype(np.intp), source_size - 2) if source_size > 1 else np.zeros(size, np.intp)
+    right = np.minimum(left + 1, source_size - 1)
+    weight = (position - left).astype(np.float32)
+    matrix = np.zeros((size, source_size), dtype=np.float32)
+    rows = np.arange(size)
+    matrix[rows, left] = 1 - weight
+    matrix[rows, right] += weight
+    return matrix
+
+def fbm_field(width, height, cell, octaves=4, gain=0.5, rng=np.random):
+    """Return a height x width float32 fractal value-noise field in [0, 1].
+
+    Octave k is uniform noise on a grid of cell / 2**k pixels at a random
+    phase, weighted gain**k; octaves finer than four pixels are skipped. The
+    octaves are summed on the finest octave's grid and upsampled to the
+    field once. Bilinear resampling is separable, so each resize is a pair of
+    small matrix products. rng is np.random or a RandomState.
+    """
+    steps = [cell / 2 ** k for k in range(octaves)]
+    steps = [max(steps[0], 1.0)] + [step for step in steps[1:] if step >= 4.0]
+    fine = steps[-1]
+    fine_w = int(width / fine) + 2
+    fine_h = int(height / fine) + 2
+    total = np.zeros((fine_h, fine_w), dtype=np.float32)
+    weight = 0.0
+    amplitude = 1.0
+    for step in steps:
+        grid = rng.random_sample((int(height / step) + 4, int(width / step) + 4)).astype(np.float32)
+        ratio = step / fine
+        phase_x, phase_y = rng.random_sample(2)
+        total += amplitude * (_bilinear(fine_h, grid.shape[0], ratio, phase_y) @ grid
+                              @ _bilinear(fine_w, grid.shape[1], ratio, phase_x).T)
+        weight += amplitude
+        amplitude *= gain
+    total /= weight
+    return _bilinear(height, fine_h, fine) @ total @ _bilinear(width, fine_w, fine).T
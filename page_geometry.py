@@ -0,0 +1,119 @@
+"""
+Cached per-page-size geometry for edge and page-wide effects.
+
+Edge darkening, torn edges and vignettes all start from the same few arrays
+for a page size: pixel coordinates, the distance of every pixel to the nearest
+edge, and its distance to the centre. A batch of same-size pages, or a set of
+similar variations of one page, needs them again and again, so they are built
+once per size and kept in a small LRU cache bounded by GEOMETRY_CACHE_BYTES.
+Cached arrays are read-only; derive new arrays from them rather than writing
+in place.
+
+Effects that only reach in from the border are drawn box by box over
+border_boxes, four corner patches and the four strips between them, so they
+never touch the page interior.
+"""
+
+import math
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+from render_stats import count
+
+GEOMETRY_CACHE_BYTES = 64 * 2**20   # Bytes of geometry kept across renders
+
+_cache = OrderedDict()  # (kind, width, height) -> read-only array or tuple of arrays
+_cache_bytes = 0
+_lock = threading.Lock()
+
+def _nbytes(value):
+    return sum(array.nbytes for array in value) if isinstance(value, tuple) else value.nbytes
+
+def _cached(kind, width, height, build):
+    """Return the geometry (kind, width, height), building it with build() on a miss.
+
+    The least recently used entries are dropped once the cache holds more
+    than GEOMETRY_CACHE_BYTES; a result larger than that is returned uncached.
+    """
+    global _cache_bytes
+    key = (kind, width, height)
+    with _lock:
+        value = _cache.get(key)
+        if value is not None:
+            _cache.move_to_end(key)
+            count('geometry_hits')
+            return value
+    count('geometry_misses')
+    value = build()
+    for array in value if isinstance(value, tuple) else (value,):
+        array.setflags(write=False)
+    size = _nbytes(value)
+    if size > GEOMETRY_CACHE_BYTES:
+        return value
+    with _lock:
+        if key not in _cache:
+            _cache[key] = value
+            _cache_bytes += size
+        while _cache_bytes > GEOMETRY_CACHE_BYTES:
+            _, dropped = _cache.popitem(last=False)
+            _cache_bytes -= _nbytes(dropped)
+    return value
+
+def clear_geometry_cache():
+    """Drop every cached array, e.g. before measuring memory."""
+    global _cache_bytes
+    with _lock:
+        _cache.clear()
+        _cache_bytes = 0
+
+def pixel_grid(width, height):
+    """Return (ys, xs): float32 pixel indices as an H x 1 column and a 1 x W row (an ogrid)."""
+    return _cached('grid', width, height, lambda: (
+        np.arange(height, dtype=np.float32).reshape(-1, 1),
+        np.arange(width, dtype=np.float32).reshape(1, -1)))
+
+def edge_distance(width, height, box=None):
+    """Return the float32 distance, in pixels, of every pixel centre to the nearest page edge pixel.
+
+    Without box the whole H x W map is returned from the cache; with a
+    (left, top, right, bottom) box, just that part is computed.
+    """
+    def build(left=0, top=0, right=width, bottom=height):
+        ys, xs = pixel_grid(width, height)
+        ys, xs = ys[top:bottom], xs[:, left:right]
+        return np.minimum(np.minimum(ys, (height - 1) - ys), np.minimum(xs, (width - 1) - xs))
+    if box is not None:
+        return build(*box)
+    return _cached('edge', width, height, build)
+
+def centre_distance(width, height):
+    """Return the H x W float32 distance, in pixels, of every pixel to the page centre."""
+    def build():
+        ys, xs = pixel_grid(width, height)
+        return np.sqrt((xs - np.float32(width / 2.0)) ** 2 + (ys - np.float32(height / 2.0)) ** 2)
+    return _cached('centre', width, height, build)
+
+def border_boxes(width, height, band, corners=None):
+    """Return non-overlapping (left, top, right, bottom) boxes covering a page's border.
+
+    The four corner patches come first, top-left, top-right, bottom-left and
+    bottom-right, sized by corners as (width, height) pairs in that order
+    (default: band-sided squares; each is widened to at least band). Then
+    come the top, bottom, left and right strips, band pixels deep (at least
+    one), between them. Where the border would cover the page, the one box
+    is the whole page.
+    """
+    band = max(1, math.ceil(band))
+    corners = [(max(band, math.ceil(w)), max(band, math.ceil(h))) for w, h in (corners or [(band, band)] * 4)]
+    (tl_w, tl_h), (tr_w, tr_h), (bl_w, bl_h), (br_w, br_h) = corners
+    if (tl_w + tr_w >= width or bl_w + br_w >= width or tl_h + bl_h >= height or tr_h + br_h >= height
+            or 2 * band >= width or 2 * band >= height):
+        return [(0, 0, width, height)]
+    return [
+        (0, 0, tl_w, tl_h), (width - tr_w, 0, width, tr_h),
+        (0, height - bl_h, bl_w, height), (width - br_w, height - br_h, width, height),
+        (tl_w, 0, width - tr_w, band), (bl_w, height - band, width - br_w, height),
+        (0, tl_h, band, height - bl_h), (width - band, tr_h, width, height - br_h),
+    ]
@@ -0,0 +1,244 @@
+"""
+Aging pages on worker processes, with the pixels passed through shared memory.
+
+Handing a page to a process pool the usual way pickles it: the pixels are
+copied into the pickle, through the pipe and out again, and the aged page
+makes the same trip back, tens to hundreds of megabytes each way for a
+scan. Here every page and the buffer for its aged result are placed in
+multiprocessing.shared_memory blocks instead. A job carries only their
+handles (block name, shape, dtype and image mode); the worker wraps the
+blocks as NumPy views, reads the page from one and writes the aged page
+into the other, and only the small results (marks used, the plan drawn and
+the performance report) are pickled back.
+
+How many pages render at once is tuned to the machine and the pages: a
+pool of one process per CPU, and a page is only admitted while the
+estimated peak memory of the pages in flight (see estimate_render) fits in
+the memory available without swapping. Small pages run fully parallel,
+and a large scan waits for the pages ahead of it and runs alone in the
+pool with every CPU drawing it. Only with a single process (as on a
+single CPU) is the batch rendered in this process, without the pool.
+
+    for result in age_images(pages, num_smudges=20, aging_level='heavy'):
+        result['image'].save(...)
+"""
+
+import os
+import random
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import resource_tracker, shared_memory
+
+import numpy as np
+from PIL import Image
+
+from aging_effects import apply_smudges, available_cpus, estimate_render, layer_scales, layer_specs
+
+# Image modes whose pixels are shared as they are; others are converted to RGBA first
+SHARED_MODES = {'L': 1, 'RGB': 3, 'RGBA': 4}
+
+MEMORY_HEADROOM = 0.75              # Share of the available memory renders may take
+WORKER_BASE_BYTES = 96 * 2**20      # Resident size of a worker before it renders (interpreter, NumPy, Pillow)
+
+def available_memory():
+    """Return the bytes of memory that can be used without swapping, or None if unknown.
+
+    This is MemAvailable from /proc/meminfo, which counts reclaimable page
+    cache, or the free physical memory where that is missing.
+    """
+    try:
+        with open('/proc/meminfo') as meminfo:
+            for line in meminfo:
+                if line.startswith('MemAvailable:'):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    try:
+        return os.sysconf('SC_AVPHYS_PAGES') * os.sysconf('SC_PAGE_SIZE')
+    except (ValueError, OSError):
+        return None
+
+def job_bytes(width, height, options):
+    """Estimate the memory one render of a width x height page with options takes.
+
+    This is the render's estimated peak (see estimate_render, which reads
+    num_smudges, aging_level and plan from options), the shared page and
+    result buffers, and a worker process to run it in.
+    """
+    estimate = estimate_render(width, height, options.get('num_smudges', 3),
+                               options.get('aging_level', 'medium'), plan=options.get('plan'))
+    return estimate['peak_bytes'] + 8 * width * height + WORKER_BASE_BYTES
+
+def concurrent_renders(cost, cpus=None, memory=None):
+    """Return how many renders costing cost bytes each can run at once.
+
+    One per CPU, as far as MEMORY_HEADROOM of memory (default: the
+    available memory) holds them, and always at least one.
+    """
+    cpus = cpus or available_cpus()
+    memory = available_memory() if memory is None else memory
+    if memory is None:
+        return cpus
+    return max(1, min(cpus, int(memory * MEMORY_HEADROOM // max(cost, 1))))
+
+def shared_array(shape, dtype=np.uint8):
+    """Create a shared memory block for an array of shape and dtype.
+
+    Returns:
+        Tuple of (SharedMemory, handle dict, NumPy view of the block). The
+        handle names the block and is all another process needs to attach it.
+    """
+    dtype = np.dtype(dtype)
+    block = shared_memory.SharedMemory(create=True, size=max(1, int(np.prod(shape)) * dtype.itemsize))
+    handle = {'name': block.name, 'shape': tuple(shape), 'dtype': dtype.str}
+    return block, handle, np.ndarray(shape, dtype=dtype, buffer=block.buf)
+
+def attach_array(handle):
+    """Attach the block a handle names and return (SharedMemory, NumPy view of it)."""
+    block = shared_memory.SharedMemory(name=handle['name'])
+    return block, np.ndarray(handle['shape'], dtype=np.dtype(handle['dtype']), buffer=block.buf)
+
+def share_image(image):
+    """Copy an image's pixels into a new shared memory block.
+
+    Returns:
+        Tuple of (SharedMemory, handle dict with the image mode)
+    """
+    if image.mode not in SHARED_MODES:
+        image = image.convert('RGBA')
+    channels = SHARED_MODES[image.mode]
+    shape = (image.height, image.width) if channels == 1 else (image.height, image.width, channels)
+    block, handle, pixels = shared_array(shape)
+    pixels[...] = np.asarray(image)
+    del pixels
+    handle['mode'] = image.mode
+    return block, handle
+
+def view_image(handle, pixels):
+    """Wrap the shared pixels of a handle from share_image as a read-only PIL image, without a copy."""
+    height, width = handle['shape'][:2]
+    return Image.frombuffer(handle['mode'], (width, height), pixels, 'raw', handle['mode'], 0, 1)
+
+def release(block):
+    """Close a block created in this process and free it."""
+    block.close()
+    block.unlink()
+
+def _age_job(job):
+    # Runs in a worker: render the shared page into the shared result buffer
+    page_block, page = attach_array(job['page'])
+    result_block, result = attach_array(job['result'])
+    try:
+        random.seed(job['seed'])
+        np.random.seed(job['seed'])
+        aged, marks_used, report, layers = apply_smudges(view_image(job['page'], page), return_report=True,
+                                                         return_layers=True, **job['options'])
+        result[...] = np.asarray(aged)
+        return {'marks_used': marks_used, 'plan': layer_specs(layers), 'scales': layer_scales(layers),
+                'report': report}
+    finally:
+        del page, result
+        page_block.close()
+        result_block.close()
+
+def _age_here(image, seed, options):
+    # A batch that runs one page at a time skips the pool and the copies
+    random.seed(seed)
+    np.random.seed(seed)
+    aged, marks_used, report, layers = apply_smudges(image, return_report=True, return_layers=True, **options)
+    return {'image': aged, 'marks_used': marks_used, 'plan': layer_specs(layers),
+            'scales': layer_scales(layers), 'report': report, 'layers': layers}
+
+def _submit(pool, image, seed, options):
+    page_block, page = share_image(image)
+    result_block, result, pixels = shared_array((image.height, image.width, 4))
+    del pixels
+    job = {'page': page, 'result': result, 'seed': seed, 'options': options}
+    return pool.submit(_age_job, job), (page_block, result_block), result
+
+def age_images(images, processes=None, seeds=None, memory=None, **options):
+    """Age images on a pool of worker processes and yield the results in order.
+
+    images may be any iterable of PIL images, such as a generator loading
+    them from disk. Every image is rendered with apply_smudges(image,
+    **options) after seeding random and np.random with its entry of seeds
+    (default: drawn from random, so seeding it beforehand reproduces the
+    batch, whatever the number of processes).
+
+    processes caps the pool (default: one per CPU). A page is admitted only
+    while the pages in flight, at most two per process, fit in
+    MEMORY_HEADROOM of memory (default: the available memory, read when the
+    batch starts) by their job_bytes estimates; a page too large to share
+    the machine waits for the others and runs alone. Unless options set
+    threads, each render draws and finishes on the CPUs left to it. With
+    one process (as on a single CPU) the batch is rendered here instead,
+    without the pool or the copies.
+
+    Yields:
+        Dicts with 'image' (the aged RGBA page), 'marks_used', 'plan' (the
+        MarkSpecs drawn), 'scales' (their mask scales, see layer_scales) and
+        'report' (see apply_smudges return_report);
+        pages rendered here also carry their 'layers'
+    """
+    cpus = available_cpus()
+    processes = processes or cpus
+    memory = available_memory() if memory is None else memory
+    budget = None if memory is None else memory * MEMORY_HEADROOM
+    seeds = iter(seeds) if seeds is not None else None
+    images = iter(images)
+
+    def next_seed():
+        return next(seeds) if seeds is not None else random.getrandbits(32)
+
+    def job_options(cost):
+        # The renders that fit beside this one share the CPUs
+        if 'threads' in options:
+            return options
+        renders = min(processes, concurrent_renders(cost, cpus, memory))
+        return dict(options, threads=max(1, cpus // renders))
+
+    if processes == 1:
+        for image in images:
+            yield _age_here(image, next_seed(), job_options(0))
+        return
+
+    pending = deque()   # (future, blocks, result handle, cost)
+    in_flight = 0
+
+    def collect():
+        nonlocal in_flight
+        future, blocks, handle, cost = pending.popleft()
+        in_flight -= cost
+        try:
+            outcome = future.result()
+            # The block is freed below, so the page is copied out of it once
+            pixels = np.ndarray(handle['shape'], dtype=np.uint8, buffer=blocks[1].buf)
+            outcome['image'] = Image.fromarray(pixels.copy())
+            del pixels
+            return outcome
+        finally:
+            for block in blocks:
+                release(block)
+
+    # Workers must share this process's resource tracker; one of their own
+    # would report every block they attached as leaked when they exit
+    resource_tracker.ensure_running()
+    try:
+        with ProcessPoolExecutor(max_workers=processes) as pool:
+            image = next(images, None)
+            while image is not None:
+                cost = job_bytes(image.width, image.height, options)
+                # Admission: wait for results until the page fits beside those in flight
+                while pending and (len(pending) >= 2 * processes
+                                   or (budget is not None and in_flight + cost > budget)):
+                    yield collect()
+                pending.append(_submit(pool, image, next_seed(), job_options(cost)) + (cost,))
+                in_flight += cost
+                image = next(images, None)
+            while pending:
+                yield collect()
+    finally:
+        # Jobs still pending when the caller stops early or a job fails
+        for _, blocks, _, _ in pending:
+            for block in blocks:
+                release(block)
@@ -0,0 +1,294 @@
+"""
+Lightweight render instrumentation.
+
+The rendering code wraps its stages in span() and reports sizes through
+count(). Nothing is recorded unless a RenderStats collector is active, so the
+calls cost a single ContextVar lookup in the default path and can stay in
+production code.
+
+A collector created with trace=True also keeps every span as an event and can
+export them in the Chrome trace format (open in https://ui.perfetto.dev or
+chrome://tracing). profiled() captures a cProfile run alongside it.
+"""
+
+import cProfile
+import functools
+import io
+import json
+import marshal
+import os
+import pstats
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+_active_stats = ContextVar('render_stats', default=None)
+
+class RenderStats:
+    """Accumulates wall time per stage and named counters for one render."""
+
+    def __init__(self, trace=False, parent=None):
+        self.stages = {}    # stage name -> [total seconds, calls]
+        self.counters = {}  # counter name -> total
+        self.annotations = {}  # name -> JSON-serialisable note, such as a latency budget
+        self.events = [] if trace else None  # (name, start, end, thread id)
+        self.parent = parent  # enclosing collector that also receives everything
+        self.lock = threading.Lock()  # render worker threads record concurrently
+        self.started = time.perf_counter()
+        self.finished = None
+
+    def add_time(self, name, seconds):
+        entry = self.stages.get(name)
+        if entry is None:
+            self.stages[name] = [seconds, 1]
+        else:
+            entry[0] += seconds
+            entry[1] += 1
+
+    def add_span(self, name, start, end):
+        """Record a finished span here and in every enclosing collector."""
+        stats = self
+        thread = None
+        while stats is not None:
+            with stats.lock:
+                stats.add_time(name, end - start)
+            if stats.events is not None:
+                if thread is None:
+                    thread = threading.get_ident()
+                stats.events.append((name, start, end, thread))
+            stats = stats.parent
+
+    def count(self, name, amount=1):
+        stats = self
+        while stats is not None:
+            with stats.lock:
+                stats.counters[name] = stats.counters.get(name, 0) + amount
+            stats = stats.parent
+
+    def annotate(self, name, value):
+        stats = self
+        while stats is not None:
+            with stats.lock:
+                stats.annotations[name] = value
+            stats = stats.parent
+
+    def chrome_trace(self):
+        """Return the recorded spans as a Chrome trace-event dict.
+
+        Spans become complete ("X") events; viewers nest them by time and
+        thread. apply_smudges contains each mark, which contains its
+        generator, blur and upsample spans (marks drawn on worker threads
+        sit on those threads' rows), and then recomposite, which contains a
+        composite span per layer and the finishing pass.
+        """
+        if self.events is None:
+            raise ValueError("RenderStats was created without trace=True")
+        pid = os.getpid()
+        thread_ids = {}
+        trace_events = []
+        for name, start, end, thread in self.events:
+            tid = thread_ids.setdefault(thread, len(thread_ids) + 1)
+            trace_events.append({
+                'name': name,
+                'cat': name.split(':', 1)[0],
+                'ph': 'X',
+                'ts': (start - self.started) * 1e6,
+                'dur': (end - start) * 1e6,
+                'pid': pid,
+                'tid': tid,
+            })
+        for thread, tid in thread_ids.items():
+            trace_events.append({
+                'name': 'thread_name', 'ph': 'M', 'pid': pid, 'tid': tid,
+                'args': {'name': 'render' if tid == 1 else f'worker {tid - 1}'},
+            })
+        return {
+            'traceEvents': trace_events,
+            'displayTimeUnit': 'ms',
+            'otherData': {'counters': dict(self.counters), 'annotations': dict(self.annotations)},
+        }
+
+    def chrome_trace_json(self):
+        """Return chrome_trace() encoded as UTF-8 JSON bytes."""
+        return json.dumps(self.chrome_trace()).encode('utf-8')
+
+    def as_dict(self):
+        """Return the collected numbers as a plain, JSON-serialisable report.
+
+        Stages named ``mark:<type>`` are also summarised under ``mark_types``
+        together with the ``mask_pixels:<type>`` counters.
+        """
+        end = self.finished if self.finished is not None else time.perf_counter()
+        mark_types = {}
+        for name, (seconds, calls) in self.stages.items():
+            if name.startswith('mark:'):
+                mark_type = name[len('mark:'):]
+                mark_types[mark_type] = {
+                    'count': calls,
+                    'seconds': seconds,
+                    'mask_pixels': self.counters.get('mask_pixels:' + mark_type, 0),
+                }
+        return {
+            'total_seconds': end - self.started,
+            'stages': {
+                name: {'seconds': seconds, 'calls': calls}
+                for name, (seconds, calls) in self.stages.items()
+                if not name.startswith('mark:')
+            },
+            'mark_types': mark_types,
+            'counters': dict(self.counters),
+            'annotations': dict(self.annotations),
+        }
+
+class _Span:
+    __slots__ = ('stats', 'name', 'start')
+
+    def __init__(self, stats, name):
+        self.stats = stats
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.stats.add_span(self.name, self.start, time.perf_counter())
+        return False
+
+class _NullSpan:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+_NULL_SPAN = _NullSpan()
+
+def current():
+    """Return the active RenderStats, or None when nothing is collecting."""
+    return _active_stats.get()
+
+def span(name):
+    """Time the enclosed block under name if a collector is active."""
+    stats = _active_stats.get()
+    if stats is None:
+        return _NULL_SPAN
+    return _Span(stats, name)
+
+def count(name, amount=1):
+    """Add amount to a named counter if a collector is active."""
+    stats = _active_stats.get()
+    if stats is not None:
+        stats.count(name, amount)
+
+def annotate(name, value):
+    """Attach a note (any JSON-serialisable value) to the report if a collector is active."""
+    stats = _active_stats.get()
+    if stats is not None:
+        stats.annotate(name, value)
+
+@contextmanager
+def activate(stats):
+    """Route spans and counters in the enclosed block to an existing collector."""
+    token = _active_stats.set(stats)
+    try:
+        yield stats
+    finally:
+        _active_stats.reset(token)
+
+@contextmanager
+def collect(trace=False):
+    """Collect stats for the enclosed block into a fresh RenderStats.
+
+    With trace=True every span is also kept for chrome_trace(). Collectors
+    nest: anything recorded here is also passed to an enclosing collector.
+    """
+    stats = RenderStats(trace=trace, parent=_active_stats.get())
+    with activate(stats):
+        yield stats
+    stats.finished = time.perf_counter()
+
+def traced(func):
+    """Decorator that times every call of func under its own name."""
+    name = func.__name__
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        stats = _active_stats.get()
+        if stats is None:
+            return func(*args, **kwargs)
+        with _Span(stats, name):
+            return func(*args, **kwargs)
+
+    return wrapper
+
+class ProfileCapture:
+    """A cProfile run, exportable as a .pstats file or a text summary."""
+
+    def __init__(self):
+        self.profiler = cProfile.Profile()
+        self.raw_stats = None
+
+    def finish(self):
+        self.profiler.create_stats()
+        self.raw_stats = self.profiler.stats
+
+    def pstats_bytes(self):
+        """Return the profile in the marshal format read by pstats and snakeviz."""
+        return marshal.dumps(self.raw_stats)
+
+    def dump(self, path):
+        with open(path, 'wb') as f:
+            f.write(self.pstats_bytes())
+
+    def summary(self, limit=25, sort='cumulative'):
+        """Return the top functions by sort key as printed by pstats."""
+        stream = io.StringIO()
+        stats = pstats.Stats(stream=stream)
+        stats.stats = self.raw_stats
+        stats.get_top_level_stats()
+        stats.sort_stats(sort).print_stats(limit)
+        return stream.getvalue()
+
+@contextmanager
+def profiled():
+    """Run the enclosed block under cProfile and yield its ProfileCapture.
+
+    The capture's stats are available once the block exits.
+    """
+    capture = ProfileCapture()
+    capture.profiler.enable()
+    try:
+        yield capture
+    finally:
+        capture.profiler.disable()
+        capture.finish()
+
+def format_report(report):
+    """Render a report dict from RenderStats.as_dict() as a fixed-width table."""
+    lines = [f"render: {report['total_seconds'] * 1000:.0f} ms"]
+    budget = report.get('annotations', {}).get('latency_budget')
+    if budget is not None:
+        lines[0] += (f" (budget {budget['budget_ms']:.0f} ms, estimated {budget['estimated_full_ms']:.0f} ms"
+                     f" at full quality, {budget['estimated_ms']:.0f} ms as rendered)")
+        for entry in budget['degraded']:
+            if entry['scale'] > 0:
+                lines.append(f"  degraded: #{entry['index'] + 1} {entry['kind']} at {entry['scale']:.0%} resolution")
+            else:
+                lines.append(f"  degraded: #{entry['index'] + 1} {entry['kind']} left out")
+    lines.append("")
+    lines.append(f"{'stage':24} {'ms':>8} {'calls':>6}")
+    stages = sorted(report['stages'].items(), key=lambda item: item[1]['seconds'], reverse=True)
+    for name, entry in stages:
+        lines.append(f"{name:24} {entry['seconds'] * 1000:8.1f} {entry['calls']:6d}")
+    if report['mark_types']:
+        lines.append("")
+        lines.append(f"{'mark type':24} {'ms':>8} {'count':>6} {'mask Mpx':>9}")
+        marks = sorted(report['mark_types'].items(), key=lambda item: item[1]['seconds'], reverse=True)
+        for name, entry in marks:
+            lines.append(f"{name:24} {entry['seconds'] * 1000:8.1f} {entry['count']:6d} "
+                         f"{entry['mask_pixels'] / 1e6:9.2f}")
+    return "\n".join(lines)
@@ -0,0 +1,133 @@
+"""
+Analytic rasterizer for feathered irregular shapes.
+
+Most marks are a stack of filled irregular shapes softened by one large
+Gaussian blur. feather() draws the same result straight from the shapes: each
+shape is a star-shaped outline around its centre (an ellipse whose radius is
+perturbed per angle, see aging_effects.irregular_outline), so the signed
+distance of a pixel to its edge comes from one polar lookup, and the blurred
+coverage of a straight edge at that distance is the Gaussian tail. Only the
+window the feathered shape reaches is evaluated, and since the result has no
+detail finer than the blur, callers evaluate it on the reduced synthesis canvas.
+"""
+
+import math
+
+import numpy as np
+
+# Logistic approximation of the standard normal CDF: Phi(x) ~ 1 / (1 + exp(-1.702 x)),
+# within 0.01 everywhere
+LOGISTIC_SCALE = 1.702
+
+# Shapes with a mean radius below this many blur sigmas are drawn as Gaussian
+# bumps; the edge model only holds for shapes well wider than the blur
+SMALL_SHAPE = 2.0
+
+# Distance, in sigmas, standing for "outside every shape"; also caps exp() arguments
+FAR = 60.0
+
+# Angles the outline is resampled at before smoothing
+OUTLINE_ANGLES = np.linspace(-math.pi, math.pi, 129)
+
+def _smooth_outline(angles, radii, angular_sigma):
+    """Resample an outline's radius factors at OUTLINE_ANGLES, Gaussian-smoothed over angle.
+
+    Radial distance keeps every wobble of the outline at full strength however
+    far out a pixel is, where the blur would have spread it; smoothing by the
+    angle the blur spans at the outline keeps wobbles from turning into rays.
+    """
+    samples = np.interp(OUTLINE_ANGLES[:-1], angles, radii, period=2 * math.pi)
+    frequencies = np.fft.rfftfreq(len(samples), 1.0 / len(samples))
+    smoothed = np.fft.irfft(np.fft.rfft(samples) * np.exp(-0.5 * (frequencies * angular_sigma) ** 2),
+                            len(samples))
+    return np.append(smoothed, smoothed[0])
+
+def feather(shapes, draw_size, sigma, scale=1.0):
+    """Rasterize filled shapes, each overwriting the ones before it, as if blurred by sigma.
+
+    The overwritten stack equals the sum over k of (fill of shape k - fill of
+    shape k-1) times the union of shapes k and above. The blur is linear, so
+    each union is feathered on its own: its edge distance is the smallest of
+    its shapes' distances.
+
+    Args:
+        shapes: List of (outline, fill). outline is (cx, cy, rx, ry,
+            rotation, angles, radii) in full-size pixels: centre, semi-axes,
+            rotation in radians, and the outline's radius factors at its
+            vertex angles (radians); fill is 0-255
+        draw_size: Side of the square canvas drawn, in pixels
+        sigma: Gaussian blur standard deviation, in full-size pixels
+        scale: draw_size over the full-size canvas side (see
+            aging_effects.synthesis_canvas)
+
+    Returns:
+        float32 array of draw_size x draw_size mask values
+    """
+    mask = np.zeros((draw_size, draw_size), dtype=np.float32)
+    # Over the union of the shapes seen so far, from the top: the distance to
+    # its edge in sigmas, the coverage of its small shapes, and its blurred coverage
+    distance = np.full((draw_size, draw_size), FAR, dtype=np.float32)
+    bumps = np.zeros((draw_size, draw_size), dtype=np.float32)
+    covered = np.zeros((draw_size, draw_size), dtype=np.float32)
+    top, left, bottom, right = draw_size, draw_size, 0, 0
+
+    for index in range(len(shapes) - 1, -1, -1):
+        (cx, cy, rx, ry, rotation, angles, radii), fill = shapes[index]
+        mean_radius = sum(radii) / len(radii)
+        radius = math.sqrt(rx * ry) * mean_radius
+        small = radius < SMALL_SHAPE * sigma
+        if rx * ry <= 0:
+            # A degenerate outline (a zero semi-axis on a tiny mask) has no area
+            x0 = y0 = x1 = y1 = 0
+        else:
+            if small:
+                # Blurred, a small shape is a Gaussian bump with the shape's mass,
+                # widened by the shape's own spread along each axis
+                var_x = sigma * sigma + (rx * mean_radius) ** 2 / 4.0
+                var_y = sigma * sigma + (ry * mean_radius) ** 2 / 4.0
+                reach = 3.0 * math.sqrt(max(var_x, var_y))
+            else:
+                reach = max(rx, ry) * max(radii) + 3.0 * sigma
+            x0 = max(0, math.floor((cx - reach + 0.5) * scale - 0.5))
+            y0 = max(0, math.floor((cy - reach + 0.5) * scale - 0.5))
+            x1 = min(draw_size, math.ceil((cx + reach + 0.5) * scale - 0.5) + 1)
+            y1 = min(draw_size, math.ceil((cy + reach + 0.5) * scale - 0.5) + 1)
+
+        if x0 < x1 and y0 < y1:
+            # Window pixel centres in full-size coordinates, in the shape's own frame
+            dx = ((np.arange(x0, x1, dtype=np.float32) + 0.5) / scale - 0.5 - cx)[np.newaxis, :]
+            dy = ((np.arange(y0, y1, dtype=np.float32) + 0.5) / scale - 0.5 - cy)[:, np.newaxis]
+            cos_rot = math.cos(rotation)
+            sin_rot = math.sin(rotation)
+            lx = dx * cos_rot + dy * sin_rot
+            ly = dy * cos_rot - dx * sin_rot
+
+            window = np.s_[y0:y1, x0:x1]
+            if small:
+                height = min(1.0, radius * radius / (2.0 * math.sqrt(var_x * var_y)))
+                bump = height * np.exp(lx * lx * (-0.5 / var_x) + ly * ly * (-0.5 / var_y))
+                bumps[window] += (1.0 - bumps[window]) * bump
+            else:
+                u = lx / rx
+                v = ly / ry
+                rho = np.hypot(u, v)
+                angular_sigma = sigma / radius if radius else 0.0
+                edge = np.interp(np.arctan2(v, u), OUTLINE_ANGLES,
+                                 _smooth_outline(angles, radii, angular_sigma)).astype(np.float32)
+                # Pixels per unit of rho along the ray through the pixel, which lies
+                # between the two semi-axes (the centre itself takes the smaller)
+                stretch = np.maximum(np.hypot(lx, ly) / np.maximum(rho, 1e-6), min(rx, ry))
+                # The blurred edge of a curved shape sits inside its outline, by
+                # about sigma^2 / 2R for a disc of radius R
+                inset = sigma * sigma / (2.0 * radius) if radius else 0.0
+                shape_distance = ((rho - edge) * stretch + inset) / sigma
+                np.minimum(distance[window], shape_distance, out=distance[window])
+            edges = 1.0 / (1.0 + np.exp(np.minimum(distance[window] * LOGISTIC_SCALE, FAR)))
+            covered[window] = 1.0 - (1.0 - edges) * (1.0 - bumps[window])
+            top, left = min(top, y0), min(left, x0)
+            bottom, right = max(bottom, y1), max(right, x1)
+
+        below = shapes[index - 1][1] if index else 0
+        if top < bottom:
+            mask[top:bottom, left:right] += (fill - below) * covered[top:bottom, left:right]
+    return mask
@@ -0,0 +1,95 @@
+"""
+Pre-rendered dot sprites for speckle effects.
+
+Ink splatter and dust are hundreds of small dots, and drawing them one
+draw call at a time keeps the whole effect in Python. Instead every dot shape
+is rendered once per radius into a small atlas of sprite variants, and stamp()
+splats a whole array of dots onto a mask with max-accumulation: the work per
+dot is a few numpy element operations, so 5,000 dots cost little more than 50.
+Sprites can carry the effect's blur, so the mask needs no full-size blur pass.
+"""
+
+import math
+import random
+
+import numpy as np
+from PIL import Image, ImageDraw, ImageFilter
+
+ATLAS_VARIANTS = 16   # Sprite variants per irregular shape and radius
+ATLAS_SEED = 2207     # Fixed, so every process builds the same sprites
+
+# (shape, radius, variants, blur) -> list of (dy, dx, weight) arrays. Render threads
+# may both build a missing atlas; they build the same one, so either result is kept.
+_atlases = {}
+
+def disc(draw, bbox, fill, rng):
+    """Sprite shape: a filled ellipse, as ImageDraw.ellipse draws it."""
+    draw.ellipse(bbox, fill=fill)
+
+def sprite_atlas(shape, radius, variants=1, blur=0):
+    """Return the sprites of a shape at an integer radius, rendering them on first use.
+
+    shape is called as shape(draw, bbox, fill, rng) for a bbox of the given
+    radius around the sprite centre, once per variant; blur is a Gaussian
+    blur radius applied to each sprite.
+
+    Returns:
+        List of (dy, dx, weight) arrays: the offsets from the dot centre of
+        the pixels each variant covers, and its coverage there (0-1]
+    """
+    key = (shape, radius, variants, blur)
+    sprites = _atlases.get(key)
+    if sprites is None:
+        rng = random.Random(f"{ATLAS_SEED}:{getattr(shape, '__name__', shape)}:{radius}")
+        # Irregular shapes wobble well past their bbox, and the blur spreads them further
+        reach = int(radius * 2.5) + 2 + math.ceil(3 * blur)
+        sprites = []
+        for _ in range(variants):
+            sprite = Image.new('L', (2 * reach + 1, 2 * reach + 1), 0)
+            shape(ImageDraw.Draw(sprite), [reach - radius, reach - radius, reach + radius, reach + radius],
+                  255, rng)
+            if blur:
+                sprite = sprite.filter(ImageFilter.GaussianBlur(blur))
+            coverage = np.asarray(sprite)
+            dy, dx = np.nonzero(coverage)
+            sprites.append((dy - reach, dx - reach, coverage[dy, dx] / np.float32(255)))
+        _atlases[key] = sprites
+    return sprites
+
+def stamp(mask, xs, ys, radii, values, shape=disc, variants=1, blur=0, rng=np.random):
+    """Stamp dots onto a uint8 mask in place, keeping the maximum where dots overlap.
+
+    Args:
+        mask: 2-D uint8 array
+        xs, ys, radii, values: Integer arrays, one entry per dot: centre,
+            radius and opacity
+        shape: Sprite shape (see sprite_atlas)
+        variants: Number of sprite variants; each dot picks one from rng
+        blur: Gaussian blur radius the sprites are rendered with
+        rng: np.random or a RandomState
+    """
+    xs, ys, radii, values = (np.asarray(a, dtype=np.intp) for a in (xs, ys, radii, values))
+    if len(xs) == 0:
+        return mask
+    choices = rng.randint(variants, size=len(xs)) if variants > 1 else np.zeros(len(xs), dtype=np.intp)
+    # One offset table for every (radius, variant) sprite in use, so all dots
+    # expand to pixels in a single vectorised step
+    keys, group = np.unique(radii * variants + choices, return_inverse=True)
+    tables = [sprite_atlas(shape, int(key // variants), variants, blur)[int(key % variants)] for key in keys]
+    lengths = np.array([len(dy) for dy, _, _ in tables])
+    starts = np.concatenate(([0], np.cumsum(lengths)[:-1]))
+    all_dy = np.concatenate([dy for dy, _, _ in tables])
+    all_dx = np.concatenate([dx for _, dx, _ in tables])
+    all_weight = np.concatenate([weight for _, _, weight in tables])
+
+    counts = lengths[group]
+    dot = np.repeat(np.arange(len(xs)), counts)
+    within = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+    pixel = starts[group][dot] + within
+    yy = ys[dot] + all_dy[pixel]
+    xx = xs[dot] + all_dx[pixel]
+    height, width = mask.shape
+    inside = (yy >= 0) & (yy < height) & (xx >= 0) & (xx < width)
+    stamped = values[dot][inside] * all_weight[pixel][inside] + 0.5
+    np.maximum.at(mask, (yy[inside], xx[inside]), stamped.astype(mask.dtype))
+    return mask